@@ -0,0 +1,109 @@
+'''
+
+    We aim to measure what authenticating a request and holding it to its token's rate limit costs with a large registry: loading the registry, looking a token up, counting a request in the shared rate limits, and the whole of authentication as a request sees it. Lookups are compared against searching a list of tokens, which is how tokens used to be checked.
+
+    Several worker processes then count requests against the same limits at once, to measure the throughput of the shared database and check that the workers never let more requests through than the limit allows between them.
+
+    Usage: python benchmarks/authentication_cost.py [--tokens N] [--requests N] [--workers N]
+
+'''
+
+import argparse, json, multiprocessing, os, sys, tempfile, time
+
+# Define the directory of the server, which must be importable before we can import it.
+server_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server")
+
+# Time a function over many calls, returning the mean in microseconds.
+def measure(function, arguments):
+
+    started_at = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+
+    return (time.perf_counter() - started_at) / len(arguments) * 1e6
+
+# Count requests against the limits of a set of keys from a worker process, returning how many were let through and how long they took.
+def hammer(path, keys, limit, requests):
+
+    from ratelimit import RateLimits
+
+    rate_limits = RateLimits(path)
+    allowed = 0
+
+    started_at = time.perf_counter()
+    for index in range(requests):
+        allowed += rate_limits.acquire(keys[index % len(keys)], limit, 3600) is None
+
+    return allowed, time.perf_counter() - started_at
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Measure the cost of authentication and rate limiting with a large registry of tokens.")
+    parser.add_argument("--tokens", type=int, default=100000, help="How many tokens to register.")
+    parser.add_argument("--requests", type=int, default=20000, help="How many requests to time each operation over.")
+    parser.add_argument("--workers", type=int, default=4, help="How many processes count requests against the shared rate limits at once.")
+    arguments = parser.parse_args()
+
+    # Our configuration is read from the environment when the server is imported, and databases are created relative to the working directory.
+    directory = tempfile.mkdtemp(prefix="monitor-authentication-")
+    os.chdir(directory)
+
+    tokens = ["token_" + str(index) + "_" + os.urandom(8).hex() for index in range(arguments.tokens)]
+    os.environ["MONITOR_TOKENS_PATH"] = os.path.join(directory, "tokens.json")
+
+    # Every token is limited, so every request is counted, but no more generously than the benchmark ever reaches.
+    os.environ["MONITOR_TOKEN_RATE_LIMIT"] = "1000000000 per hour"
+
+    with open(os.environ["MONITOR_TOKENS_PATH"], "w") as file:
+        json.dump(tokens, file)
+
+    sys.path.insert(0, server_directory)
+    import tokens as registry_module
+    from ratelimit import RateLimits
+
+    # Measure loading the registry.
+    started_at = time.perf_counter()
+    registry = registry_module.Registry()
+    print("Loaded %d tokens in %.1f ms." % (len(registry), (time.perf_counter() - started_at) * 1e3))
+
+    samples = [tokens[index * 7919 % len(tokens)] for index in range(arguments.requests)]
+    unknown = ["unknown_" + str(index) for index in range(arguments.requests)]
+    listed = list(tokens)
+
+    print()
+    print("%-40s %12s" % ("operation", "us/request"))
+    print("%-40s %12.2f" % ("registry lookup, registered token", measure(registry.lookup, samples)))
+    print("%-40s %12.2f" % ("registry lookup, unknown token", measure(registry.lookup, unknown)))
+
+    # Searching a list costs time in proportion to its length, so only a sample of lookups is needed.
+    print("%-40s %12.2f" % ("list search, registered token", measure(lambda token: token in listed, samples[:200])))
+    print("%-40s %12.2f" % ("list search, unknown token", measure(lambda token: token in listed, unknown[:200])))
+
+    # Measure counting requests, both spread across every token and all against the same one.
+    rate_limits = RateLimits(os.path.join(directory, "ratelimits.sqlite"))
+    keys = [registry.lookup(token)["key"] + ":report_cpu" for token in samples]
+
+    print("%-40s %12.2f" % ("rate limit, spread across tokens", measure(lambda key: rate_limits.acquire(key, 60, 3600), keys)))
+    print("%-40s %12.2f" % ("rate limit, one token", measure(lambda key: rate_limits.acquire(key, 10 ** 9, 3600), [keys[0]] * arguments.requests)))
+
+    # Measure the whole of authentication as a request sees it, through the server.
+    import main
+
+    with main.monitor.test_request_context("/api/v1/report_cpu", method="POST"):
+        print("%-40s %12.2f" % ("authenticate, lookup and rate limit", measure(lambda token: main.authenticate({"token": token}), samples)))
+
+    # Count requests from several processes at once against a handful of shared limits, each of which should let exactly its limit through between them.
+    limit = 1000
+    shared_keys = ["shared_" + str(index) for index in range(10)]
+    requests = max(arguments.requests // arguments.workers, 2 * limit * len(shared_keys) // arguments.workers)
+
+    with multiprocessing.get_context("spawn").Pool(arguments.workers, initializer=sys.path.insert, initargs=(0, server_directory)) as pool:
+        results = pool.starmap(hammer, [(os.path.join(directory, "shared.sqlite"), shared_keys, limit, requests)] * arguments.workers)
+
+    allowed = sum(result[0] for result in results)
+    elapsed = max(result[1] for result in results)
+
+    print()
+    print("%d workers counted %d requests in %.2f s, %.0f requests/s between them." % (arguments.workers, requests * arguments.workers, elapsed, requests * arguments.workers / elapsed))
+    print("They let %d through against limits that allow %d in total." % (allowed, limit * len(shared_keys)))
@@ -0,0 +1,60 @@
+'''
+
+    We aim to measure what the client's collectors cost the host they run on: the CPU time each takes per sample, what that comes to as a share of one core at the reporting interval, and the memory the agent holds.
+
+    Usage: python benchmarks/client_collectors.py [--samples N] [--interval SECONDS]
+
+'''
+
+import argparse, os, resource, sys, time
+
+# Import the collectors from the client.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "client"))
+from routines.cpu import CPU
+from routines.memory import Memory
+from routines.net import Network
+from routines.disks import Disks
+
+# Retrieve the resident set size of this process, in bytes.
+def resident_size():
+
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Measure the cost of the client's collectors.")
+    parser.add_argument("--samples", type=int, default=2000, help="How many samples each collector takes.")
+    parser.add_argument("--interval", type=float, default=1.0, help="The reporting interval, in seconds, to express the cost as a share of one core at.")
+    arguments = parser.parse_args()
+
+    resident_before = resident_size()
+    collectors = {"cpu": CPU(), "memory": Memory(), "net": Network(), "disks": Disks()}
+
+    # Take a sample from each collector first, so that files are opened and buffers are grown before we measure.
+    for collector in collectors.values():
+        collector.collect()
+
+    print("%-8s %14s %14s %12s" % ("collector", "cpu us/sample", "wall us/sample", "% of a core"))
+    total = 0
+
+    for name, collector in collectors.items():
+
+        # Measure the CPU time the process spends, which counts the time the kernel spends generating the pseudo-files on our behalf.
+        cpu_started_at = time.process_time()
+        wall_started_at = time.perf_counter()
+
+        for _ in range(arguments.samples):
+            collector.collect()
+
+        cpu_time = (time.process_time() - cpu_started_at) / arguments.samples
+        wall_time = (time.perf_counter() - wall_started_at) / arguments.samples
+        total += cpu_time
+
+        print("%-8s %14.1f %14.1f %11.4f%%" % (name, cpu_time * 1e6, wall_time * 1e6, cpu_time / arguments.interval * 100))
+
+    print("%-8s %14.1f %14s %11.4f%%" % ("total", total * 1e6, "", total / arguments.interval * 100))
+
+    resident_after = resident_size()
+    print("Resident memory is %.1f MiB, of which the collectors account for %.1f KiB, peaking at %.1f MiB." % (resident_after / 2 ** 20, (resident_after - resident_before) / 2 ** 10, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10))
@@ -0,0 +1,155 @@
+'''
+
+    We aim to measure how much the compression of stored values saves on a real database, and what it costs to decode them, so that the level and dictionary can be chosen from numbers rather than guesses.
+
+    Every JSON value is compressed without a dictionary, with the dictionary of the current format and with a dictionary trained on the database itself, which shows whether the current dictionary is worth replacing with a new version. Values with their own binary encoding, such as history chunks, are left out. The database is only read, but the key-value database can only be opened by one process at a time, so the server must be stopped.
+
+    Usage: python benchmarks/compression_ratio.py [PATH ...] [--level N] [--dictionary-size N] [--sample N] [--print-dictionary]
+
+'''
+
+import argparse, collections, dbm, json, os, random, re, sys, time, zlib
+
+# Import the compression of stored values from the server.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import compression, config
+
+# Define the fragments of JSON a dictionary is trained from: keys alongside their colon, strings, and the digits numbers start with, such as the leading digits of a timestamp.
+fragment_pattern = re.compile(rb'"(?:[^"\\]|\\.)*"(?:: )?|-?\d{2,4}')
+
+# Define the group of a key, such as the section of a record or the segment of an audit log.
+def group_of(key):
+
+    parts = key.split(":")
+
+    if len(parts) >= 3 and parts[1] == "audit":
+        return "audit segment"
+
+    if len(parts) == 2 and parts[1] == "audit":
+        return "audit index"
+
+    if len(parts) >= 3:
+        return "history index"
+
+    return parts[-1] if len(parts) == 2 else "other"
+
+# Compress a value as raw deflate with an optional dictionary, the same way stored values are.
+def deflate(data, level, dictionary=None):
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary) if dictionary else zlib.compressobj(level, zlib.DEFLATED, -15)
+    return 1 + len(compressor.compress(data) + compressor.flush())
+
+# Train a dictionary from values, keeping the fragments that would save the most bytes in total. Matches near the end of a dictionary are the cheapest to refer to, so the most valuable fragments come last.
+def train(values, size):
+
+    counts = collections.Counter(fragment for value in values for fragment in fragment_pattern.findall(value))
+    fragments = sorted((fragment for fragment, count in counts.items() if count > 1), key=lambda fragment: counts[fragment] * len(fragment), reverse=True)
+
+    chosen = []
+    total = 0
+
+    for fragment in fragments:
+
+        if total + len(fragment) > size:
+            continue
+
+        chosen.append(fragment)
+        total += len(fragment)
+
+    return b"".join(reversed(chosen))
+
+# Time decoding a value, in microseconds.
+def time_decode(function, data, repeat):
+
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        function(data)
+
+    return (time.perf_counter() - started_at) / repeat * 1e6
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Measure the compression of stored values on a real database.")
+    parser.add_argument("paths", nargs="*", default=[config.database_path], help="The databases to read, such as every shard.")
+    parser.add_argument("--level", type=int, default=config.compression_level or 6, help="The level to compress values at.")
+    parser.add_argument("--dictionary-size", type=int, default=4096, help="The size of the dictionary to train, up to 32768 bytes.")
+    parser.add_argument("--sample", type=int, default=2000, help="How many values to train the dictionary on and time decoding with.")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to decode each sampled value.")
+    parser.add_argument("--print-dictionary", action="store_true", help="Print the trained dictionary, to adopt it as a new version of the format.")
+    arguments = parser.parse_args()
+
+    # Read every JSON value as it would be serialized before compression, alongside how it's currently stored.
+    values = []
+    stored_bytes = 0
+
+    for path in arguments.paths:
+
+        with dbm.open(path, "r") as database:
+
+            for key in database.keys():
+
+                stored = database[key]
+
+                try:
+                    data = compression.decompress(stored)
+                    json.loads(data)
+
+                except (ValueError, zlib.error):
+                    continue
+
+                values.append((group_of(key.decode() if isinstance(key, bytes) else key), data))
+                stored_bytes += len(stored)
+
+    if not values:
+        sys.exit("There are no JSON values in " + ", ".join(arguments.paths) + ".")
+
+    # Train a dictionary on a sample of the values.
+    generator = random.Random(0)
+    sample = generator.sample(values, min(arguments.sample, len(values)))
+    trained = train([data for group, data in sample], arguments.dictionary_size)
+
+    # Measure the size of each group of values under every way of compressing them. Values only count as compressed if that makes them smaller, as when they're stored.
+    methods = {
+
+        "none": lambda data: len(data),
+        "no dictionary": lambda data: min(len(data), deflate(data, arguments.level)),
+        "current": lambda data: min(len(data), deflate(data, arguments.level, compression.dictionaries[compression.version])),
+        "trained": lambda data: min(len(data), deflate(data, arguments.level, trained))
+
+    }
+
+    sizes = collections.defaultdict(lambda: dict.fromkeys(methods, 0))
+    counts = collections.Counter()
+
+    for group, data in values:
+
+        counts[group] += 1
+        for method, measure in methods.items():
+            sizes[group][method] += measure(data)
+
+    print("%-16s %8s %12s %12s %12s %12s" % ("group", "values", "json B", "no dict", "current", "trained"))
+
+    for group in sorted(sizes, key=lambda group: -sizes[group]["none"]):
+
+        size = sizes[group]
+        print("%-16s %8d %12d %11.2fx %11.2fx %11.2fx" % (group, counts[group], size["none"], size["none"] / size["no dictionary"], size["none"] / size["current"], size["none"] / size["trained"]))
+
+    totals = {method: sum(size[method] for size in sizes.values()) for method in methods}
+    print("%-16s %8d %12d %11.2fx %11.2fx %11.2fx" % ("total", len(values), totals["none"], totals["none"] / totals["no dictionary"], totals["none"] / totals["current"], totals["none"] / totals["trained"]))
+    print("These values currently take %d bytes as stored." % stored_bytes)
+
+    # Time decoding the sample both as plain JSON and compressed with the current dictionary, as the storage layer does when a value isn't in memory.
+    plain_time = 0
+    compressed_time = 0
+
+    for group, data in sample:
+
+        compressed = compression.compress(data, arguments.level)
+        plain_time += time_decode(json.loads, data, arguments.repeat)
+        compressed_time += time_decode(compression.loads, compressed, arguments.repeat)
+
+    print("Decoding takes %.2fus per value as plain JSON and %.2fus compressed, %.2fx as long." % (plain_time / len(sample), compressed_time / len(sample), compressed_time / plain_time))
+
+    if arguments.print_dictionary:
+        print(repr(trained))
@@ -0,0 +1,65 @@
+'''
+
+    We aim to compare the JSON and binary encodings of reports by the bytes each puts on the wire and the time the server spends decoding each.
+
+    Usage: python benchmarks/ingest_format.py [--iterations N]
+
+'''
+
+import argparse, json, os, sys, timeit
+
+# Import the binary encoding from the server.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import binary
+
+# Define a representative report of each kind, including a batch from a host with several interfaces and mounting points.
+interface = {"name": "eth0", "ipv6": "fe80::a00:27ff:fe4e:66a1", "ipv4": "192.168.1.24", "mac": "08:00:27:4e:66:a1"}
+mounting_point = {"path": "/var/lib/docker", "used": 41234567168, "available": 215678930944}
+cpu = {"threads": 16, "cores": 8, "model": "AMD Ryzen 7 5800X 8-Core Processor", "load": 0.37}
+memory = {"available": 33554432000, "used": 12884901888, "swap": {"available": 8589934592, "used": 1048576}}
+
+reports = {
+
+    "latency": {"token": "development_key_1", "requested_at": 1760000000},
+    "interface": dict(interface, token="development_key_1"),
+    "cpu": dict(cpu, token="development_key_1"),
+    "memory": dict(memory, token="development_key_1"),
+    "mounting_point": dict(mounting_point, token="development_key_1"),
+    "batch": {
+
+        "token": "development_key_1",
+        "collected_at": 1759999940.25,
+        "latency": {"requested_at": 1760000000},
+        "echo": {"ping": "AMQ1ZGJ0dxgNsnX3ZqIe0TYNOWrvh2ZJGPXh1z-oPNE="},
+        "cpu": cpu,
+        "memory": memory,
+        "interfaces": [dict(interface, name="veth" + str(index)) for index in range(24)],
+        "mounting_points": [dict(mounting_point, path="/mnt/volume" + str(index)) for index in range(12)]
+
+    }
+
+}
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Compare the JSON and binary encodings of reports.")
+    parser.add_argument("--iterations", type=int, default=100000, help="How many times to decode each report.")
+    arguments = parser.parse_args()
+
+    print("%-16s %10s %10s %14s %14s %8s" % ("report", "json B", "binary B", "json us/op", "binary us/op", "speedup"))
+
+    for kind, report in reports.items():
+
+        # Encode the report as a client would.
+        encoded_json = json.dumps(report).encode()
+        encoded_binary = binary.encode(report, kind)
+
+        # Ensure both encodings decode to the same body, so we're comparing like with like.
+        assert binary.decode(encoded_binary, kind) == json.loads(encoded_json), kind
+
+        # Time decoding each encoding.
+        json_time = timeit.timeit(lambda: json.loads(encoded_json), number=arguments.iterations) / arguments.iterations
+        binary_time = timeit.timeit(lambda: binary.decode(encoded_binary, kind), number=arguments.iterations) / arguments.iterations
+
+        print("%-16s %10d %10d %14.2f %14.2f %7.2fx" % (kind, len(encoded_json), len(encoded_binary), json_time * 1e6, binary_time * 1e6, json_time / binary_time))
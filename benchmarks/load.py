@@ -0,0 +1,241 @@
+'''
+
+    We aim to measure how many reports per second the server can take, and how its latency holds up, by simulating many concurrent clients against the application in-process.
+
+    Each simulated client sends a mix of the five report endpoints on behalf of tokens drawn from a shared pool. The results, including the time spent loading, serializing and writing records, are saved as JSON so that runs can be compared across commits.
+
+    Usage: python benchmarks/load.py [--clients N] [--requests N] [--tokens N] [--backend dbm|sqlite] [--shards N] [--ingest-mode sync|queue] [--output PATH]
+
+'''
+
+import argparse, json, os, random, subprocess, sys, tempfile, threading, time
+
+# Define the directory of the server, which must be importable before we can import it.
+server_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server")
+
+# Define the mix of reports a client sends, as pairs of an endpoint and its relative weight.
+mix = (
+
+    ("report_latency", 20),
+    ("report_network_interface", 25),
+    ("report_cpu", 20),
+    ("report_memory", 20),
+    ("report_disk_mounting_point", 15)
+
+)
+
+# Build the body of a report to an endpoint for a token.
+def build_report(endpoint, token, generator):
+
+    if endpoint == "report_latency":
+        return {"token": token, "requested_at": int(time.time()) - 1}
+
+    if endpoint == "report_network_interface":
+        return {"token": token, "name": generator.choice(("eth0", "eth1", "lo", "docker0", "veth" + str(generator.randrange(8)))), "ipv6": None, "ipv4": "10.0." + str(generator.randrange(256)) + "." + str(generator.randrange(256)), "mac": "02:42:ac:11:00:02"}
+
+    if endpoint == "report_cpu":
+        return {"token": token, "threads": 16, "cores": 8, "model": "AMD Ryzen 7 5800X 8-Core Processor", "load": generator.random() * 8}
+
+    if endpoint == "report_memory":
+        return {"token": token, "available": 33554432000, "used": generator.randrange(33554432000), "swap": {"available": 8589934592, "used": generator.randrange(8589934592)}}
+
+    return {"token": token, "path": generator.choice(("/", "/home", "/var/lib/docker", "/mnt/volume" + str(generator.randrange(4)))), "used": generator.randrange(2 ** 40), "available": 2 ** 40}
+
+# Retrieve a percentile of sorted values.
+def percentile(values, fraction):
+
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+# Summarize the latencies of a set of requests, in milliseconds.
+def summarize(latencies, errors):
+
+    latencies = sorted(latencies)
+    return {
+
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None
+
+    }
+
+# Retrieve the combined size of every file in a directory, which covers every shard and any write-ahead logs.
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+
+# Define a class to represent the time spent in each phase of handling a record, measured by wrapping the functions that make up each phase.
+class Phases:
+
+    def __init__(self):
+        self.timings = {}
+
+    # Replace a function of a module or class with one that records how long each call takes under a phase.
+    def wrap(self, owner, name, phase):
+
+        function = getattr(owner, name)
+        timings = self.timings.setdefault(phase, [])
+
+        def timed(*arguments, **keywords):
+
+            started_at = time.perf_counter()
+            try:
+                return function(*arguments, **keywords)
+
+            finally:
+                timings.append(time.perf_counter() - started_at)
+
+        setattr(owner, name, timed)
+
+    def summarize(self):
+        return {phase: {"calls": len(timings), "total_s": sum(timings), "mean_us": sum(timings) / len(timings) * 1e6 if timings else None} for phase, timings in self.timings.items()}
+
+# Retrieve the commit the benchmark ran against, if it's run from a git checkout.
+def current_commit():
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=server_directory, capture_output=True, text=True, check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Simulate concurrent clients reporting to the server.")
+    parser.add_argument("--clients", type=int, default=16, help="How many clients send reports at once.")
+    parser.add_argument("--requests", type=int, default=500, help="How many reports each client sends.")
+    parser.add_argument("--tokens", type=int, default=1000, help="How many distinct tokens reports are sent for.")
+    parser.add_argument("--backend", default="dbm", choices=("dbm", "sqlite"), help="The storage engine to store records in.")
+    parser.add_argument("--shards", type=int, default=1, help="How many databases to partition records across.")
+    parser.add_argument("--ingest-mode", default="sync", choices=("sync", "queue"), help="Whether reports are written before responding or queued for the writer.")
+    parser.add_argument("--directory", help="The directory to keep the databases in, which defaults to a new temporary directory.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the reports that are generated.")
+    parser.add_argument("--output", default="load.json", help="The path to save the results to.")
+    arguments = parser.parse_args()
+
+    output = os.path.abspath(arguments.output)
+    directory = os.path.abspath(arguments.directory or tempfile.mkdtemp(prefix="monitor-load-"))
+
+    # Our configuration is read from the environment when the server is imported, and databases are created relative to the working directory.
+    os.environ["MONITOR_BACKEND"] = arguments.backend
+    os.environ["MONITOR_SHARDS"] = str(arguments.shards)
+    os.environ["MONITOR_INGEST_MODE"] = arguments.ingest_mode
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+
+    # Register every token, without rate limits getting in the way of the measurement.
+    tokens = ["load_" + str(index) for index in range(arguments.tokens)]
+    os.environ["MONITOR_TOKENS_PATH"] = os.path.join(directory, "tokens.json")
+    os.environ["MONITOR_TOKEN_RATE_LIMIT"] = ""
+
+    with open(os.environ["MONITOR_TOKENS_PATH"], "w") as file:
+        json.dump(tokens, file)
+
+    sys.path.insert(0, server_directory)
+    import main, backends, ingest, sqlite_backend, storage
+
+    main.limiter.enabled = False
+
+    # Measure loading sections, serializing them and writing them to the database, for whichever storage engine is in use.
+    phases = Phases()
+    phases.wrap(backends.KeyValueBackend, "load", "load")
+    phases.wrap(storage.Storage, "put", "serialize")
+    phases.wrap(storage.Storage, "write", "write")
+    phases.wrap(sqlite_backend.SQLiteBackend, "load", "load")
+    phases.wrap(sqlite_backend, "row_from_section", "serialize")
+    phases.wrap(sqlite_backend.SQLiteBackend, "commit", "write")
+
+    # Create the storage engine before measuring anything, so the first requests don't pay for it.
+    backend = backends.get_backend()
+    size_before = directory_size(directory)
+
+    endpoints = [endpoint for endpoint, weight in mix]
+    weights = [weight for endpoint, weight in mix]
+    results = {endpoint: {"latencies": [], "errors": 0} for endpoint in endpoints}
+    results_lock = threading.Lock()
+
+    # Send reports as a single client, keeping the latencies to merge once we're done.
+    def client(index):
+
+        generator = random.Random(arguments.seed * 1000003 + index)
+        test_client = main.monitor.test_client()
+        latencies = {endpoint: [] for endpoint in endpoints}
+        errors = {endpoint: 0 for endpoint in endpoints}
+
+        for _ in range(arguments.requests):
+
+            endpoint = generator.choices(endpoints, weights)[0]
+            body = build_report(endpoint, generator.choice(tokens), generator)
+
+            started_at = time.perf_counter()
+            response = test_client.post("/api/v1/" + endpoint, json=body)
+            latencies[endpoint].append(time.perf_counter() - started_at)
+
+            if response.status_code not in (200, 202):
+                errors[endpoint] += 1
+
+        with results_lock:
+
+            for endpoint in endpoints:
+                results[endpoint]["latencies"] += latencies[endpoint]
+                results[endpoint]["errors"] += errors[endpoint]
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(arguments.clients)]
+
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - started_at
+
+    # Wait for every queued report to be written, then for everything to reach the database, so the growth of the database is complete.
+    if arguments.ingest_mode == "queue":
+        ingest.get_writer().close()
+
+    drained = time.perf_counter() - started_at
+    backend.flush()
+    size_after = directory_size(directory)
+
+    total = sum(len(result["latencies"]) for result in results.values())
+    report = {
+
+        "commit": current_commit(),
+        "started_at": time.time() - drained,
+        "settings": {key: value for key, value in vars(arguments).items() if key not in ("output", "directory")},
+        "elapsed_s": elapsed,
+        "drained_s": drained,
+        "throughput_rps": total / elapsed,
+        "overall": summarize([latency for result in results.values() for latency in result["latencies"]], sum(result["errors"] for result in results.values())),
+        "endpoints": {endpoint: summarize(result["latencies"], result["errors"]) for endpoint, result in results.items()},
+        "phases": phases.summarize(),
+        "database": {"bytes_before": size_before, "bytes_after": size_after, "growth_bytes": size_after - size_before}
+
+    }
+
+    with open(output, "w") as file:
+        json.dump(report, file, indent=4)
+
+    # Print a summary of the run.
+    print("%d requests in %.2fs: %.0f requests per second" % (total, elapsed, report["throughput_rps"]))
+    print("%-28s %8s %7s %9s %9s %9s" % ("endpoint", "requests", "errors", "p50 ms", "p95 ms", "p99 ms"))
+
+    for endpoint, summary in list(report["endpoints"].items()) + [("overall", report["overall"])]:
+
+        if summary["requests"]:
+            print("%-28s %8d %7d %9.2f %9.2f %9.2f" % (endpoint, summary["requests"], summary["errors"], summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]))
+
+    for phase, summary in report["phases"].items():
+
+        if summary["calls"]:
+            print("%-10s %8d calls %10.3fs total %10.1fus mean" % (phase, summary["calls"], summary["total_s"], summary["mean_us"]))
+
+    print("Database grew by %d bytes. Results were saved to %s." % (report["database"]["growth_bytes"], output))
@@ -0,0 +1,172 @@
+'''
+
+    We aim to measure what holding a record's sections as typed sections costs against holding them as the dictionaries they're stored as: the memory each record's sections take, creating a new record's default sections, and decoding and encoding a loaded record.
+
+    Typed sections are also measured against a layout that packs the numeric fields of each section into an array of doubles, which is how the server's sections would hold them if they were stored in arrays.
+
+    Usage: python benchmarks/record_model.py [--records N] [--iterations N]
+
+'''
+
+import argparse, array, copy, json, math, os, sys, timeit, tracemalloc
+
+# Import the server's typed sections.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import sections
+
+# Define the default sections as they were deep copied for every new record, to measure against.
+default_sections = {
+
+    "metadata": {"created_at": None, "updated_at": None},
+    "cpu": {"threads": None, "cores": None, "model": None, "load": None},
+    "memory": {"available": None, "used": None, "swap": None},
+    "interfaces": {},
+    "mounting_points": {}
+
+}
+
+# Build the stored sections of a typical record.
+def stored_record(index):
+
+    return {
+
+        "metadata": {"created_at": 1700000000.0 + index, "updated_at": 1700000060.0 + index},
+        "cpu": {"threads": 16, "cores": 8, "model": "AMD Ryzen 7 5800X 8-Core Processor", "load": 1.25 + index % 7},
+        "memory": {"available": 17179869184 + index, "used": 8589934592 + index, "swap": {"available": 2147483648, "used": 1048576 + index}},
+        "interfaces": {name: {"name": name, "ipv6": "fe80::1", "ipv4": "10.0.0." + str(index % 250), "mac": "00:11:22:33:44:55", "seen_at": 1700000060.0 + index} for name in ("lo", "eth0")},
+        "mounting_points": {path: {"path": path, "used": 107374182400 + index, "available": 429496729600 - index, "seen_at": 1700000060.0 + index} for path in ("/", "/home", "/boot")}
+
+    }
+
+# Define the numeric fields of each section that the array layout packs into an array of doubles, and the fields it keeps as attributes. Arrays of doubles can't hold None or tell integers from floats, so a missing value is stored as NaN and integer fields are converted back as they're encoded.
+array_fields = {
+
+    "metadata": (("created_at", "updated_at"), ()),
+    "cpu": (("threads", "cores", "load"), ("model",)),
+    "memory": (("available", "used", "swap_available", "swap_used"), ()),
+    "mounting_points": (("used", "available", "seen_at"), ("path",))
+
+}
+
+integer_fields = {"threads", "cores", "available", "used", "swap_available", "swap_used"}
+
+# Define a class to represent a section in the array layout, with its numeric fields in an array and any others as attributes.
+class ArraySection:
+
+    __slots__ = ("values", "numbers")
+
+    def __init__(self, values, numbers):
+
+        self.values = values
+        self.numbers = numbers
+
+# Decode a section into the array layout.
+def decode_array_section(name, value):
+
+    numbers, others = array_fields[name]
+    return ArraySection(tuple(value[field] for field in others), array.array("d", [math.nan if value[field] is None else value[field] for field in numbers]))
+
+# Encode a section in the array layout back into its stored layout.
+def encode_array_section(name, section):
+
+    numbers, others = array_fields[name]
+    value = dict(zip(others, section.values))
+
+    for field, number in zip(numbers, section.numbers):
+        value[field] = None if math.isnan(number) else int(number) if field in integer_fields else number
+
+    return value
+
+# Decode every section of a stored record into the array layout. Swap is flattened into memory, and interfaces have no numeric fields but when they were seen, so they're held as typed sections.
+def decode_arrays(stored):
+
+    memory = stored["memory"]
+
+    return {
+
+        "metadata": decode_array_section("metadata", stored["metadata"]),
+        "cpu": decode_array_section("cpu", stored["cpu"]),
+        "memory": decode_array_section("memory", {"available": memory["available"], "used": memory["used"], "swap_available": memory["swap"]["available"], "swap_used": memory["swap"]["used"]}),
+        "interfaces": {key: sections.Interface.decode(entry) for key, entry in stored["interfaces"].items()},
+        "mounting_points": {key: decode_array_section("mounting_points", entry) for key, entry in stored["mounting_points"].items()}
+
+    }
+
+def encode_arrays(record):
+
+    memory = encode_array_section("memory", record["memory"])
+
+    return {
+
+        "metadata": encode_array_section("metadata", record["metadata"]),
+        "cpu": encode_array_section("cpu", record["cpu"]),
+        "memory": {"available": memory["available"], "used": memory["used"], "swap": {"available": memory["swap_available"], "used": memory["swap_used"]}},
+        "interfaces": {key: entry.encode() for key, entry in record["interfaces"].items()},
+        "mounting_points": {key: encode_array_section("mounting_points", entry) for key, entry in record["mounting_points"].items()}
+
+    }
+
+# Create a new record's default sections in the array layout.
+def default_arrays():
+
+    return {
+
+        "metadata": ArraySection((), array.array("d", [math.nan] * 2)),
+        "cpu": ArraySection((None,), array.array("d", [math.nan] * 3)),
+        "memory": ArraySection((), array.array("d", [math.nan] * 4)),
+        "interfaces": {},
+        "mounting_points": {}
+
+    }
+
+# Decode every section of a stored record, either into typed sections or into copies of its dictionaries, which is what the storage layer's cache requires of records that change their sections.
+def decode_typed(stored):
+    return {name: sections.decode(name, value) for name, value in stored.items()}
+
+def decode_dictionaries(stored):
+    return copy.deepcopy(stored)
+
+# Encode every typed section back into its stored layout. Dictionaries are stored as they are.
+def encode_typed(record):
+    return {name: sections.encode(name, value) for name, value in record.items()}
+
+# Measure the memory a list of records takes, in bytes per record.
+def memory_per_record(build, count):
+
+    tracemalloc.start()
+    records = [build(index) for index in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del records
+    return size / count
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Measure the memory and speed of typed record sections against dictionaries.")
+    parser.add_argument("--records", type=int, default=20000, help="How many records to measure the memory of.")
+    parser.add_argument("--iterations", type=int, default=20000, help="How many times to time each operation.")
+    arguments = parser.parse_args()
+
+    # Every layout holds the same strings, so the difference is the structure around them and how numbers are held.
+    dictionary_size = memory_per_record(lambda index: json.loads(json.dumps(stored_record(index))), arguments.records)
+    typed_size = memory_per_record(lambda index: decode_typed(json.loads(json.dumps(stored_record(index)))), arguments.records)
+    arrays_size = memory_per_record(lambda index: decode_arrays(json.loads(json.dumps(stored_record(index)))), arguments.records)
+
+    print("%-32s %12s %12s %12s" % ("", "dictionaries", "typed", "arrays"))
+    print("%-32s %12.0f %12.0f %12.0f" % ("bytes per record", dictionary_size, typed_size, arrays_size))
+
+    # Time creating a new record's default sections, decoding a stored record and encoding it back.
+    stored = stored_record(0)
+
+    timings = (
+
+        ("create defaults (us)", lambda: copy.deepcopy(default_sections), lambda: {name: sections.default(name) for name in default_sections}, default_arrays),
+        ("decode record (us)", lambda: decode_dictionaries(stored), lambda: decode_typed(stored), lambda: decode_arrays(stored)),
+        ("decode and encode record (us)", lambda: decode_dictionaries(stored), lambda: encode_typed(decode_typed(stored)), lambda: encode_arrays(decode_arrays(stored)))
+
+    )
+
+    for name, *layouts in timings:
+        print("%-32s %12.2f %12.2f %12.2f" % ((name,) + tuple(timeit.timeit(layout, number=arguments.iterations) / arguments.iterations * 1e6 for layout in layouts)))
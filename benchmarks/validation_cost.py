@@ -0,0 +1,156 @@
+'''
+
+    We aim to measure the cost of validating each section of a report with the compiled validators, against the hand-written parsers they replaced.
+
+    Usage: python benchmarks/validation_cost.py [--iterations N]
+
+'''
+
+import argparse, os, sys, timeit
+
+# Import the server's validators.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import main
+
+# Define the hand-written parsers the validators replaced, as they were, to measure against.
+def handwritten_network_interface(body):
+
+    network_interface_schema = {"name": None, "ipv6": None, "ipv4": None, "mac": None}
+
+    try:
+        network_interface_schema["name"] = body["name"]
+        network_interface_schema["ipv6"] = body["ipv6"]
+        network_interface_schema["ipv4"] = body["ipv4"]
+        network_interface_schema["mac"] = body["mac"]
+
+    except:
+        raise ValueError("Corrupted or malformed request.")
+
+    if (network_interface_schema["name"] is None or network_interface_schema["mac"] is None):
+        raise ValueError("An essential value is set to null in the request.")
+
+    if (not isinstance(body["name"], str) or (not isinstance(body["mac"], str))):
+        raise ValueError("An essential value isn't the correct type in the request.")
+
+    if (body["ipv6"] is not None and not isinstance(body["ipv6"], str)):
+        raise ValueError("The type for the IPv6 value isn't recognized in the request.")
+
+    if (body["ipv4"] is not None and not isinstance(body["ipv4"], str)):
+        raise ValueError("The type for the IPv4 value isn't recognized in the request.")
+
+    return network_interface_schema
+
+def handwritten_cpu(body):
+
+    cpu_schema = {"threads": None, "cores": None, "model": None, "load": None}
+
+    try:
+        cpu_schema["threads"] = body["threads"]
+        cpu_schema["cores"] = body["cores"]
+        cpu_schema["model"] = body["model"]
+        cpu_schema["load"] = body["load"]
+
+    except:
+        raise ValueError("Malformed or corrupted request.")
+
+    if not isinstance(cpu_schema["threads"], int) or not isinstance(cpu_schema["cores"], int) or not isinstance(cpu_schema["model"], str) or not isinstance(cpu_schema["load"], float):
+        raise ValueError("Type-error in request.")
+
+    return cpu_schema
+
+def handwritten_memory(body):
+
+    memory_schema = {"available": None, "used": None, "swap": None}
+
+    try:
+        memory_schema["available"] = body["available"]
+        memory_schema["used"] = body["used"]
+        memory_schema["swap"] = body["swap"]
+
+    except:
+        raise ValueError("There was an error while trying to parse your request.")
+
+    if (not isinstance(memory_schema["available"], int) or not isinstance(memory_schema["used"], int)):
+        raise ValueError("There was an invalid type detected while trying parsing your request.")
+
+    if (not isinstance(memory_schema["swap"], dict) and not memory_schema["swap"] is None):
+        raise ValueError("There was an error while trying to verify the type of the swap object.")
+
+    if (isinstance(memory_schema["swap"], dict)):
+
+        try:
+            swap_is_valid = isinstance(memory_schema["swap"]["available"], int) and isinstance(memory_schema["swap"]["used"], int)
+
+        except:
+            raise ValueError("The swap segment of your request couldn't be parsed.")
+
+        if (not swap_is_valid):
+            raise ValueError("The swap segment of your request has an invalid type.")
+
+    return memory_schema
+
+def handwritten_disk_mounting_point(body):
+
+    disk_interface_schema = {"path": None, "used": None, "available": None}
+
+    try:
+        disk_interface_schema["path"] = body["path"]
+        disk_interface_schema["used"] = body["used"]
+        disk_interface_schema["available"] = body["available"]
+
+    except:
+        raise ValueError("Corrupted or malformed request.")
+
+    if (not isinstance(disk_interface_schema["path"], str) or not isinstance(disk_interface_schema["available"], int) or not isinstance(disk_interface_schema["used"], int)):
+        raise ValueError("Invalid type assigned to field in request.")
+
+    return disk_interface_schema
+
+# Define each section alongside a valid body, an invalid one and the parser before and after.
+sections = (
+
+    ("interface", {"token": "development_key_1", "name": "eth0", "ipv6": None, "ipv4": "192.168.1.24", "mac": "08:00:27:4e:66:a1"}, {"name": 1, "ipv6": 2, "mac": None}, handwritten_network_interface, main.parse_network_interface),
+    ("cpu", {"token": "development_key_1", "threads": 16, "cores": 8, "model": "AMD Ryzen 7 5800X", "load": 0.37}, {"threads": "16", "cores": 8.0, "load": 1}, handwritten_cpu, main.parse_cpu),
+    ("memory", {"token": "development_key_1", "available": 33554432000, "used": 12884901888, "swap": {"available": 8589934592, "used": 1048576}}, {"available": 1, "used": 2, "swap": {"available": "1"}}, handwritten_memory, main.parse_memory),
+    ("mounting_point", {"token": "development_key_1", "path": "/", "used": 41234567168, "available": 215678930944}, {"path": "/", "used": 1.5}, handwritten_disk_mounting_point, main.parse_disk_mounting_point)
+
+)
+
+# Time a parser against a body, whether it accepts it or not.
+def measure(parser, body, iterations):
+
+    def run():
+
+        try:
+            parser(body)
+
+        except ValueError:
+            pass
+
+    return timeit.timeit(run, number=iterations) / iterations
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Measure the cost of validating each section of a report.")
+    parser.add_argument("--iterations", type=int, default=200000, help="How many times to validate each body.")
+    arguments = parser.parse_args()
+
+    print("%-16s %-8s %16s %16s" % ("section", "body", "before ns/op", "after ns/op"))
+
+    for section, valid, invalid, before, after in sections:
+
+        # Ensure the validator accepts what the hand-written parser accepted.
+        assert after(valid) == before(valid), section
+
+        for label, body in (("valid", valid), ("invalid", invalid)):
+            print("%-16s %-8s %16.0f %16.0f" % (section, label, measure(before, body, arguments.iterations) * 1e9, measure(after, body, arguments.iterations) * 1e9))
+
+    # Show what a client is told about an invalid body, which now lists every problem at once.
+    for section, valid, invalid, before, after in sections:
+
+        try:
+            after(invalid)
+
+        except ValueError as error_message:
+            print(section + ": " + str(error_message))
@@ -0,0 +1,69 @@
+'''
+
+    We aim to report the state of the client to the server on an interval, with as little overhead on the client as we can manage. Every collector is created once and keeps its files open between samples, and every cycle is sent as one batch.
+
+    Usage: python main.py [--server URL] [--token TOKEN] [--interval SECONDS] [--refresh SECONDS] [--spool PATH] [--spool-size BYTES] [--burst N]
+
+'''
+
+import argparse, os, time
+
+# Import our collectors.
+from routines.cpu import CPU
+from routines.memory import Memory
+from routines.net import Network
+from routines.disks import Disks
+
+# Import our delivery of batches.
+from reporter import Changes, Connection, Reporter
+from spool import Spool
+
+# Collect the batch of a cycle, stamped with when it was collected so that the server keeps its samples in their place even if it's replayed from the spool much later. Interfaces and mounting points are only included if they've changed.
+def collect(collectors, changes, token):
+
+    cpu, memory, network, disks = collectors
+    now = time.time()
+
+    batch = {
+
+        "token": token,
+        "collected_at": now,
+        "latency": {"requested_at": int(now)},
+        "cpu": cpu.collect(),
+        "memory": memory.collect()
+
+    }
+
+    for section, collector in (("interfaces", network), ("mounting_points", disks)):
+
+        entries = changes.filter(section, collector.collect(), now)
+        if entries:
+            batch[section] = entries
+
+    return batch
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Report the state of this client to the server.")
+    parser.add_argument("--server", default=os.environ.get("MONITOR_SERVER", "http://127.0.0.1:5000"), help="The URL of the server.")
+    parser.add_argument("--token", default=os.environ.get("MONITOR_TOKEN", "development_key_1"), help="The token to report with.")
+    parser.add_argument("--interval", type=float, default=float(os.environ.get("MONITOR_INTERVAL", "60")), help="How often, in seconds, to report.")
+    parser.add_argument("--refresh", type=float, default=float(os.environ.get("MONITOR_REFRESH", "3600")), help="How often, in seconds, to report interfaces and mounting points that haven't changed. This should be well under the server's stale TTL.")
+    parser.add_argument("--spool", default=os.environ.get("MONITOR_SPOOL", "spool.bin"), help="The file to keep batches in while the server can't take them.")
+    parser.add_argument("--spool-size", type=int, default=int(os.environ.get("MONITOR_SPOOL_SIZE", str(4 * 1024 * 1024))), help="The size, in bytes, of a new spool. Once it's full, the oldest batches are dropped.")
+    parser.add_argument("--burst", type=int, default=int(os.environ.get("MONITOR_BURST", "5")), help="How many spooled batches to replay per cycle. Every cycle's requests count against the server's rate limit of the token, so this should leave room under it.")
+    arguments = parser.parse_args()
+
+    collectors = (CPU(), Memory(), Network(), Disks())
+    changes = Changes(arguments.refresh)
+    reporter = Reporter(Connection(arguments.server), Spool(arguments.spool, arguments.spool_size), arguments.burst)
+
+    # Report on the interval, keeping to its schedule however long a cycle takes.
+    next_cycle = time.monotonic()
+    while True:
+
+        reporter.report(collect(collectors, changes, arguments.token))
+
+        next_cycle += arguments.interval
+        time.sleep(max(0, next_cycle - time.monotonic()))
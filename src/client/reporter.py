@@ -0,0 +1,220 @@
+'''
+
+    We aim to deliver the client's reports to the server in as few requests as we can, and to hold on to them while the server can't take them.
+
+    Every cycle is sent as one batch over a connection that's kept open between cycles, and interfaces and mounting points are only sent when they've changed. A batch the server can't take, because it's unreachable, overloaded or rate-limiting us, is kept in the spool and replayed oldest first once it can, backing off between attempts.
+
+    The first batch sent each cycle, whether it's sent straight away or replayed from the spool, echoes a ping the server issued just before, so that the server measures the round-trip time itself even while a backlog drains.
+
+'''
+
+import http.client, json, random, sys, time, urllib.parse
+
+# Define the sections that hold lists of entries, and the field that identifies an entry in each.
+keyed_sections = {
+
+    "interfaces": "name",
+    "mounting_points": "path"
+
+}
+
+# Define how old, in seconds, a batch's latency section may be when it's sent. The server measures latency as the time since the batch was made, so a batch that waited in the spool would report how long it waited instead.
+latency_max_age = 5
+
+# Define the statuses that mean the server may take the batch later, and so that it should be kept. Any other status the server rejects a batch with means it's invalid and will never be taken.
+retry_statuses = {401, 403, 408, 429, 500, 502, 503, 504}
+
+# Define a class to represent which entries of the keyed sections have been sent, and when.
+class Changes:
+
+    def __init__(self, refresh):
+
+        # Store how often, in seconds, an unchanged entry is sent anyway, so that the server never prunes it as stale.
+        self.refresh = refresh
+        self.sent = {section: {} for section in keyed_sections}
+
+    # Filter the entries of a section down to those that have changed since they were last sent, or are due to be refreshed, and remember them as sent.
+    def filter(self, section, entries, now):
+
+        key = keyed_sections[section]
+        sent = self.sent[section]
+        changed = []
+
+        for entry in entries:
+
+            previous = sent.get(entry[key])
+            if previous is None or previous[0] != entry or now - previous[1] >= self.refresh:
+                sent[entry[key]] = (entry, now)
+                changed.append(entry)
+
+        # Forget entries that have gone away, so that they're sent if they come back.
+        if len(sent) > len(entries):
+
+            present = {entry[key] for entry in entries}
+            for name in [name for name in sent if name not in present]:
+                del sent[name]
+
+        return changed
+
+# Define a class to represent a connection to the server that's kept open between requests.
+class Connection:
+
+    def __init__(self, server, timeout=10):
+
+        url = urllib.parse.urlsplit(server)
+        connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+
+        self.path = url.path.rstrip("/") + "/api/v1/"
+        self.connection = connection_class(url.hostname, url.port, timeout=timeout)
+
+        # Store whether the connection has carried a request since it was opened.
+        self.used = False
+
+    # Post a body to an endpoint of the server, returning the status, the number of seconds the server asked us to wait before retrying, if it did, and the body of the response.
+    def post(self, endpoint, data):
+
+        while True:
+
+            reused = self.used
+            self.used = True
+
+            try:
+
+                self.connection.request("POST", self.path + endpoint, data, {"Content-Type": "application/json"})
+                response = self.connection.getresponse()
+
+                # Read the whole response, so that the connection can carry the next request.
+                data = response.read()
+
+                if response.will_close:
+                    self.close()
+
+                retry_after = response.getheader("Retry-After")
+                return response.status, float(retry_after) if retry_after and retry_after.isdigit() else None, data
+
+            except (OSError, http.client.HTTPException):
+
+                self.close()
+
+                # A connection the server closed while it was idle fails on its next request, so we retry once on a new connection.
+                if not reused:
+                    raise
+
+    # Close the connection. It's opened again by the next request.
+    def close(self):
+        self.connection.close()
+        self.used = False
+
+# Define a class to represent the delivery of batches to the server.
+class Reporter:
+
+    def __init__(self, connection, spool, burst=5, backoff=5, max_backoff=600):
+
+        self.connection = connection
+        self.spool = spool
+
+        # Store how many spooled batches we replay per cycle, so that a backlog doesn't burst past the server's rate limit. A backlog drains by one less than this every cycle, since each cycle adds a batch of its own.
+        self.burst = burst
+
+        # Store how long, in seconds, we wait after the first failure, doubling with each one after that up to the maximum.
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.failures = 0
+        self.retry_at = 0
+
+    # Send a batch to the server, returning whether it should be kept to retry.
+    def deliver(self, batch):
+
+        try:
+            status, retry_after, data = self.connection.post("report_batch", json.dumps(batch).encode())
+
+        except (OSError, http.client.HTTPException) as error:
+            self.back_off(None, str(error))
+            return True
+
+        if status in (200, 202):
+            self.failures = 0
+            return False
+
+        if status in retry_statuses:
+            self.back_off(retry_after, "the server responded with " + str(status))
+            return True
+
+        print("The server rejected a batch with " + str(status) + ", so it was dropped.", file=sys.stderr)
+        return False
+
+    # Wait longer after every consecutive failure, with some jitter so that clients that failed together don't retry together, and at least as long as the server asked.
+    def back_off(self, retry_after, reason):
+
+        self.failures += 1
+        delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1)) * random.uniform(0.5, 1)
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        self.retry_at = time.monotonic() + delay
+        print("Couldn't deliver a batch, as " + reason + ". Retrying in %.0f seconds." % delay, file=sys.stderr)
+
+    # Ask the server for a ping and echo it in a batch in place of its latency, so that the server measures the round-trip time on its own clock. If the server won't issue a ping, such as when pings are rate-limited, the batch keeps its latency. Returns None if the server couldn't be reached.
+    def echo(self, batch):
+
+        try:
+            status, retry_after, data = self.connection.post("ping", json.dumps({"token": batch["token"]}).encode())
+
+        except (OSError, http.client.HTTPException) as error:
+            self.back_off(None, str(error))
+            return None
+
+        if status != 200:
+            return batch
+
+        # The server responds with its payload followed by its status. A replayed batch may have lost its latency already.
+        echoed = dict(batch, echo={"ping": json.loads(data)[0]["ping"]})
+        echoed.pop("latency", None)
+
+        return echoed
+
+    # Report a batch. While the server is taking batches and none are waiting, it's sent straight away, echoing a ping. Otherwise it joins the spool behind those that are, and the first of them to be replayed echoes the ping instead. Pings are only valid briefly, so they're never spooled.
+    def report(self, batch):
+
+        if len(self.spool) == 0 and time.monotonic() >= self.retry_at:
+
+            echoed = self.echo(batch)
+            if echoed is not None and not self.deliver(echoed):
+                return
+
+        dropped = self.spool.dropped
+        self.spool.append(json.dumps(batch).encode())
+
+        if self.spool.dropped > dropped:
+            print("The spool is full, so its %d oldest batches were dropped." % (self.spool.dropped - dropped), file=sys.stderr)
+
+        self.replay(echo=True)
+
+    # Replay spooled batches, oldest first, until one fails or we've sent as many as we may in a cycle. If echo is set, the first batch echoes a ping.
+    def replay(self, echo=False):
+
+        for _ in range(self.burst):
+
+            if len(self.spool) == 0 or time.monotonic() < self.retry_at:
+                return
+
+            batch = json.loads(self.spool.peek())
+
+            # Drop a latency section that's gone stale while it waited.
+            if "latency" in batch and time.time() - batch["latency"]["requested_at"] > latency_max_age:
+                del batch["latency"]
+
+            if echo:
+
+                batch = self.echo(batch)
+                if batch is None:
+                    return
+
+                echo = False
+
+            if self.deliver(batch):
+                return
+
+            self.spool.pop()
@@ -0,0 +1,80 @@
+'''
+
+    We aim to report the processor of the client: how many threads and cores it has, its model, and its load as the number of threads that were busy on average since the last sample.
+
+'''
+
+import os
+
+# Import our reader of pseudo-files.
+from routines.procfs import PseudoFile
+
+# Read the cores and model of the processor from /proc/cpuinfo, which never change while we're running. Architectures that don't list physical cores are counted as having a core per thread.
+def read_processor(threads):
+
+    cores = set()
+    model = None
+    physical_id = None
+
+    try:
+
+        with open("/proc/cpuinfo", "rb") as file:
+
+            for line in file:
+
+                key, _, value = line.partition(b":")
+                key = key.strip()
+
+                if key == b"physical id":
+                    physical_id = value.strip()
+
+                elif key == b"core id":
+                    cores.add((physical_id, value.strip()))
+
+                elif model is None and key in (b"model name", b"Processor", b"cpu model", b"Hardware"):
+                    model = value.strip().decode(errors="replace")
+
+    except OSError:
+        pass
+
+    return len(cores) or threads, model or "Unknown"
+
+# Define a class to represent the collector of the processor's information.
+class CPU:
+
+    def __init__(self):
+
+        self.stat = PseudoFile("/proc/stat")
+        self.threads = os.cpu_count() or 1
+        self.cores, self.model = read_processor(self.threads)
+
+        # The load is measured between samples, so we take the first reading now.
+        self.previous = self.times()
+
+    # Read the total time every thread has spent, and the time they've spent idle, in clock ticks. These come from the first line of /proc/stat, which sums every thread.
+    def times(self):
+
+        data = self.stat.read()
+        values = [int(value) for value in data[:data.index(b"\n")].split()[1:9]]
+
+        # Time spent waiting on input and output counts as idle, and guest time is already included in user time.
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        return sum(values), idle
+
+    # Collect the body of a CPU report.
+    def collect(self):
+
+        total, idle = self.times()
+        elapsed = total - self.previous[0]
+        busy = 0.0 if elapsed <= 0 else (elapsed - (idle - self.previous[1])) / elapsed
+
+        self.previous = (total, idle)
+
+        return {
+
+            "threads": self.threads,
+            "cores": self.cores,
+            "model": self.model,
+            "load": busy * self.threads
+
+        }
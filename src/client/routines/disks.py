@@ -0,0 +1,82 @@
+'''
+
+    We aim to report the mounted disks of the client: the path each is mounted at, and how many bytes are used and available on it.
+
+'''
+
+import os, re
+
+# Import our reader of pseudo-files.
+from routines.procfs import PseudoFile
+
+# Define the escapes /proc/mounts uses for whitespace and backslashes in paths, such as "\040" for a space.
+escape_pattern = re.compile(rb"\\([0-7]{3})")
+
+# Read the filesystems that don't store anything on a device, such as proc and tmpfs, which /proc/filesystems marks as "nodev". ZFS datasets are marked the same way but do hold data.
+def read_virtual_filesystems():
+
+    virtual = set()
+
+    try:
+
+        with open("/proc/filesystems", "rb") as file:
+
+            for line in file:
+
+                fields = line.split()
+                if len(fields) == 2 and fields[0] == b"nodev":
+                    virtual.add(fields[1])
+
+    except OSError:
+        pass
+
+    virtual.discard(b"zfs")
+    return virtual
+
+# Define a class to represent the collector of the mounted disks' information.
+class Disks:
+
+    def __init__(self):
+
+        self.mounts = PseudoFile("/proc/self/mounts", 16384)
+        self.virtual = read_virtual_filesystems()
+
+    # Collect the bodies of a report for every mounted disk. A device mounted in several places, such as by bind mounts, is only reported where it was first mounted. The root is always reported, even if it's an overlay, as it is inside a container.
+    def collect(self):
+
+        reports = []
+        devices = set()
+
+        for line in self.mounts.read().splitlines():
+
+            fields = line.split(b" ", 3)
+            if len(fields) < 3:
+                continue
+
+            device, path, filesystem = fields[0], fields[1], fields[2]
+            if (filesystem in self.virtual and path != b"/") or device in devices:
+                continue
+
+            if b"\\" in path:
+                path = escape_pattern.sub(lambda match: bytes((int(match.group(1), 8),)), path)
+
+            try:
+                statistics = os.statvfs(path)
+
+            except OSError:
+                continue
+
+            # Skip filesystems without any blocks, such as those of some special devices.
+            if statistics.f_blocks == 0:
+                continue
+
+            devices.add(device)
+            reports.append({
+
+                "path": os.fsdecode(path),
+                "used": (statistics.f_blocks - statistics.f_bfree) * statistics.f_frsize,
+                "available": statistics.f_bavail * statistics.f_frsize
+
+            })
+
+        return reports
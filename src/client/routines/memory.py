@@ -0,0 +1,46 @@
+'''
+
+    We aim to report the memory of the client: how much is available and used, and the same for swap if it's enabled.
+
+'''
+
+# Import our reader of pseudo-files.
+from routines.procfs import PseudoFile
+
+# Retrieve a field of /proc/meminfo in bytes, or None if the kernel doesn't report it. Fields are reported in kibibytes.
+def field(data, name):
+
+    start = data.find(name)
+    if start == -1:
+        return None
+
+    start += len(name)
+    return int(data[start:data.index(b"\n", start)].split()[0]) * 1024
+
+# Define a class to represent the collector of the memory's information.
+class Memory:
+
+    def __init__(self):
+        self.meminfo = PseudoFile("/proc/meminfo")
+
+    # Collect the body of a memory report.
+    def collect(self):
+
+        data = self.meminfo.read()
+        total = field(data, b"MemTotal:")
+
+        # Kernels older than 3.14 don't estimate the available memory, so we estimate it the way they used to be read.
+        available = field(data, b"MemAvailable:")
+        if available is None:
+            available = field(data, b"MemFree:") + field(data, b"Buffers:") + field(data, b"\nCached:")
+
+        swap_total = field(data, b"SwapTotal:") or 0
+        swap_free = field(data, b"SwapFree:") or 0
+
+        return {
+
+            "available": available,
+            "used": total - available,
+            "swap": {"available": swap_free, "used": swap_total - swap_free} if swap_total else None
+
+        }
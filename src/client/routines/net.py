@@ -0,0 +1,111 @@
+'''
+
+    We aim to report the network interfaces of the client: their names, addresses and hardware addresses.
+
+'''
+
+import fcntl, ipaddress, os, socket
+
+# Import our reader of pseudo-files.
+from routines.procfs import PseudoFile
+
+# Define the request that retrieves the IPv4 address of an interface, which takes a struct ifreq: the interface's name in 16 bytes, followed by a struct sockaddr_in whose address starts 4 bytes in.
+SIOCGIFADDR = 0x8915
+ifreq_size = 40
+address_offset = 20
+
+# Define the scope of global IPv6 addresses in /proc/net/if_inet6, which we prefer over link-local addresses.
+global_scope = b"00"
+
+# Define a class to represent the collector of the network interfaces' information.
+class Network:
+
+    def __init__(self):
+
+        self.dev = PseudoFile("/proc/net/dev")
+        self.inet6 = PseudoFile("/proc/net/if_inet6") if os.path.exists("/proc/net/if_inet6") else None
+
+        # Store the socket and request buffer we ask the kernel for IPv4 addresses with, which are reused for every interface.
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.request = bytearray(ifreq_size)
+
+        # Store the files holding the hardware address of each interface, opened the first time we see it, and the IPv6 addresses we've formatted.
+        self.hardware_addresses = {}
+        self.formatted = {}
+
+    # Retrieve the names of the interfaces, skipping the two header lines of /proc/net/dev.
+    def names(self):
+        return [line.partition(b":")[0].strip().decode() for line in self.dev.read().splitlines()[2:] if b":" in line]
+
+    # Retrieve the IPv4 address of an interface, or None if it doesn't have one. The kernel writes its answer into the request buffer.
+    def ipv4(self, name):
+
+        encoded = name.encode()[:15]
+        self.request[:] = bytes(ifreq_size)
+        self.request[:len(encoded)] = encoded
+
+        try:
+            fcntl.ioctl(self.socket.fileno(), SIOCGIFADDR, self.request, True)
+
+        except OSError:
+            return None
+
+        return socket.inet_ntoa(self.request[address_offset:address_offset + 4])
+
+    # Retrieve the IPv6 address of every interface that has one, preferring global addresses. Each line of /proc/net/if_inet6 holds an address as 32 hexadecimal digits, its interface's index, prefix length, scope and flags, and the interface's name.
+    def ipv6(self):
+
+        addresses = {}
+        if self.inet6 is None:
+            return addresses
+
+        for line in self.inet6.read().splitlines():
+
+            fields = line.split()
+            if len(fields) < 6:
+                continue
+
+            name = fields[5].decode()
+            if name in addresses and fields[3] != global_scope:
+                continue
+
+            # Formatting an address is the only expensive part, and addresses rarely change, so we remember them.
+            address = self.formatted.get(fields[0])
+            if address is None:
+                address = self.formatted[fields[0]] = str(ipaddress.IPv6Address(bytes.fromhex(fields[0].decode())))
+
+            addresses[name] = address
+
+        return addresses
+
+    # Retrieve the hardware address of an interface. Interfaces without one, such as tunnels, are reported with an address of zeroes.
+    def mac(self, name):
+
+        try:
+
+            if name not in self.hardware_addresses:
+                self.hardware_addresses[name] = PseudoFile(os.path.join("/sys/class/net", name, "address"), 64)
+
+            return self.hardware_addresses[name].read().strip().decode() or "00:00:00:00:00:00"
+
+        except OSError:
+            return "00:00:00:00:00:00"
+
+    # Collect the bodies of a report for every interface.
+    def collect(self):
+
+        names = self.names()
+        ipv6 = self.ipv6()
+
+        # Close the files of interfaces that have gone away.
+        for name in set(self.hardware_addresses).difference(names):
+            self.hardware_addresses.pop(name).close()
+
+        return [{
+
+            "name": name,
+            "ipv6": ipv6.get(name),
+            "ipv4": self.ipv4(name),
+            "mac": self.mac(name)
+
+        } for name in names]
@@ -0,0 +1,45 @@
+'''
+
+    We aim to read the kernel's pseudo-files, such as those in /proc and /sys, with as little work per sample as possible. Each file is opened once and read into a buffer that's reused between samples.
+
+'''
+
+import os
+
+# Define a class to represent a pseudo-file that's kept open between samples. The kernel regenerates the contents of these files whenever they're read from the start, so we never need to reopen them.
+class PseudoFile:
+
+    def __init__(self, path, size=4096):
+
+        self.path = path
+        self.descriptor = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+
+        # Store the buffer we read into, which grows to fit the file the first time it's too small.
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    # Read the current contents of the file.
+    def read(self):
+
+        os.lseek(self.descriptor, 0, os.SEEK_SET)
+        length = 0
+
+        while True:
+
+            # Grow the buffer if the file has filled it.
+            if length == len(self.buffer):
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+
+            read = os.readv(self.descriptor, [self.view[length:]])
+            if read == 0:
+                return bytes(self.view[:length])
+
+            length += read
+
+    def close(self):
+
+        if self.descriptor is not None:
+            os.close(self.descriptor)
+            self.descriptor = None
@@ -0,0 +1,191 @@
+'''
+
+    We aim to keep the reports we haven't delivered yet on disk, so that they survive the server being unreachable and the agent being restarted, without ever taking more than a fixed amount of space.
+
+    The spool is a ring buffer in a memory-mapped file of a fixed size. Once it's full, the oldest reports are dropped to make room for new ones. A report is written and flushed to disk before the header that points at it, and the header is written to alternating slots, each with a checksum, so a crash part way through a write loses at most that report.
+
+'''
+
+import mmap, os, struct, zlib
+
+# Define the layout of the file: two slots for the header, followed by the ring of reports. Each header holds a magic number, a sequence number that picks the newer slot, the position of the oldest report, the position the next report is written at and how many reports are held, followed by a checksum of all of those.
+magic = b"MONSPOOL"
+header = struct.Struct("<8sQIII")
+header_slot_size = 32
+data_offset = 2 * header_slot_size
+
+# Each report is preceded by its length and a checksum of it. A length of all ones marks that the rest of the ring is unused and the next report is at its start.
+record_header = struct.Struct("<II")
+wrap_marker = 0xFFFFFFFF
+
+# Define a class to represent the spool.
+class Spool:
+
+    def __init__(self, path, size=4 * 1024 * 1024):
+
+        # An existing spool keeps the size it was created with, so that changing the setting never loses the reports in it.
+        exists = os.path.exists(path) and os.path.getsize(path) > data_offset + record_header.size
+        self.file = open(path, "r+b" if exists else "w+b")
+
+        if not exists:
+            self.file.truncate(size)
+
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.size = len(self.map)
+
+        # Store how many reports have been dropped to make room since we started.
+        self.dropped = 0
+
+        if not self.load():
+            self.sequence = 0
+            self.reset()
+            self.commit()
+
+    # Read the newer of the two headers whose checksums are intact, then check every report it points to. Returns False if neither header is intact.
+    def load(self):
+
+        newest = None
+        for slot in range(2):
+
+            offset = slot * header_slot_size
+            fields = header.unpack_from(self.map, offset)
+            checksum = struct.unpack_from("<I", self.map, offset + header.size)[0]
+
+            if fields[0] == magic and checksum == zlib.crc32(self.map[offset:offset + header.size]) and (newest is None or fields[1] > newest[1]):
+                newest = fields
+
+        if newest is None:
+            return False
+
+        self.sequence, self.head, self.tail, self.count = newest[1:]
+
+        # If a report was damaged, such as by a failing disk, we keep the reports before it and drop it and those after it.
+        position = self.head
+        for index in range(self.count):
+
+            position = self.skip_wrap(position)
+            length, checksum = record_header.unpack_from(self.map, position)
+
+            if position + record_header.size + length > self.size or zlib.crc32(self.map[position + record_header.size:position + record_header.size + length]) != checksum:
+
+                self.count = index
+                self.tail = position
+                if self.count == 0:
+                    self.reset()
+
+                self.commit()
+                break
+
+            position += record_header.size + length
+
+        return True
+
+    def __len__(self):
+        return self.count
+
+    # Start over with an empty ring. This doesn't write the header.
+    def reset(self):
+        self.head = self.tail = data_offset
+        self.count = 0
+
+    # Retrieve the position of the report at a position, which is the start of the ring if the rest of it is unused.
+    def skip_wrap(self, position):
+
+        if position + record_header.size > self.size or record_header.unpack_from(self.map, position)[0] == wrap_marker:
+            return data_offset
+
+        return position
+
+    # Write the header to the older of the two slots, once everything it points to has reached the disk.
+    def commit(self):
+
+        self.map.flush()
+        self.sequence += 1
+
+        offset = (self.sequence % 2) * header_slot_size
+        fields = header.pack(magic, self.sequence, self.head, self.tail, self.count)
+
+        self.map[offset:offset + header.size] = fields
+        struct.pack_into("<I", self.map, offset + header.size, zlib.crc32(fields))
+        self.map.flush()
+
+    # Find room for a report of a given length, returning the position to write it at, or None if there isn't enough room without dropping a report.
+    def room(self, length):
+
+        if self.count == 0:
+            self.reset()
+            return self.tail
+
+        # The reports are in one piece from the head to the tail, so there's room after the tail and before the head.
+        if self.tail >= self.head:
+
+            if self.tail + length <= self.size:
+                return self.tail
+
+            if data_offset + length < self.head:
+
+                # Mark the rest of the ring as unused, if there's room for the marker.
+                if self.tail + record_header.size <= self.size:
+                    record_header.pack_into(self.map, self.tail, wrap_marker, 0)
+
+                return data_offset
+
+            return None
+
+        # The reports wrap around the end of the ring, so the only room is between the tail and the head.
+        return self.tail if self.tail + length < self.head else None
+
+    # Add a report, dropping the oldest ones if there isn't room for it.
+    def append(self, data):
+
+        length = record_header.size + len(data)
+        if length > self.size - data_offset:
+            raise ValueError("The report is larger than the spool.")
+
+        position = self.room(length)
+        while position is None:
+            self.remove()
+            self.dropped += 1
+            position = self.room(length)
+
+        record_header.pack_into(self.map, position, len(data), zlib.crc32(data))
+        self.map[position + record_header.size:position + length] = data
+
+        self.tail = position + length
+        self.count += 1
+        self.commit()
+
+    # Retrieve the oldest report, or None if the spool is empty.
+    def peek(self):
+
+        if self.count == 0:
+            return None
+
+        position = self.skip_wrap(self.head)
+        length = record_header.unpack_from(self.map, position)[0]
+        return bytes(self.map[position + record_header.size:position + record_header.size + length])
+
+    # Drop the oldest report without writing the header.
+    def remove(self):
+
+        position = self.skip_wrap(self.head)
+        length = record_header.unpack_from(self.map, position)[0]
+
+        self.head = position + record_header.size + length
+        self.count -= 1
+
+        if self.count == 0:
+            self.reset()
+
+    # Drop the oldest report once it's been delivered.
+    def pop(self):
+
+        if self.count == 0:
+            return
+
+        self.remove()
+        self.commit()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,312 @@
+'''
+
+    We aim to raise threshold alerts, such as a mount more than 90% full for five minutes or a latency above 500 ms, as samples arrive rather than by scanning records for them.
+
+    Rules are indexed by the metric they watch and, within a metric, sorted by their threshold. We remember the last value of each metric of each client, so a new sample only visits the rules whose threshold lies between the last value and the new one, which are exactly those that start or stop being broken. How long each rule has been broken for is tracked per client in memory, with the rules waiting to fire ordered by when they're due, and alerts that start or stop firing are delivered to a webhook or command in the background.
+
+'''
+
+import bisect, heapq, json, os, queue, shlex, subprocess, threading, urllib.request
+
+# Import our configuration.
+import config
+
+# Import the identifiers clients are known by, which unlike their tokens may be shown to others.
+from tokens import identifier_of
+
+# Define the metrics rules may watch.
+alert_metrics = ("latency", "cpu_load", "memory_used", "memory_usage", "disk_used", "disk_usage")
+
+# Define the comparisons rules may make between a metric and their threshold.
+operators = (">", ">=", "<", "<=")
+
+# Compute the metrics rules may watch from a sample of a metric's history, as tuples of the metric, what it measures, such as the path of a mounting point, and its value. Usages are the fraction of the total that's used.
+def alert_values(metric, values):
+
+    if metric == "latency":
+        return (("latency", None, values[0]),)
+
+    if metric == "cpu":
+        return (("cpu_load", None, values[0]),)
+
+    if metric == "memory" or metric.startswith("disk:"):
+
+        available, used = values
+        prefix, subject = ("memory", None) if metric == "memory" else ("disk", metric[len("disk:"):])
+
+        if available + used <= 0:
+            return ((prefix + "_used", subject, used),)
+
+        return ((prefix + "_used", subject, used), (prefix + "_usage", subject, used / (available + used)))
+
+    return ()
+
+# Define a class to represent a rule, which fires once a metric has been compared to a threshold and found broken for at least its duration.
+class Rule:
+
+    def __init__(self, name, metric, operator, threshold, duration=0):
+
+        self.name = name
+        self.metric = metric
+        self.operator = operator
+        self.threshold = threshold
+        self.duration = duration
+
+    # Create a rule from its definition, such as {"name": "disk_nearly_full", "metric": "disk_usage", "operator": ">", "threshold": 0.9, "for": 300}.
+    @classmethod
+    def from_definition(cls, definition):
+
+        if not isinstance(definition, dict):
+            raise ValueError("Every alert rule must be an object.")
+
+        name = definition.get("name")
+        if not isinstance(name, str) or not name:
+            raise ValueError("Every alert rule must have a name.")
+
+        if definition.get("metric") not in alert_metrics:
+            raise ValueError("The alert rule " + name + " must watch one of " + ", ".join(alert_metrics) + ".")
+
+        if definition.get("operator") not in operators:
+            raise ValueError("The alert rule " + name + " must compare with one of " + ", ".join(operators) + ".")
+
+        threshold = definition.get("threshold")
+        duration = definition.get("for", 0)
+
+        if not isinstance(threshold, (int, float)) or isinstance(threshold, bool):
+            raise ValueError("The threshold of the alert rule " + name + " must be numeric.")
+
+        if not isinstance(duration, (int, float)) or isinstance(duration, bool) or duration < 0:
+            raise ValueError("The duration of the alert rule " + name + " must be a non-negative number of seconds.")
+
+        return cls(name, definition["metric"], definition["operator"], threshold, duration)
+
+# Define a class to represent the rules of a single metric and operator, sorted by their threshold, so that the rules a value breaks are always a contiguous run of them.
+class Thresholds:
+
+    def __init__(self, operator, rules):
+
+        self.rules = sorted(rules, key=lambda rule: rule.threshold)
+        self.thresholds = [rule.threshold for rule in self.rules]
+
+        # Rules that watch for a value above their threshold are broken by every rule before the value's position, and those that watch for a value below it by every rule after.
+        self.above = operator in (">", ">=")
+        self.search = bisect.bisect_left if operator in (">", "<=") else bisect.bisect_right
+
+    # Retrieve the position of a value among the thresholds, or where a value that breaks no rule would be if there isn't one.
+    def position(self, value):
+
+        if value is None:
+            return 0 if self.above else len(self.rules)
+
+        return self.search(self.thresholds, value)
+
+    # Retrieve the rules that start or stop being broken as a metric moves from its previous value to a new one, alongside whether they're now broken.
+    def changes(self, previous, value):
+
+        before = self.position(previous)
+        after = self.position(value)
+
+        if before == after:
+            return (), False
+
+        return self.rules[min(before, after):max(before, after)], (after > before) == self.above
+
+# Load the rules from a JSON file holding a list of their definitions. Without the file, there are no rules.
+def load_rules(path=config.alert_rules_path):
+
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as file:
+        definitions = json.load(file)
+
+    if not isinstance(definitions, list):
+        raise ValueError("The alert rules must be a list.")
+
+    rules = [Rule.from_definition(definition) for definition in definitions]
+
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError("Every alert rule must have a different name.")
+
+    return rules
+
+# Define a class to represent the delivery of alerts to a webhook, a command or both. Alerts are delivered one at a time in the background, so a slow receiver never holds up a report, and are dropped if too many are waiting.
+class Sink:
+
+    def __init__(self, webhook=config.alert_webhook, command=config.alert_command, queue_size=config.alert_queue_size, timeout=config.alert_timeout):
+
+        # Store our settings.
+        self.webhook = webhook
+        self.command = command
+        self.timeout = timeout
+
+        # Store the alerts waiting to be delivered, alongside how many were dropped or failed.
+        self.queue = queue.Queue(queue_size)
+        self.statistics = {
+
+            "delivered": 0,
+            "dropped": 0,
+            "failed": 0
+
+        }
+        self.lock = threading.Lock()
+
+        # Only start delivering if there's somewhere to deliver to.
+        self.thread = None
+        if webhook or command:
+            self.thread = threading.Thread(target=self.deliver_loop, name="monitor-alerts", daemon=True)
+            self.thread.start()
+
+    # Queue an alert for delivery.
+    def deliver(self, alert):
+
+        if self.thread is None:
+            return
+
+        try:
+            self.queue.put_nowait(alert)
+
+        except queue.Full:
+
+            with self.lock:
+                self.statistics["dropped"] += 1
+
+    # Deliver alerts as they're queued. The webhook receives each one as a JSON body, and the command on its standard input.
+    def deliver_loop(self):
+
+        while True:
+
+            body = json.dumps(self.queue.get()).encode()
+            delivered = True
+
+            if self.webhook:
+
+                try:
+                    urllib.request.urlopen(urllib.request.Request(self.webhook, body, {"Content-Type": "application/json"}), timeout=self.timeout).close()
+
+                except (OSError, ValueError):
+                    delivered = False
+
+            if self.command:
+
+                try:
+                    delivered = subprocess.run(shlex.split(self.command), input=body, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout).returncode == 0 and delivered
+
+                except (OSError, subprocess.SubprocessError):
+                    delivered = False
+
+            with self.lock:
+                self.statistics["delivered" if delivered else "failed"] += 1
+
+# Define a class to represent the rules and the state of every client's alerts.
+class Alerts:
+
+    def __init__(self, rules, sink):
+
+        # Index the rules by the metric they watch, and within it by their operator.
+        self.rules = {rule.name: rule for rule in rules}
+        self.index = {}
+
+        for metric in alert_metrics:
+
+            by_operator = [Thresholds(operator, [rule for rule in rules if rule.metric == metric and rule.operator == operator]) for operator in operators]
+            by_operator = [thresholds for thresholds in by_operator if thresholds.rules]
+
+            if by_operator:
+                self.index[metric] = by_operator
+
+        self.sink = sink
+
+        # Store the state of each metric of each client, keyed by its token, the metric and what it measures. The state holds the last value, when each broken rule was first broken and whether it's firing, and the rules waiting to fire ordered by when they're due.
+        self.states = {}
+        self.lock = threading.Lock()
+
+        # Remember which process owns this state.
+        self.pid = os.getpid()
+
+    # Check a sample of a client's metric against the rules that watch it, returning the alerts that started or stopped firing, which are also queued for delivery.
+    def observe(self, token, metric, values, timestamp):
+
+        alerts = []
+
+        for name, subject, value in alert_values(metric, values):
+
+            thresholds = self.index.get(name)
+            if thresholds is None:
+                continue
+
+            with self.lock:
+
+                state = self.states.setdefault((token, name, subject), {"value": None, "broken": {}, "pending": []})
+
+                # Track the rules that have started or stopped being broken. Those that start wait until their duration is up before firing, and those that stop resolve their alert if it was firing.
+                for rules in thresholds:
+
+                    changed, broken = rules.changes(state["value"], value)
+                    for rule in changed:
+
+                        if broken:
+                            state["broken"][rule.name] = [timestamp, False]
+                            heapq.heappush(state["pending"], (timestamp + rule.duration, rule.name, timestamp))
+                            continue
+
+                        broken_since, firing = state["broken"].pop(rule.name, (None, False))
+                        if firing:
+                            alerts.append(self.alert(rule, "resolved", token, subject, value, timestamp))
+
+                state["value"] = value
+
+                # Fire the alerts of rules that have been broken for long enough, in the order they became due. Rules that stopped being broken while they waited are skipped, so only the rules that are due are ever visited.
+                pending = state["pending"]
+                while pending and pending[0][0] <= timestamp:
+
+                    due_at, rule_name, broken_since = heapq.heappop(pending)
+                    broken = state["broken"].get(rule_name)
+
+                    if broken is not None and broken[0] == broken_since and not broken[1]:
+                        broken[1] = True
+                        alerts.append(self.alert(self.rules[rule_name], "firing", token, subject, value, timestamp))
+
+        for alert in alerts:
+            self.sink.deliver(alert)
+
+        return alerts
+
+    # Describe an alert that has started or stopped firing. The client is named by its identifier rather than its token, as the alert leaves the server.
+    def alert(self, rule, state, token, subject, value, timestamp):
+
+        return {
+
+            "rule": rule.name,
+            "state": state,
+            "client": identifier_of(token),
+            "metric": rule.metric,
+            "subject": subject,
+            "operator": rule.operator,
+            "threshold": rule.threshold,
+            "value": value,
+            "timestamp": timestamp,
+            "description": "Alert " + rule.name + (" is firing" if state == "firing" else " was resolved") + ("" if subject is None else " for " + subject) + ", as " + rule.metric + " is " + format(value, ".6g") + "."
+
+        }
+
+# Store the process-wide alerts.
+alerts = None
+alerts_lock = threading.Lock()
+
+# Retrieve the process-wide alerts, loading the rules on first use.
+def get_alerts():
+
+    global alerts
+
+    # Worker processes forked from a parent need their own delivery thread, and only see the samples they're sent.
+    if alerts is not None and alerts.pid == os.getpid():
+        return alerts
+
+    with alerts_lock:
+
+        if alerts is None or alerts.pid != os.getpid():
+            alerts = Alerts(load_rules(), Sink())
+
+    return alerts
@@ -0,0 +1,195 @@
+'''
+
+    We aim to store the audit log of each record as an append-only sequence of bounded segments, so that logging an event costs the same no matter how long a client has been reporting.
+
+'''
+
+import threading, time
+
+# Import our configuration.
+import config
+
+# Build the storage key of the index of an audit log.
+def index_key(token):
+    return token + ":audit"
+
+# Build the storage key of a segment of an audit log.
+def segment_key(token, segment):
+    return token + ":audit:" + str(segment)
+
+# Define a class to represent the audit logs stored in the database.
+class AuditLog:
+
+    def __init__(self, storage, segment_size=config.audit_segment_size, max_segments=config.audit_max_segments, max_age=config.audit_max_age):
+
+        # Store our settings.
+        self.storage = storage
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.max_age = max_age
+
+        # Appending may roll a log over to a new segment, which must only happen once per log. Each store has its own lock, so separate databases never wait on each other.
+        self.lock = threading.Lock()
+
+    # Retrieve the index of an audit log, which maps each retained segment to the count and time range of its events.
+    def index(self, token):
+
+        index = self.storage.get(index_key(token))
+
+        if index is None:
+
+            index = {
+
+                "head": 0,
+                "segments": {}
+
+            }
+
+        return index
+
+    # Append an event to the end of an audit log.
+    def append(self, token, entry):
+
+        with self.lock:
+
+            index = self.index(token)
+            head = str(index["head"])
+
+            # Start a new segment if the current one is full, applying retention now that a segment has been completed.
+            if head in index["segments"] and index["segments"][head][0] >= self.segment_size:
+
+                index["head"] += 1
+                head = str(index["head"])
+                index["segments"][head] = [0, entry["timestamp"], entry["timestamp"]]
+                self.expire(token, index)
+
+            # Retrieve the current segment, starting it if it's new.
+            if head in index["segments"] and index["segments"][head][0] > 0:
+                segment = self.storage.get(segment_key(token, head))
+
+            else:
+                segment = []
+                index["segments"][head] = [0, entry["timestamp"], entry["timestamp"]]
+
+            segment.append(entry)
+
+            # Track the count and time range of the segment in the index.
+            index["segments"][head][0] = len(segment)
+            index["segments"][head][2] = entry["timestamp"]
+
+            self.storage.put(segment_key(token, head), segment)
+            self.storage.put(index_key(token), index)
+
+    # Drop the oldest segments of an audit log beyond our size and age limits. This never drops the current segment.
+    def expire(self, token, index):
+
+        expires_at = time.time() - self.max_age
+        segments = sorted(index["segments"], key=int)
+
+        for segment in segments[:-1]:
+
+            if len(index["segments"]) <= self.max_segments and index["segments"][segment][2] >= expires_at:
+                break
+
+            del index["segments"][segment]
+            self.storage.delete(segment_key(token, segment))
+
+    # Apply retention to an audit log, trim expired events from its oldest segment and merge completed segments that have become small.
+    def compact(self, token):
+
+        with self.lock:
+
+            index = self.index(token)
+            if not index["segments"]:
+                return
+
+            self.expire(token, index)
+
+            expires_at = time.time() - self.max_age
+            segments = sorted(index["segments"], key=int)
+
+            # Trim expired events out of the oldest segment, which may be only partially expired.
+            oldest = segments[0]
+            if index["segments"][oldest][1] < expires_at:
+
+                entries = [entry for entry in self.storage.get(segment_key(token, oldest)) if entry["timestamp"] >= expires_at]
+                self.store_segment(token, index, oldest, entries)
+
+            # Merge neighbouring completed segments while their events fit into a single segment. The current segment is left alone since it's still being appended to.
+            merged = None
+            for segment in segments[:-1]:
+
+                if segment not in index["segments"]:
+                    continue
+
+                if merged is not None and index["segments"][merged][0] + index["segments"][segment][0] <= self.segment_size:
+
+                    entries = self.storage.get(segment_key(token, merged)) + self.storage.get(segment_key(token, segment))
+                    self.store_segment(token, index, merged, entries)
+                    self.store_segment(token, index, segment, [])
+
+                else:
+                    merged = segment
+
+            self.storage.put(index_key(token), index)
+
+    # Replace the events of a segment, removing the segment entirely if it's now empty.
+    def store_segment(self, token, index, segment, entries):
+
+        if entries:
+            index["segments"][segment] = [len(entries), entries[0]["timestamp"], entries[-1]["timestamp"]]
+            self.storage.put(segment_key(token, segment), entries)
+
+        else:
+            del index["segments"][segment]
+            self.storage.delete(segment_key(token, segment))
+
+    # Read a page of events from an audit log in chronological order, optionally filtered by time range and event type. The returned cursor continues from where the page ended, or is None once there's nothing left.
+    def read(self, token, start=None, end=None, event=None, cursor=None, limit=100):
+
+        index = self.index(token)
+        entries = []
+
+        # Cursors take the form "segment:offset".
+        cursor_segment, cursor_offset = (int(part) for part in cursor.split(":")) if cursor else (None, 0)
+
+        for segment in sorted(index["segments"], key=int):
+
+            # Skip segments we've already returned, and those entirely outside of the time range.
+            if cursor_segment is not None and int(segment) < cursor_segment:
+                continue
+
+            count, first_timestamp, last_timestamp = index["segments"][segment]
+            if (start is not None and last_timestamp < start) or (end is not None and first_timestamp > end):
+                continue
+
+            offset = cursor_offset if cursor_segment is not None and int(segment) == cursor_segment else 0
+            segment_entries = self.storage.get(segment_key(token, segment)) or []
+
+            for position in range(offset, len(segment_entries)):
+
+                entry = segment_entries[position]
+                if (start is not None and entry["timestamp"] < start) or (end is not None and entry["timestamp"] > end) or (event is not None and entry["event"] != event):
+                    continue
+
+                # Stop once the page is full, pointing the cursor at the event that didn't fit.
+                if len(entries) >= limit:
+                    return entries, segment + ":" + str(position)
+
+                entries.append(entry)
+
+        return entries, None
+
+    # Iterate every retained event of an audit log in chronological order.
+    def entries(self, token):
+
+        index = self.index(token)
+
+        for segment in sorted(index["segments"], key=int):
+            yield from self.storage.get(segment_key(token, segment)) or []
+
+    # Append existing events to an audit log, such as those migrated from an older storage layout.
+    def extend(self, token, entries):
+
+        for entry in entries:
+            self.append(token, entry)
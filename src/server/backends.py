@@ -0,0 +1,243 @@
+'''
+
+    We aim to let records be stored by different storage engines behind the same interface, selected through our configuration.
+
+'''
+
+import atexit, contextlib, os, threading, time
+
+# Import our configuration.
+import config
+
+# Import the key-value storage layer and the stores built on top of it.
+from storage import Storage, get_storage
+from audit import AuditLog
+from history import History
+from rollups import Rollups
+
+# Import the SQLite storage engine.
+from sqlite_backend import SQLiteBackend
+
+# Import sharding.
+from sharding import ShardedBackend, shard_path
+
+# Import our metrics.
+import metrics
+
+# Define the key that records which version of the key-value storage layout the database uses.
+schema_version_key = "__schema_version__"
+schema_version = 4
+
+# Build the storage key of a section of a record.
+def section_key(token, section):
+    return token + ":" + section
+
+# Bring the key-value database up to the current storage layout. This only needs to do any work once per database.
+def migrate(storage):
+
+    # Skip the migration if the database is already using the current layout.
+    version = storage.get(schema_version_key) or 1
+    if version >= schema_version:
+        return
+
+    # Split records stored as a single value under their token into separately stored sections.
+    if version < 2:
+        migrate_to_sections(storage)
+
+    # Move audit logs out of the record sections into their own segmented store.
+    if version < 3:
+        migrate_to_segmented_audit_logs(storage)
+
+    # Key interfaces and mounting points by their name and path, dropping the duplicates stored as lists.
+    if version < 4:
+        migrate_to_keyed_sections(storage)
+
+    # Record that the database now uses the current layout, and write everything out right away.
+    storage.put(schema_version_key, schema_version)
+    storage.flush()
+
+# Split records stored as a single value under their token into separately stored sections.
+def migrate_to_sections(storage):
+
+    for key in storage.keys():
+
+        # Legacy records are stored under the bare token.
+        if ":" in key or key == schema_version_key:
+            continue
+
+        legacy_record = storage.get(key)
+        if not isinstance(legacy_record, dict) or "metadata" not in legacy_record or "data" not in legacy_record:
+            continue
+
+        # Map the legacy record onto its sections.
+        analytics = legacy_record["data"]["analytics"]
+        sections = {
+
+            "metadata": {
+
+                "created_at": legacy_record["metadata"]["created_at"],
+                "updated_at": legacy_record["metadata"]["updated_at"]
+
+            },
+            "audit_log": legacy_record["metadata"]["audit_log"],
+            "latency": analytics["network"]["latency"],
+            "interfaces": analytics["network"]["interfaces"],
+            "cpu": analytics["cpu"],
+            "memory": analytics["memory"],
+            "mounting_points": analytics["disks"]["mounting_points"]
+
+        }
+
+        # Store each section under its own key and remove the legacy record.
+        for section, value in sections.items():
+            storage.put(section_key(key, section), value)
+
+        storage.delete(key)
+
+# Move audit logs stored as a record section into the segmented audit log store.
+def migrate_to_segmented_audit_logs(storage):
+
+    audit_log = AuditLog(storage)
+
+    for key in storage.keys():
+
+        if not key.endswith(":audit_log"):
+            continue
+
+        audit_log.extend(key[:-len(":audit_log")], storage.get(key) or [])
+        storage.delete(key)
+
+# Convert the interfaces and mounting points stored as lists into maps keyed by their name and path. Earlier versions could store the same one several times, in which case the last is the most recently reported.
+def migrate_to_keyed_sections(storage):
+
+    # Treat every migrated entry as just reported, so that none are removed before the client has had a chance to report them again.
+    seen_at = time.time()
+
+    for key in storage.keys():
+
+        for section, name in (("interfaces", "name"), ("mounting_points", "path")):
+
+            if not key.endswith(":" + section):
+                continue
+
+            entries = storage.get(key)
+            if isinstance(entries, list):
+                storage.put(key, {entry[name]: dict(entry, seen_at=seen_at) for entry in entries})
+
+# Define a class to represent records stored as JSON sections in a key-value database, behind our write-behind storage layer.
+class KeyValueBackend:
+
+    def __init__(self, storage):
+
+        # Store the storage layer and the stores built on top of it, alongside the lock records are loaded and saved under.
+        self.storage = storage
+        self.lock = threading.RLock()
+        self.audit_log = AuditLog(storage)
+        self.history = History(storage)
+        self.rollups = Rollups(lambda *arguments: History(storage, *arguments))
+
+        # Ensure the database has been migrated to the current layout before we read anything from it.
+        migrate(storage)
+
+        # An unsharded storage engine is its own only shard.
+        self.shards = [self]
+
+    def shard_index(self, token):
+        return 0
+
+    def shard(self, token):
+        return self
+
+    def fan_out(self, function):
+        return [function(self)]
+
+    # Retrieve a section of a record, or None if it hasn't been stored.
+    def load(self, token, section):
+        return self.storage.get(section_key(token, section))
+
+    # Store changed sections of a record, keeping track of how large each section is. The storage layer writes them back to the database in the background.
+    def save(self, token, sections):
+
+        for section, value in sections.items():
+            metrics.section_size.labels(section).observe(self.storage.put(section_key(token, section), value))
+
+    # Group several saves into a single write to the database.
+    @contextlib.contextmanager
+    def group(self):
+
+        yield
+        self.flush()
+
+    # Values are only ever written in the background, so there's no transaction to roll back.
+    def rollback(self):
+        pass
+
+    # Call a function once what's been saved is committed. Saved values are never rolled back, so that's right away.
+    def after_commit(self, callback):
+        callback()
+
+    # Load and save a record without another thread doing the same in between. A key-value database can only be opened by one process at a time, so a lock is enough.
+    @contextlib.contextmanager
+    def transaction(self):
+
+        with self.lock:
+            yield
+
+    # List the tokens of every stored record.
+    def tokens(self):
+        return [key[:-len(":metadata")] for key in self.storage.keys() if key.endswith(":metadata")]
+
+    # Write every pending change to the database.
+    def flush(self):
+        self.storage.flush()
+
+    def close(self):
+        self.storage.close()
+
+# Create the storage engine for a single database, which is one of several shards if shards is more than one.
+def create_shard(name, shard=0, shards=1):
+
+    if name == "dbm":
+        return KeyValueBackend(get_storage() if shards == 1 else Storage(shard_path(config.database_path, shard, shards)))
+
+    if name == "sqlite":
+        return SQLiteBackend(shard_path(config.sqlite_path, shard, shards))
+
+    raise ValueError("Unknown storage backend " + repr(name) + ".")
+
+# Create the storage engine selected by our configuration, partitioning records across shards if more than one is configured.
+def create_backend(name=config.backend, shards=config.shards):
+
+    if shards == 1:
+        return create_shard(name)
+
+    return ShardedBackend([create_shard(name, shard, shards) for shard in range(shards)])
+
+# Store the process-wide storage engine.
+backend = None
+backend_pid = None
+backend_lock = threading.Lock()
+
+# Close the process-wide storage engine as the process that created it exits. Processes forked from it inherit this exit handler, and leave closing it to that process.
+def close_backend(closing, pid):
+
+    if os.getpid() == pid:
+        closing.close()
+
+# Retrieve the process-wide storage engine, creating it on first use.
+def get_backend():
+
+    global backend, backend_pid
+
+    # Worker processes forked from a parent need their own storage engine.
+    if backend is not None and backend_pid == os.getpid():
+        return backend
+
+    with backend_lock:
+
+        if backend is None or backend_pid != os.getpid():
+            backend = create_backend()
+            backend_pid = os.getpid()
+            atexit.register(close_backend, backend, backend_pid)
+
+    return backend
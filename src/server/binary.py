@@ -0,0 +1,311 @@
+'''
+
+    We aim to provide a compact, fixed-layout binary encoding of reports as an alternative to JSON, which decodes into the same request bodies so that both share the same validation and writes.
+
+    Every message starts with a header of the encoding's version, the kind of report it holds and the length of the token, followed by the token and the report's sections. Each section lays out its numeric fields in a fixed order, then, if it has strings, a mask of which of them are null and the length of its strings, followed by the strings themselves joined by null characters, so that they're decoded and split at once. A null string is laid out as an empty one, and a string can't hold a null character. A list of sections is laid out by field, with each fixed-size field of every section in the list followed by the next, then every section's mask, the length of all of their strings and the strings, field by field, so that a whole list is unpacked at once. A single section is laid out as a list of one. Integers are signed 64-bit, numbers are 64-bit floats and strings are UTF-8, all little-endian.
+
+'''
+
+import struct
+
+# Define the content type clients send binary reports as.
+content_type = "application/vnd.monitor.report"
+
+# Define the version of the layout we encode and decode.
+version = 3
+
+# Define the kinds of report a message may hold.
+kinds = {
+
+    "latency": 1,
+    "interface": 2,
+    "cpu": 3,
+    "memory": 4,
+    "mounting_point": 5,
+    "batch": 6
+
+}
+
+# Define how many lengths of list the compiled layouts of each kind of section are kept for.
+max_list_structs = 256
+
+# Define the error raised when a section's strings don't split into as many as it has.
+malformed_strings = "The binary report's strings don't match its sections."
+
+# Define how each type of field is laid out. A swap is a flag marking whether it's present, followed by its available and used memory.
+codes = {
+
+    "integer": "q",
+    "number": "d",
+    "swap": "Bqq"
+
+}
+
+# Define the fields of each kind of section as pairs of a name and a type.
+section_fields = {
+
+    "latency": (("requested_at", "integer"),),
+    "interface": (("name", "string"), ("ipv6", "string"), ("ipv4", "string"), ("mac", "string")),
+    "cpu": (("threads", "integer"), ("cores", "integer"), ("model", "string"), ("load", "number")),
+    "memory": (("available", "integer"), ("used", "integer"), ("swap", "swap")),
+    "mounting_point": (("path", "string"), ("used", "integer"), ("available", "integer")),
+    "echo": (("ping", "string"),)
+
+}
+
+# Define which sections a batch may hold, in the order they're laid out, and the bit of the batch's flags that marks each single-valued section as present. Another bit marks when the batch was collected as present, which is laid out before every section.
+batch_sections = (("latency", "latency", 1), ("echo", "echo", 2), ("cpu", "cpu", 4), ("memory", "memory", 8))
+batch_lists = (("interfaces", "interface"), ("mounting_points", "mounting_point"))
+collected_at_bit = 16
+
+# Define the layouts of the header and of a batch's flags, when it was collected and its list lengths.
+header = struct.Struct("<BBH")
+flags = struct.Struct("<B")
+collected_at = struct.Struct("<d")
+count = struct.Struct("<H")
+
+# Define a class to represent the layout of a kind of section, compiled once into functions that read a section or a list of sections with a single unpack and a single decode of all of their strings.
+class Layout:
+
+    def __init__(self, fields):
+
+        # Numeric fields are laid out first, then the swap if the section has one, then a mask of which strings are null if the section has strings.
+        self.numbers = tuple(name for name, kind in fields if kind in ("integer", "number"))
+        self.swap = next((name for name, kind in fields if kind == "swap"), None)
+        self.strings = tuple(name for name, kind in fields if kind == "string")
+        self.codes = "".join(codes[kind] for name, kind in fields if kind in ("integer", "number")) + (codes["swap"] if self.swap else "")
+        self.struct = struct.Struct(self.format(1))
+        self.structs = {1: self.struct}
+
+        # Name the local each field is read into.
+        values = {name: "number_" + str(position) for position, name in enumerate(self.numbers)}
+        values.update((name, "string_" + str(position)) for position, name in enumerate(self.strings))
+        unpacked = [values[name] for name in self.numbers]
+
+        if self.swap is not None:
+            unpacked += ["swap_present", "swap_available", "swap_used"]
+            values[self.swap] = "({'available': swap_available, 'used': swap_used} if swap_present else None)"
+
+        section = "{" + ", ".join(repr(name) + ": " + values[name] for name, kind in fields) + "}"
+
+        # Generate the source of a function that unpacks every fixed-size field of a section into a local, splits out its strings and builds the section in one go. Strings that run past the end of the message leave the offset past it, which the caller reports.
+        source = ["def read(data, offset):", "    " + "".join(value + ", " for value in unpacked + (["mask", "total"] if self.strings else [])) + "= unpack_from(data, offset)", "    offset += " + str(self.struct.size)]
+
+        if self.strings:
+
+            source += [
+
+                "    strings = data[offset:offset + total].decode().split('\\0')",
+                "    if len(strings) != " + str(len(self.strings)) + ":",
+                "        raise ValueError(" + repr(malformed_strings) + ")",
+                "    " + "".join(values[name] + ", " for name in self.strings) + "= strings",
+                "    offset += total"
+
+            ]
+
+            for position, name in enumerate(self.strings):
+                source += ["    if mask & " + str(1 << position) + ":", "        " + values[name] + " = None"]
+
+        source.append("    return " + section + ", offset")
+
+        # Generate the source of a function that builds a list of sections from the columns of their fields.
+        source += ["def build(columns):", "    return [" + section + " for " + "".join(value + ", " for value in unpacked + [values[name] for name in self.strings]) + "in zip(*columns)]"]
+
+        namespace = {"unpack_from": self.struct.unpack_from}
+        exec("\n".join(source), namespace)
+
+        # Read a section starting at an offset, returning its fields and the offset just past it.
+        self.read = namespace["read"]
+        self.build = namespace["build"]
+
+    # Retrieve the format of a list of so many sections, which lays out each fixed-size field of every section in turn, followed by the mask of every section and the length of their strings.
+    def format(self, size):
+        return "<" + "".join(str(size) + code for code in self.codes) + (str(size) + "BI" if self.strings else "")
+
+    # Retrieve the compiled layout of a list of so many sections. The layouts of the lengths of list clients send are kept, up to a limit so that lists of every possible length can't fill memory.
+    def list_struct(self, size):
+
+        compiled = self.structs.get(size)
+        if compiled is None:
+
+            compiled = struct.Struct(self.format(size))
+            if len(self.structs) < max_list_structs:
+                self.structs[size] = compiled
+
+        return compiled
+
+    # Read a list of so many sections starting at an offset, returning them and the offset just past them. An empty list takes up no space.
+    def read_list(self, data, offset, size):
+
+        if size == 0:
+            return [], offset
+
+        # Unpack every fixed-size field of every section at once, splitting the values into a column per field.
+        compiled = self.list_struct(size)
+        values = compiled.unpack_from(data, offset)
+        offset += compiled.size
+
+        fixed = len(self.codes) * size
+        columns = [values[position:position + size] for position in range(0, fixed, size)]
+
+        if not self.strings:
+            return self.build(columns), offset
+
+        # Decode and split every string at once, then split them into a column per field.
+        masks = values[fixed:-1]
+        total = values[-1]
+        strings = data[offset:offset + total].decode().split("\0")
+
+        if len(strings) != len(self.strings) * size:
+            raise ValueError(malformed_strings)
+
+        columns += [strings[position:position + size] for position in range(0, len(strings), size)]
+        sections = self.build(columns)
+
+        # Null strings were laid out as empty strings, and are marked in their section's mask.
+        if masks.count(0) != size:
+
+            for section, mask in zip(sections, masks):
+
+                for position, name in enumerate(self.strings):
+
+                    if mask & 1 << position:
+                        section[name] = None
+
+        return sections, offset + total
+
+    # Write a list of sections. An empty list takes up no space.
+    def write_list(self, bodies, parts):
+
+        if not bodies:
+            return
+
+        values = [body[name] for name in self.numbers for body in bodies]
+
+        if self.swap is not None:
+
+            swaps = [body[self.swap] for body in bodies]
+            values += [0 if swap is None else 1 for swap in swaps]
+            values += [0 if swap is None else swap[name] for name in ("available", "used") for swap in swaps]
+
+        if not self.strings:
+            parts.append(self.list_struct(len(bodies)).pack(*values))
+            return
+
+        strings = ["" if body[name] is None else body[name] for name in self.strings for body in bodies]
+        for string in strings:
+
+            if "\0" in string:
+                raise ValueError("A string with a null character can't be encoded.")
+
+        encoded = "\0".join(strings).encode()
+        masks = [sum(1 << position for position, name in enumerate(self.strings) if body[name] is None) for body in bodies]
+
+        parts.append(self.list_struct(len(bodies)).pack(*values, *masks, len(encoded)))
+        parts.append(encoded)
+
+    # Write a section, which is laid out the same as a list holding only that section.
+    def write(self, body, parts):
+        self.write_list([body], parts)
+
+# Compile the layout of each kind of section.
+layouts = {kind: Layout(fields) for kind, fields in section_fields.items()}
+
+# Read the body of a message, which is everything after its token.
+def read_body(data, offset, kind):
+
+    # Batches start with flags marking whether when they were collected and which single-valued sections follow, and end with each list of sections prefixed by its length.
+    if kind == "batch":
+
+        body = {"collected_at": None}
+        present = flags.unpack_from(data, offset)[0]
+        offset += flags.size
+
+        if present & collected_at_bit:
+            body["collected_at"] = collected_at.unpack_from(data, offset)[0]
+            offset += collected_at.size
+
+        for section, section_kind, bit in batch_sections:
+
+            if present & bit:
+                body[section], offset = layouts[section_kind].read(data, offset)
+
+            else:
+                body[section] = None
+
+        for section, section_kind in batch_lists:
+
+            size = count.unpack_from(data, offset)[0]
+            offset += count.size
+
+            body[section], offset = layouts[section_kind].read_list(data, offset, size)
+
+        return body, offset
+
+    return layouts[kind].read(data, offset)
+
+# Decode a message into the request body it stands for, raising a ValueError if it isn't a well-formed message of the expected kind.
+def decode(data, kind):
+
+    try:
+
+        message_version, message_kind, token_length = header.unpack_from(data, 0)
+
+        if message_version != version:
+            raise ValueError("The binary report's version isn't supported.")
+
+        if message_kind != kinds[kind]:
+            raise ValueError("The binary report isn't the kind this endpoint accepts.")
+
+        offset = header.size + token_length
+        if offset > len(data):
+            raise ValueError("The binary report ends unexpectedly.")
+
+        body, end = read_body(data, offset, kind)
+        body["token"] = data[header.size:offset].decode()
+
+    # Running out of data part way through a section is reported the same as running out anywhere else.
+    except struct.error:
+        raise ValueError("The binary report ends unexpectedly.")
+
+    except UnicodeDecodeError:
+        raise ValueError("The binary report contains a string that isn't valid UTF-8.")
+
+    if end > len(data):
+        raise ValueError("The binary report ends unexpectedly.")
+
+    if end != len(data):
+        raise ValueError("The binary report has unexpected trailing data.")
+
+    return body
+
+# Encode a request body as a message of a kind. This is what clients use to send binary reports.
+def encode(body, kind):
+
+    token = body["token"].encode()
+    parts = [header.pack(version, kinds[kind], len(token)), token]
+
+    if kind == "batch":
+
+        present = sum(bit for section, section_kind, bit in batch_sections if body.get(section) is not None)
+        if body.get("collected_at") is None:
+            parts.append(flags.pack(present))
+
+        else:
+            parts += [flags.pack(present | collected_at_bit), collected_at.pack(body["collected_at"])]
+
+        for section, section_kind, bit in batch_sections:
+
+            if body.get(section) is not None:
+                layouts[section_kind].write(body[section], parts)
+
+        for section, section_kind in batch_lists:
+
+            entries = body.get(section) or []
+            parts.append(count.pack(len(entries)))
+            layouts[section_kind].write_list(entries, parts)
+
+    else:
+        layouts[kind].write(body, parts)
+
+    return b"".join(parts)
@@ -0,0 +1,195 @@
+'''
+
+    We aim to push every accepted report to the dashboards watching it as it arrives, so that they never have to poll records out of the database.
+
+    Reports are published to a hub in the process that accepted them, which hands each subscriber its own copy through a bounded buffer. A subscriber that falls behind loses its oldest updates rather than holding up the report being published, so ingest never waits on a slow dashboard. Each update is serialized once, however many subscribers receive it.
+
+    Clients are identified in updates and subscriptions by their opaque identifier, never by their token, which is their secret.
+
+'''
+
+import collections, itertools, json, os, threading, time
+
+# Import our configuration.
+import config
+
+# Import the identifiers clients are known by, which unlike their tokens may be shown to others.
+from tokens import identifier_of
+
+# Define the sections of a report that are published as updates, which subscribers may filter by.
+sections = ("latency", "round_trip", "interfaces", "cpu", "memory", "mounting_points")
+
+# Define a class to represent a single subscriber, with the clients and metrics it wants updates of and the updates it has yet to receive.
+class Subscription:
+
+    def __init__(self, clients=None, metrics=None, buffer_size=config.stream_buffer_size):
+
+        # Store our filters, either of which may be None to receive updates of every client or metric.
+        self.clients = clients
+        self.metrics = metrics
+
+        # Store the updates we haven't sent yet, dropping the oldest once the buffer is full, alongside how many were dropped since we last sent any.
+        self.messages = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.condition = threading.Condition(threading.Lock())
+
+    # Add an update to the buffer. This never waits on the subscriber, only on the lock it holds for as long as it takes to empty the buffer.
+    def put(self, message):
+
+        with self.condition:
+
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+
+            # The subscriber only ever waits on an empty buffer, so it only needs waking for the first update.
+            if not self.messages:
+                self.condition.notify()
+
+            self.messages.append(message)
+
+    # Take every buffered update, waiting up to the timeout for one to arrive. Returns the updates alongside how many were dropped before them.
+    def get(self, timeout=None):
+
+        with self.condition:
+
+            if not self.messages:
+                self.condition.wait(timeout)
+
+            messages = list(self.messages)
+            self.messages.clear()
+
+            dropped = self.dropped
+            self.dropped = 0
+
+        return messages, dropped
+
+# Define a class to represent the hub that reports are published to and subscribers receive them from.
+class Hub:
+
+    def __init__(self):
+
+        # Store subscribers by the identifiers of the clients they want updates of, so that publishing a report only visits the subscribers that want it, alongside those that want every client.
+        self.by_client = {}
+        self.everyone = set()
+        self.lock = threading.Lock()
+
+        # Number every update, so that subscribers can tell their place in the stream.
+        self.sequence = itertools.count(1)
+
+        # Remember which process owns this hub.
+        self.pid = os.getpid()
+
+    # Add a subscriber, which receives updates of any of the clients and metrics given, or of every client or metric if they're None.
+    def subscribe(self, clients=None, metrics=None):
+
+        subscription = Subscription(None if clients is None else frozenset(clients), None if metrics is None else frozenset(metrics))
+
+        with self.lock:
+
+            if subscription.clients is None:
+                self.everyone.add(subscription)
+
+            else:
+
+                for client in subscription.clients:
+                    self.by_client.setdefault(client, set()).add(subscription)
+
+        return subscription
+
+    # Remove a subscriber.
+    def unsubscribe(self, subscription):
+
+        with self.lock:
+
+            if subscription.clients is None:
+                self.everyone.discard(subscription)
+                return
+
+            for client in subscription.clients:
+
+                subscribers = self.by_client.get(client)
+                if subscribers is None:
+                    continue
+
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.by_client[client]
+
+    # Publish a report that was accepted for a client as an update of each of its sections, where a report may contain any of the "latency", "round_trip", "interfaces", "cpu", "memory" and "mounting_points" sections.
+    def publish(self, token, report):
+
+        # Most reports have nobody watching them, which we can tell without taking the lock, and usually before working out the client's identifier.
+        if not self.everyone and not self.by_client:
+            return
+
+        client = identifier_of(token)
+        if not self.everyone and client not in self.by_client:
+            return
+
+        with self.lock:
+            subscriptions = list(self.everyone) + list(self.by_client.get(client, ()))
+
+        published_at = time.time()
+
+        for section in sections:
+
+            value = report.get(section)
+            if value is None or value == []:
+                continue
+
+            recipients = [subscription for subscription in subscriptions if subscription.metrics is None or section in subscription.metrics]
+            if not recipients:
+                continue
+
+            # Format the update as a server-sent event once, and share it between every subscriber.
+            sequence = next(self.sequence)
+            message = "id: " + str(sequence) + "\nevent: update\ndata: " + json.dumps({"client": client, "metric": section, "value": value, "published_at": published_at}, separators=(",", ":")) + "\n\n"
+
+            for subscription in recipients:
+                subscription.put(message)
+
+# Store the process-wide hub.
+hub = None
+hub_lock = threading.Lock()
+
+# Retrieve the process-wide hub, creating it on first use.
+def get_hub():
+
+    global hub
+
+    # Each worker process only publishes the reports it accepts itself, so it needs its own hub.
+    if hub is not None and hub.pid == os.getpid():
+        return hub
+
+    with hub_lock:
+
+        if hub is None or hub.pid != os.getpid():
+            hub = Hub()
+
+    return hub
+
+# Iterate the server-sent events of a new subscriber until the client goes away, sending a comment whenever the stream has been quiet for the keep-alive interval so that proxies keep it open and a client that's gone is noticed. We only subscribe once the stream starts, so a response that's never sent can't leave a subscriber behind.
+def stream(hub, clients=None, metrics=None, keepalive_interval=config.stream_keepalive_interval):
+
+    subscription = hub.subscribe(clients, metrics)
+
+    try:
+
+        # Ask clients to wait a few seconds before reconnecting, and let them know the stream is open.
+        yield "retry: 5000\n: connected\n\n"
+
+        while True:
+
+            messages, dropped = subscription.get(keepalive_interval)
+
+            if dropped:
+                yield "event: dropped\ndata: " + json.dumps({"dropped": dropped}) + "\n\n"
+
+            if messages:
+                yield "".join(messages)
+
+            elif not dropped:
+                yield ": keep-alive\n\n"
+
+    finally:
+        hub.unsubscribe(subscription)
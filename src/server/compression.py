@@ -0,0 +1,87 @@
+'''
+
+    We aim to store values in a fraction of the space their JSON takes, by compressing each one against a preset dictionary of the strings that recur across every record and audit log, so that even a small section compresses well on its own.
+
+    Compressed values start with a byte giving the version of their format, which picks the dictionary they were compressed against. That byte can never start a JSON document, so values stored before we compressed them, and values too small to be worth compressing, are read as they are.
+
+'''
+
+import json, zlib
+
+# Import our configuration.
+import config
+
+# Define the dictionary of each version of the format. A dictionary must never change once values have been compressed against it, so an improved one needs a new version. Matches near the end of a dictionary are the cheapest to refer to, so the most common strings come last.
+dictionaries = {
+
+    1: "".join((
+
+        # The indexes of metric histories and audit logs, and the metrics a client has a history of.
+        "[\"cpu\", \"memory\", \"latency\", \"disk:/\"]",
+        "{\"head\": 0, \"chunks\": {\"0\": [1440, 17",
+        "{\"head\": 0, \"segments\": {\"0\": [256, 17",
+
+        # The sections of a record, with the values most clients share.
+        "{\"threads\": 16, \"cores\": 8, \"model\": \"Intel(R) Core(TM) i7-8700 CPU @ 3.20GHz\", \"load\": 0.",
+        "{\"threads\": 8, \"cores\": 4, \"model\": \"AMD Ryzen 7 5800X 8-Core Processor\", \"load\": 1.",
+        "{\"available\": 33554432000, \"used\": 12884901888, \"swap\": null}",
+        "{\"available\": 16777216000, \"used\": 8589934592, \"swap\": {\"available\": 8589934592, \"used\": 0}}",
+        "{\"docker0\": {\"name\": \"docker0\", \"ipv6\": null, \"ipv4\": \"172.17.0.1\", \"mac\": \"02:42:ac:11:00:02\", \"seen_at\": 17",
+        "{\"lo\": {\"name\": \"lo\", \"ipv6\": \"::1\", \"ipv4\": \"127.0.0.1\", \"mac\": \"00:00:00:00:00:00\", \"seen_at\": 17",
+        "{\"eth0\": {\"name\": \"eth0\", \"ipv6\": \"fe80::\", \"ipv4\": \"192.168.1.",
+        "{\"/\": {\"path\": \"/\", \"used\": ",
+        "{\"/home\": {\"path\": \"/home\", \"used\": ",
+        ", \"available\": ",
+        ", \"seen_at\": 17",
+        "{\"created_at\": 17",
+        ", \"updated_at\": 17",
+
+        # The events of audit logs, which make up most of what we store.
+        "{\"timestamp\": 17",
+        ", \"description\": \"A new record was generated.\", \"event\": \"created_record\"}",
+        ", \"description\": \"Network interface eth0 was removed.\", \"event\": \"network_interface_removed\"}",
+        ", \"description\": \"Mounting point / was removed.\", \"event\": \"mounting_point_removed\"}",
+        ", \"description\": \"Network interface eth0 was updated.\", \"event\": \"network_interface_updated\"}",
+        ", \"description\": \"Mounting point / was updated.\", \"event\": \"network_interface_updated\"}",
+        ", \"description\": \"Memory information was updated.\", \"event\": \"memory_updated\"}",
+        ", \"description\": \"CPU information was updated.\", \"event\": \"cpu_updated\"}",
+        ", \"description\": \"Network latency was updated.\", \"event\": \"network_latency_updated\"}, "
+
+    )).encode()
+
+}
+
+# Version 2 is version 1 with mounting point updates logged under their own event, rather than the event of network interface updates they were once logged under.
+dictionaries[2] = dictionaries[1].replace(b"Mounting point / was updated.\", \"event\": \"network_interface_updated\"", b"Mounting point / was updated.\", \"event\": \"mounting_point_updated\"")
+
+# Define the version of the format values are compressed in.
+version = 2
+
+# Compress a serialized value with the current version's dictionary. Values that don't come out smaller are left as they are, as are all values if compression is disabled.
+def compress(data, level=config.compression_level):
+
+    if level == 0:
+        return data
+
+    # Raw deflate streams leave out the header and checksum of a zlib stream, which would otherwise cost small values more than the dictionary saves them.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionaries[version])
+    compressed = bytes((version,)) + compressor.compress(data) + compressor.flush()
+
+    return compressed if len(compressed) < len(data) else data
+
+# Decompress a stored value, returning values that weren't compressed as they are.
+def decompress(data):
+
+    # JSON documents start with printable characters or whitespace, never with a byte below a tab.
+    if not data or data[0] >= 0x09:
+        return data
+
+    if data[0] not in dictionaries:
+        raise ValueError("The value was compressed by a newer version of the server.")
+
+    decompressor = zlib.decompressobj(-15, zdict=dictionaries[data[0]])
+    return decompressor.decompress(data[1:]) + decompressor.flush()
+
+# Decode a value stored as JSON, which may have been compressed.
+def loads(data):
+    return json.loads(data if isinstance(data, str) else decompress(data))
@@ -0,0 +1,130 @@
+'''
+
+    We aim to provide a single place to configure the server, with every setting overridable through an environment variable.
+
+'''
+
+import os
+
+# Define the path to the database file.
+database_path = os.environ.get("MONITOR_DATABASE_PATH", "monitor.sqlite")
+
+# Define how many values the storage layer keeps decoded in memory before evicting the least recently used one.
+cache_size = int(os.environ.get("MONITOR_CACHE_SIZE", "4096"))
+
+# Define how often, in seconds, dirty values are written back to the database in the background.
+flush_interval = float(os.environ.get("MONITOR_FLUSH_INTERVAL", "5"))
+
+# Define how many dirty values may accumulate before we write them back without waiting for the interval.
+flush_threshold = int(os.environ.get("MONITOR_FLUSH_THRESHOLD", "256"))
+
+# Define how many events each segment of an audit log holds before a new segment is started.
+audit_segment_size = int(os.environ.get("MONITOR_AUDIT_SEGMENT_SIZE", "256"))
+
+# Define how many segments of each audit log we retain, which bounds the log to this many times the segment size.
+audit_max_segments = int(os.environ.get("MONITOR_AUDIT_MAX_SEGMENTS", "64"))
+
+# Define how long, in seconds, audit events are retained.
+audit_max_age = float(os.environ.get("MONITOR_AUDIT_MAX_AGE", str(30 * 24 * 60 * 60)))
+
+# Define how often, in seconds, retention is applied to every audit log, so that expired events are dropped even from the logs of clients that have stopped reporting.
+audit_compact_interval = float(os.environ.get("MONITOR_AUDIT_COMPACT_INTERVAL", str(60 * 60)))
+
+# Define how many samples each chunk of a metric's history holds.
+history_chunk_size = int(os.environ.get("MONITOR_HISTORY_CHUNK_SIZE", "1440"))
+
+# Define how many samples of each metric's history we retain, which defaults to a year of one-minute samples.
+history_capacity = int(os.environ.get("MONITOR_HISTORY_CAPACITY", str(365 * 24 * 60)))
+
+# Define how long, in seconds, each tier of rolled up history is retained.
+rollup_minute_retention = int(os.environ.get("MONITOR_ROLLUP_MINUTE_RETENTION", str(7 * 24 * 60 * 60)))
+rollup_hour_retention = int(os.environ.get("MONITOR_ROLLUP_HOUR_RETENTION", str(90 * 24 * 60 * 60)))
+rollup_day_retention = int(os.environ.get("MONITOR_ROLLUP_DAY_RETENTION", str(5 * 365 * 24 * 60 * 60)))
+
+# Define which storage engine records are kept in, either "dbm" for the key-value database or "sqlite" for typed SQLite tables.
+backend = os.environ.get("MONITOR_BACKEND", "dbm")
+
+# Define the path to the SQLite database used by the "sqlite" storage engine.
+sqlite_path = os.environ.get("MONITOR_SQLITE_PATH", "monitor.db")
+
+# Define how reports are written, either "sync" to write each report before responding or "queue" to respond right away and leave the writing to a single writer thread. There's a writer per process, so under a server with several worker processes, each writes on its own. With SQLite, records are loaded and saved within transactions that hold the database's write lock, so the writes of different workers to the same record never overwrite each other. A key-value database can only be used by one worker process.
+ingest_mode = os.environ.get("MONITOR_INGEST_MODE", "sync")
+
+# Define how many reports may wait for the writer before we start turning reports away.
+ingest_queue_size = int(os.environ.get("MONITOR_INGEST_QUEUE_SIZE", "10000"))
+
+# Define how long, in milliseconds, the writer waits to collect a batch, and how many reports a batch may hold.
+ingest_batch_interval = float(os.environ.get("MONITOR_INGEST_BATCH_INTERVAL", "50"))
+ingest_batch_size = int(os.environ.get("MONITOR_INGEST_BATCH_SIZE", "500"))
+
+# Define how many databases records are partitioned across by a hash of their token. Each shard's database is named after the configured path, such as "monitor.0.sqlite".
+shards = int(os.environ.get("MONITOR_SHARDS", "1"))
+
+# Define how long, in seconds, an interface or mounting point may go unreported before it's removed from its record.
+stale_ttl = float(os.environ.get("MONITOR_STALE_TTL", str(24 * 60 * 60)))
+
+# Define how often, in seconds, the fleet's indexes and summary are rebuilt from the stored records. Each worker process keeps its own, updated by the reports it writes itself, so this is how long a worker may take to see what the others have written.
+fleet_recompute_interval = float(os.environ.get("MONITOR_FLEET_RECOMPUTE_INTERVAL", "60"))
+
+# Define the fraction of a mounting point that must be used before the fleet summary counts it as nearly full.
+disk_usage_threshold = float(os.environ.get("MONITOR_DISK_USAGE_THRESHOLD", "0.9"))
+
+# Define how long, in seconds, a client may go without reporting before the fleet summary counts it as stale.
+stale_host_after = float(os.environ.get("MONITOR_STALE_HOST_AFTER", str(10 * 60)))
+
+# Define how many samples or audit events an export reads at once, and how many rows of each type a block of a columnar export holds.
+export_page_size = int(os.environ.get("MONITOR_EXPORT_PAGE_SIZE", "1000"))
+export_block_size = int(os.environ.get("MONITOR_EXPORT_BLOCK_SIZE", "4096"))
+
+# Define roughly how many bytes of newline-delimited JSON an export collects before sending them on.
+export_chunk_size = int(os.environ.get("MONITOR_EXPORT_CHUNK_SIZE", "65536"))
+
+# Define how hard values stored in the key-value database are compressed, from 1 for the fastest to 9 for the smallest, or 0 to store them uncompressed.
+compression_level = int(os.environ.get("MONITOR_COMPRESSION_LEVEL", "6"))
+
+# Define how many updates each subscriber to the live stream may fall behind by before the oldest are dropped.
+stream_buffer_size = int(os.environ.get("MONITOR_STREAM_BUFFER_SIZE", "256"))
+
+# Define how often, in seconds, a quiet live stream is sent a keep-alive comment.
+stream_keepalive_interval = float(os.environ.get("MONITOR_STREAM_KEEPALIVE_INTERVAL", "15"))
+
+# Define the path to the JSON file of alert rules, each of which fires once a metric has broken a threshold for a while. Without the file, there are no alerts.
+alert_rules_path = os.environ.get("MONITOR_ALERT_RULES", "alerts.json")
+
+# Define where alerts are delivered as they start and stop firing: a URL they're posted to as JSON, a command that reads them from its standard input, or both.
+alert_webhook = os.environ.get("MONITOR_ALERT_WEBHOOK", "")
+alert_command = os.environ.get("MONITOR_ALERT_COMMAND", "")
+
+# Define how many alerts may wait to be delivered before we start dropping them, and how long, in seconds, each delivery may take.
+alert_queue_size = int(os.environ.get("MONITOR_ALERT_QUEUE_SIZE", "1000"))
+alert_timeout = float(os.environ.get("MONITOR_ALERT_TIMEOUT", "5"))
+
+# Define the relative error the percentiles of round-trip times are answered to, and how many buckets each sketch of them may hold, which bounds its memory.
+sketch_relative_accuracy = float(os.environ.get("MONITOR_SKETCH_RELATIVE_ACCURACY", "0.01"))
+sketch_max_buckets = int(os.environ.get("MONITOR_SKETCH_MAX_BUCKETS", "2048"))
+
+# Define the length, in seconds, of the windows round-trip times are sketched over. Percentiles cover between one and two windows.
+sketch_window = int(os.environ.get("MONITOR_SKETCH_WINDOW", str(60 * 60)))
+
+# Define how far ahead of the server's clock, in seconds, a batch's collection time may be, which covers small differences between clocks, and how old a batch may be when it arrives. Batches are replayed from a client's spool after an outage, so they may be quite old.
+collected_at_skew = float(os.environ.get("MONITOR_COLLECTED_AT_SKEW", "60"))
+collected_at_max_age = float(os.environ.get("MONITOR_COLLECTED_AT_MAX_AGE", str(7 * 24 * 60 * 60)))
+
+# Define the secret pings are signed with, which every worker must share. Without one, each process signs with its own random secret, so an echo must reach the worker that issued its ping.
+ping_secret = os.environ.get("MONITOR_PING_SECRET", "")
+
+# Define how long, in seconds, a ping may go unanswered before its echo is turned away.
+ping_ttl = float(os.environ.get("MONITOR_PING_TTL", "30"))
+
+# Define the path to the JSON file of the tokens clients authenticate with, which is reloaded whenever it changes, and how often, in seconds, we check whether it has. Without the file, only the development token is accepted.
+tokens_path = os.environ.get("MONITOR_TOKENS_PATH", "tokens.json")
+tokens_reload_interval = float(os.environ.get("MONITOR_TOKENS_RELOAD_INTERVAL", "5"))
+
+# Define how many requests each token may make to each endpoint, unless its entry in the registry says otherwise. An empty limit lets tokens make as many requests as they like. A client reporting every minute spends one ping and one batch a minute, and up to its burst of batches a minute while it replays a backlog from its spool, so the default leaves room for the client's default burst of 5 with margin to spare.
+token_rate_limit = os.environ.get("MONITOR_TOKEN_RATE_LIMIT", "600 per hour")
+
+# Define the path to the SQLite database the rate limits of tokens are counted in, which every worker shares.
+rate_limit_path = os.environ.get("MONITOR_RATE_LIMIT_PATH", "ratelimits.sqlite")
+
+# Define how many requests each address may make to each endpoint, whatever token they're made with, which guards against floods of requests with invalid tokens. Many clients may share an address behind NAT, so this should be well above the limit of a token. An empty limit turns it off.
+address_rate_limit = os.environ.get("MONITOR_ADDRESS_RATE_LIMIT", "6000 per hour")
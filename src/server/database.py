@@ -4,9 +4,28 @@
 
 '''
 
-import json, time, dbm
+import time
 
-# Define a default unpopulated unserialized database record.
+# Import our configuration.
+import config
+
+# Import the storage engines.
+from backends import get_backend
+
+# Import the fleet's indexes.
+from fleet import get_fleet, index_values, indexed_sections
+
+# Import the alert rules samples are checked against.
+from alerts import get_alerts
+
+# Import the sketches of round-trip times.
+import sketch
+
+# Import the typed sections records are held in.
+import sections
+from sections import Cpu, Interface, Memory, MountingPoint, Swap
+
+# Define the layout of a whole record for documentation purposes, which is the layout Record.record assembles and the layout records were stored in before each section was stored on its own. Records are never created from it, as each section's default is a new typed section.
 default_schema = {
 
     # Store the metadata pertaining to the record.
@@ -80,7 +99,22 @@ default_network_interface_schema = {
     "name": None,
     "ipv6": None,
     "ipv4": None,
-    "mac": None 
+    "mac": None,
+
+    # Store when the interface was last reported, so that interfaces the client stops reporting can be removed.
+    "seen_at": None
+
+}
+
+# Define the sub-schema for the mounted disks for documentation purposes.
+default_mounting_point_schema = {
+
+    "path": None,
+    "used": None,
+    "available": None,
+
+    # Store when the mounting point was last reported, so that mounting points the client stops reporting can be removed.
+    "seen_at": None
 
 }
 
@@ -103,6 +137,14 @@ memory_schema = {
 
 }
 
+# Define the sections that map a name to each entry, alongside how their entries are described in the audit log and the event logged when one is removed.
+keyed_sections = {
+
+    "interfaces": ("Network interface ", "network_interface_removed"),
+    "mounting_points": ("Mounting point ", "mounting_point_removed")
+
+}
+
 # Define a class to represent a record in the database.
 class Record:
 
@@ -112,204 +154,272 @@ class Record:
         # Store the token in the record class.
         self.token = token
 
-        # This must be kept always unserialized to be used later.
-        self.record = None
+        # Store the sections we've loaded so far, held as typed sections, alongside the sections we've changed. Each is a new object decoded from storage, so nothing else sees our changes until we save them.
+        self.sections = {}
+        self.dirty = set()
 
-        # Attempt to load the database file.
-        with dbm.open("monitor.sqlite", "c") as database:
+        # Store the round-trip times we've measured since we last saved, which are only counted in the fleet's sketches once they're committed.
+        self.round_trip_times = []
 
-            # Attempt to retrieve the client record from the database, if it exists.
-            try:
+        # Retrieve the storage engine that holds this record, which is one of several if records are sharded, and the audit logs and metric histories it stores alongside records.
+        self.backend = get_backend().shard(token)
+        self.audit_log = self.backend.audit_log
+        self.history = self.backend.history
+        self.rollups = self.backend.rollups
 
-                # Check if there is a record of the client in the database already and deserialize it.
-                serialized_record = database[self.token]
-                self.record = json.loads(serialized_record)
+        # If the record doesn't exist, we'll create a new one.
+        if self.section("metadata").created_at is None:
 
-            # If the record doesn't exist, we'll create a new one.
-            except KeyError:
-                # Copy the default schema into our record variable.
-                self.record = default_schema
+            # Update the record.
+            self.section("metadata").created_at = time.time()
+            self.log("A new record was generated.", "created_record")
 
-                # Update the record.
-                self.record["metadata"]["created_at"] = time.time()
-                self.record["metadata"]["updated_at"] = time.time()
-                self.record["metadata"]["audit_log"].append({
+            # Add the record to the database.
+            self.save()
 
-                    "timestamp": time.time(),
-                    "description": "A new record was generated.",
-                    "event": "created_record"
+    # Retrieve a section of the record, loading it from the storage layer the first time it's used. Sections that haven't been stored yet start from their default value.
+    def section(self, name):
 
-                })
+        if name not in self.sections:
+            self.sections[name] = sections.decode(name, self.backend.load(self.token, name))
 
-                # Serialize the record.
-                serialized_record = json.dumps(self.record)
+        return self.sections[name]
 
-                # Add the record to the database.
-                database[self.token] = serialized_record
-    
-    # This function will be used to either edit or add a new network latency to the record.
-    def set_network_latency(self, latency):
-        # Update the record.
-        self.record["data"]["analytics"]["network"]["latency"] = latency
+    # Replace the value of a section of the record.
+    def set_section(self, name, value):
+
+        self.sections[name] = value
+        self.dirty.add(name)
+
+    # Mark the record as updated and append an event to its audit log.
+    def log(self, description, event):
 
         # Update the record metadata.
-        self.record["metadata"]["updated_at"] = time.time()
-        self.record["metadata"]["audit_log"].append({
+        self.section("metadata").updated_at = time.time()
+        self.dirty.add("metadata")
+
+        # The audit log is stored on its own, so appending to it doesn't rewrite the rest of the record.
+        self.audit_log.append(self.token, {
 
             "timestamp": time.time(),
-            "description": "Network latency was updated.",
-            "event": "network_latency_updated"
+            "description": description,
+            "event": event
 
         })
 
-        # Serialize the record and update the database.
-        with dbm.open("monitor.sqlite", "c") as database:
+    # Keep a sample of a metric in its history, fold it into the metric's rolled up aggregates and check it against the alert rules. Samples are kept as of when they were collected, if the client says, or otherwise as of now. A sample too old for the history to keep isn't counted by the rollups either, so that both always agree.
+    def sample(self, metric, values, collected_at=None):
 
-            # Serialize the record.
-            serialized_record = json.dumps(self.record)
+        timestamp = time.time() if collected_at is None else collected_at
+        if self.history.append(self.token, metric, timestamp, values):
+            self.rollups.add(self.token, metric, timestamp, values)
 
-            # Update the record in the database.
-            database[self.token] = serialized_record
+        # Check the sample against the alert rules that watch it, keeping any alert that starts or stops firing in the audit log.
+        for alert in get_alerts().observe(self.token, metric, values, timestamp):
+            self.log(alert["description"], "alert_" + alert["state"])
 
-    # This function will be used to either edit or add a new network interface to the record.
-    def set_network_interfaces(self, interface):
+    # Assemble the whole record in the layout of the default schema, loading every section.
+    @property
+    def record(self):
 
-        if (len(self.record["data"]["analytics"]["network"]["interfaces"]) > 0):
+        return {
 
-            # Check if the interface name is already an object inside of the interface list.
-            for interface_record in self.record["data"]["analytics"]["network"]["interfaces"]:
+            "metadata": {
 
-                # If the interface name is already in the list, we'll update that record.
-                if interface["name"] == interface_record["name"]:
+                "created_at": self.section("metadata").created_at,
+                "updated_at": self.section("metadata").updated_at,
+                "audit_log": list(self.audit_log.entries(self.token))
 
-                    # Update the record.
-                    interface_record["ipv6"] = interface["ipv6"]
-                    interface_record["ipv4"] = interface["ipv4"]
-                    interface_record["mac"] = interface["mac"]
-                    break
+            },
+            "data": {
 
-                else:
+                "analytics": {
 
-                    # If the interface name is not in the list, we'll add it to the list.
-                    self.record["data"]["analytics"]["network"]["interfaces"].append(interface)
-                    break
-        
-        else:
-            # If the interface list is empty, we'll add the interface to the list.
-            self.record["data"]["analytics"]["network"]["interfaces"].append(interface)
+                    "network": {
 
-        # Update the record metadata.
-        self.record["metadata"]["updated_at"] = time.time()
-        self.record["metadata"]["audit_log"].append({
+                        "latency": self.section("latency"),
+                        "interfaces": [interface.encode() for interface in self.section("interfaces").values()]
 
-            "timestamp": time.time(),
-            "description": "Network interface " + interface["name"] + " was updated.",
-            "event": "network_interface_updated"
+                    },
+                    "cpu": self.section("cpu").encode(),
+                    "memory": self.section("memory").encode(),
+                    "disks": {
 
-        })
+                        "mounting_points": [mounting_point.encode() for mounting_point in self.section("mounting_points").values()]
 
-        # Serialize the record and update the database.
-        with dbm.open("monitor.sqlite", "c") as database:
+                    }
 
-            # Serialize the record.
-            serialized_record = json.dumps(self.record)
+                }
 
-            # Update the record in the database.
-            database[self.token] = serialized_record
+            }
 
-    def set_cpu(self, cpu):
-        
-        # Update the record.
-        self.record["data"]["analytics"]["cpu"]["threads"] = cpu["threads"]
-        self.record["data"]["analytics"]["cpu"]["cores"] = cpu["cores"]
-        self.record["data"]["analytics"]["cpu"]["model"] = cpu["model"]
-        self.record["data"]["analytics"]["cpu"]["load"] = cpu["load"]
+        }
 
-        # Update the record metadata.
-        self.record["metadata"]["updated_at"] = time.time()
-        self.record["metadata"]["audit_log"].append({
+    # This function will be used to write the changed sections of the record to the database, which lets several updates share a single write.
+    def save(self):
 
-            "timestamp": time.time(),
-            "description": "CPU information was updated.",
-            "event": "cpu_updated"
+        # Drop the interfaces and mounting points that haven't been reported for a while, which is only worth checking for the sections we've loaded.
+        self.remove_stale()
 
-        })
+        # Encode the changed sections into their stored layout, and work out their indexed fields from it, before handing them to the storage engine.
+        changed = {name: sections.encode(name, self.sections[name]) for name in self.dirty}
 
-        # Serialize the record and update the database.
-        with dbm.open("monitor.sqlite", "c") as database:
+        values = {}
+        for name in self.dirty & indexed_sections:
+            values.update(index_values(name, changed[name]))
 
-            # Serialize the record.
-            serialized_record = json.dumps(self.record)
+        # Hand each changed section to the storage engine.
+        self.backend.save(self.token, changed)
+        self.dirty.clear()
 
-            # Update the record in the database.
-            database[self.token] = serialized_record
+        # Keep the fleet's indexes and sketches up to date with what we've written, once it's committed, so that a write that's rolled back never shows up in them.
+        round_trip_times = self.round_trip_times
+        self.round_trip_times = []
 
-    def set_memory(self, memory):
+        if values or round_trip_times:
+            self.backend.after_commit(lambda: self.update_fleet(values, round_trip_times))
 
-        # Update the record.
-        self.record["data"]["analytics"]["memory"]["available"] = memory["available"]
-        self.record["data"]["analytics"]["memory"]["used"] = memory["used"]
-        self.record["data"]["analytics"]["memory"]["swap"] = memory["swap"]
+    # Update the fleet with the indexed fields and round-trip times of a committed write.
+    def update_fleet(self, values, round_trip_times):
+
+        fleet = get_fleet()
+
+        if values:
+            fleet.update(self.token, values)
+
+        for timestamp, round_trip_time in round_trip_times:
+            fleet.observe_round_trip_time(self.token, timestamp, round_trip_time)
+
+    # Remove the entries of the keyed sections we've loaded that haven't been reported within the staleness TTL.
+    def remove_stale(self):
+
+        stale_before = time.time() - config.stale_ttl
+
+        for section, (description, event) in keyed_sections.items():
+
+            entries = self.sections.get(section)
+            if not entries:
+                continue
+
+            for name in [name for name, entry in entries.items() if (entry.seen_at or 0) < stale_before]:
+
+                del entries[name]
+                self.dirty.add(section)
+                self.log(description + name + " was removed.", event)
+
+    # Apply a report to the record without writing it, where a report may contain any of the "latency", "round_trip", "interfaces", "cpu", "memory" and "mounting_points" sections, and when they were collected as "collected_at". Round-trip times are always measured as they arrive.
+    def apply(self, report):
+
+        collected_at = report.get("collected_at")
+
+        if report.get("latency") is not None:
+            self.set_network_latency(report["latency"], commit=False, collected_at=collected_at)
+
+        if report.get("round_trip") is not None:
+            self.set_round_trip_time(report["round_trip"], commit=False)
+
+        for interface in report.get("interfaces") or []:
+            self.set_network_interfaces(interface, commit=False)
+
+        if report.get("cpu") is not None:
+            self.set_cpu(report["cpu"], commit=False, collected_at=collected_at)
+
+        if report.get("memory") is not None:
+            self.set_memory(report["memory"], commit=False, collected_at=collected_at)
+
+        for mounting_point in report.get("mounting_points") or []:
+            self.set_disk_mounting_point(mounting_point, commit=False, collected_at=collected_at)
+
+    # This function will be used to either edit or add a new network latency to the record.
+    def set_network_latency(self, latency, commit=True, collected_at=None):
+
+        # Update the record, keeping the sample in the metric's history.
+        self.set_section("latency", latency)
+        self.sample("latency", (latency,), collected_at)
 
         # Update the record metadata.
-        self.record["metadata"]["updated_at"] = time.time()
-        self.record["metadata"]["audit_log"].append({
+        self.log("Network latency was updated.", "network_latency_updated")
 
-            "timestamp": time.time(),
-            "description": "Memory information was updated.",
-            "event": "memory_updated"
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
 
-        })
+    # Record a round-trip time the server measured, which replaces the client's network latency and is counted in the sketches of its round-trip times and the fleet's.
+    def set_round_trip_time(self, round_trip_time, commit=True):
 
-        # Serialize the record and update the database.
-        with dbm.open("monitor.sqlite", "c") as database:
+        # Update the record, keeping the sample in the latency's history.
+        self.set_section("latency", round_trip_time)
+        self.sample("latency", (round_trip_time,))
 
-            # Serialize the record.
-            serialized_record = json.dumps(self.record)
+        timestamp = time.time()
+        self.set_section("latency_sketch", sketch.observe(self.section("latency_sketch"), timestamp, round_trip_time))
+        self.round_trip_times.append((timestamp, round_trip_time))
 
-            # Update the record in the database.
-            database[self.token] = serialized_record
+        # Update the record metadata.
+        self.log("Round-trip time was measured.", "round_trip_measured")
 
-    def set_disk_mounting_point(self, mounting_point):
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
 
-        if (len(self.record["data"]["analytics"]["disks"]["mounting_points"]) > 0):
+    # This function will be used to either edit or add a new network interface to the record.
+    def set_network_interfaces(self, interface, commit=True):
 
-            # Check if the path is already an object inside of the path list.
-            for mounting_point_record in self.record["data"]["analytics"]["disks"]["mounting_points"]:
+        # Update the record. Interfaces are keyed by their name, so reporting an interface again replaces it rather than adding it a second time.
+        self.section("interfaces")[interface["name"]] = Interface(interface["name"], interface["ipv6"], interface["ipv4"], interface["mac"], time.time())
 
-                # If the path name is already in the list, we'll update that record.
-                if mounting_point["path"] == mounting_point_record["path"]:
+        self.dirty.add("interfaces")
 
-                    # Update the record.
-                    mounting_point_record["available"] = mounting_point["available"]
-                    mounting_point_record["used"] = mounting_point["used"]
-                    break
+        # Update the record metadata.
+        self.log("Network interface " + interface["name"] + " was updated.", "network_interface_updated")
 
-                else:
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
 
-                    # If the mounting point is not in the list, we'll add it to the list.
-                    self.record["data"]["analytics"]["disks"]["mounting_points"].append(mounting_point)
-                    break
-        
-        else:
-            # If the mounting point list is empty, we'll add the mounting point to the list.
-            self.record["data"]["analytics"]["disks"]["mounting_points"].append(mounting_point)
+    def set_cpu(self, cpu, commit=True, collected_at=None):
+
+        # Update the record.
+        self.set_section("cpu", Cpu(cpu["threads"], cpu["cores"], cpu["model"], cpu["load"]))
+
+        # Keep the sample in the metric's history.
+        self.sample("cpu", (cpu["load"],), collected_at)
 
         # Update the record metadata.
-        self.record["metadata"]["updated_at"] = time.time()
-        self.record["metadata"]["audit_log"].append({
+        self.log("CPU information was updated.", "cpu_updated")
 
-            "timestamp": time.time(),
-            "description": "Mounting point " + mounting_point["path"] + " was updated.",
-            "event": "network_interface_updated"
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
 
-        })
+    def set_memory(self, memory, commit=True, collected_at=None):
+
+        # Update the record.
+        self.set_section("memory", Memory(memory["available"], memory["used"], None if memory["swap"] is None else Swap.decode(memory["swap"])))
+
+        # Keep the sample in the metric's history.
+        self.sample("memory", (memory["available"], memory["used"]), collected_at)
+
+        # Update the record metadata.
+        self.log("Memory information was updated.", "memory_updated")
+
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
 
-        # Serialize the record and update the database.
-        with dbm.open("monitor.sqlite", "c") as database:
+    def set_disk_mounting_point(self, mounting_point, commit=True, collected_at=None):
 
-            # Serialize the record.
-            serialized_record = json.dumps(self.record)
+        # Update the record. Mounting points are keyed by their path, so reporting a mounting point again replaces it rather than adding it a second time.
+        self.section("mounting_points")[mounting_point["path"]] = MountingPoint(mounting_point["path"], mounting_point["used"], mounting_point["available"], time.time())
+
+        self.dirty.add("mounting_points")
+
+        # Keep the sample in the metric's history.
+        self.sample("disk:" + mounting_point["path"], (mounting_point["available"], mounting_point["used"]), collected_at)
+
+        # Update the record metadata.
+        self.log("Mounting point " + mounting_point["path"] + " was updated.", "mounting_point_updated")
 
-            # Update the record in the database.
-            database[self.token] = serialized_record
\ No newline at end of file
+        # Serialize the record and update the database, unless the caller is batching several updates into a single write.
+        if commit:
+            self.save()
@@ -0,0 +1,290 @@
+'''
+
+    We aim to export the records, metric samples and audit events of every client as a stream, so that the whole database can be shipped elsewhere without ever holding more than a page of it in memory.
+
+    Rows are produced one at a time by generators and encoded into chunks, either as newline-delimited JSON or in a columnar format where rows of the same type are grouped into blocks of columns, each compressed on its own. Every export ends with a watermark, which a later export can start from so that it only moves what's new. Records, samples and events are compared with the watermark by when they arrived rather than when they were collected, so that samples replayed from a client's spool after an export are still moved by the next.
+
+    The key-value database can only be opened by one process at a time, so with that storage engine this must only be run while the server is stopped. The export endpoint streams the same rows from a running server.
+
+    Clients are identified in every row by their opaque identifier rather than their token, which is their secret.
+
+    Usage: python export.py [--format ndjson|columnar] [--client IDENTIFIER ...] [--start TIME] [--end TIME] [--since WATERMARK] [--watermark-file PATH] [--include records,samples,events] [--output PATH]
+
+'''
+
+import argparse, json, math, os, struct, sys, time, zlib
+
+# Import our configuration.
+import config
+
+# Import the storage engines and the fields of each metric's samples.
+from backends import get_backend
+from history import fields_of
+
+# Import the identifiers clients are known by, which unlike their tokens may be shown to others.
+from tokens import identifier_of
+
+# Define the types of row an export may include.
+kinds = ("records", "samples", "events")
+
+# Define the content type of each format.
+content_types = {
+
+    "ndjson": "application/x-ndjson",
+    "columnar": "application/vnd.monitor.export"
+
+}
+
+# Columnar exports start with a line identifying the format, followed by frames of a compressed block prefixed by its length.
+columnar_magic = b"MONITOR-EXPORT 1\n"
+frame_header = struct.Struct("<I")
+
+# Retrieve the watermark of an export starting now. The current second is left to the next export, since a sample within it may still be replaced and a record may have been logged but not yet saved.
+def current_watermark():
+    return float(int(time.time()) - 1)
+
+# Iterate the tokens of every stored record alongside the shard holding it and the client's identifier, one shard at a time, optionally only those of some clients' identifiers.
+def iterate_tokens(backend, clients=None):
+
+    for shard in backend.shards:
+
+        for token in sorted(shard.tokens()):
+
+            client = identifier_of(token)
+            if clients is None or client in clients:
+                yield shard, token, client
+
+# Retrieve the row of a record, or None if it wasn't updated within the time range and after the watermark.
+def record_row(shard, token, client, start, end, since):
+
+    metadata = shard.load(token, "metadata") or {}
+    updated_at = metadata.get("updated_at")
+
+    if updated_at is None or (since is not None and updated_at <= since) or (start is not None and updated_at < start) or updated_at > end:
+        return None
+
+    # Keyed sections are exported as lists of their entries, as they're laid out in a whole record.
+    return {
+
+        "type": "record",
+        "client": client,
+        "created_at": metadata.get("created_at"),
+        "updated_at": updated_at,
+        "latency": shard.load(token, "latency"),
+        "interfaces": list((shard.load(token, "interfaces") or {}).values()),
+        "cpu": shard.load(token, "cpu"),
+        "memory": shard.load(token, "memory"),
+        "mounting_points": list((shard.load(token, "mounting_points") or {}).values())
+
+    }
+
+# Iterate the rows of every sample of a client's metrics within the time range that arrived after the watermark of an earlier export and by that of this one, reading a page of each metric's history at a time.
+def sample_rows(shard, token, client, start, end, since, watermark, page_size):
+
+    # Samples are kept to the second, and arrive at a second, so the bounds are rounded to the seconds they include.
+    first = None if start is None else math.ceil(start)
+    last = math.floor(end)
+    arrived_after = None if since is None else math.floor(since)
+    arrived_by = math.floor(watermark)
+
+    for metric in shard.history.metrics(token):
+
+        names = fields_of(metric)
+        if names is None:
+            continue
+
+        page_start = first
+        while True:
+
+            samples = shard.history.query(token, metric, page_start, last, page_size, arrived_after, arrived_by)
+
+            for sample in samples:
+                yield dict({"type": "sample", "client": client, "metric": metric, "timestamp": sample[0]}, **dict(zip(names, sample[1:])))
+
+            if len(samples) < page_size:
+                break
+
+            page_start = samples[-1][0] + 1
+
+# Iterate the rows of a client's audit events within the time range and after the watermark, reading a page of the audit log at a time.
+def event_rows(shard, token, client, start, end, since, page_size):
+
+    first = since if start is None else start if since is None else max(start, since)
+    cursor = None
+
+    while True:
+
+        entries, cursor = shard.audit_log.read(token, first, end, None, cursor, page_size)
+
+        for entry in entries:
+
+            # Events exactly at the watermark were included in the export that returned it.
+            if since is None or entry["timestamp"] > since:
+                yield dict({"type": "event", "client": client}, **entry)
+
+        if cursor is None:
+            break
+
+# Iterate every row to export up to a watermark, client by client. Every filter is optional: clients limits the export to the clients with some identifiers, start and end to an inclusive time range, and since to what changed after the watermark of an earlier export.
+def rows(backend, watermark, clients=None, start=None, end=None, since=None, include=kinds, page_size=config.export_page_size):
+
+    end = watermark if end is None else min(end, watermark)
+
+    for shard, token, client in iterate_tokens(backend, clients):
+
+        if "records" in include:
+
+            row = record_row(shard, token, client, start, end, since)
+            if row is not None:
+                yield row
+
+        if "samples" in include:
+            yield from sample_rows(shard, token, client, start, end, since, watermark, page_size)
+
+        if "events" in include:
+            yield from event_rows(shard, token, client, start, end, since, page_size)
+
+# Encode rows as newline-delimited JSON in chunks of roughly the given size, ending with a line holding the watermark.
+def ndjson(rows, watermark, chunk_size=config.export_chunk_size):
+
+    lines = []
+    size = 0
+
+    for row in rows:
+
+        line = json.dumps(row, separators=(",", ":")) + "\n"
+        lines.append(line)
+        size += len(line)
+
+        if size >= chunk_size:
+            yield "".join(lines).encode()
+            lines = []
+            size = 0
+
+    lines.append(json.dumps({"type": "watermark", "watermark": watermark}, separators=(",", ":")) + "\n")
+    yield "".join(lines).encode()
+
+# Encode a block of rows of the same type as a frame of compressed columns. Samples of different metrics have different fields, so a row without one of the block's fields has it as null.
+def encode_block(kind, block):
+
+    names = {}
+    for row in block:
+        names.update(dict.fromkeys(row))
+
+    names.pop("type", None)
+    columns = {name: [row.get(name) for row in block] for name in names}
+
+    data = zlib.compress(json.dumps({"type": kind, "count": len(block), "columns": columns}, separators=(",", ":")).encode())
+    return frame_header.pack(len(data)) + data
+
+# Encode rows in our columnar format, yielding each block as soon as it's full. Only a block of each type of row is held at once, and the export ends with a block holding the watermark.
+def columnar(rows, watermark, block_size=config.export_block_size):
+
+    yield columnar_magic
+    blocks = {}
+
+    for row in rows:
+
+        block = blocks.setdefault(row["type"], [])
+        block.append(row)
+
+        if len(block) >= block_size:
+            yield encode_block(row["type"], block)
+            blocks[row["type"]] = []
+
+    for kind, block in blocks.items():
+
+        if block:
+            yield encode_block(kind, block)
+
+    yield encode_block("watermark", [{"type": "watermark", "watermark": watermark}])
+
+# Iterate the rows of an export in our columnar format back out of a file, decoding one block at a time.
+def read_columnar(file):
+
+    if file.read(len(columnar_magic)) != columnar_magic:
+        raise ValueError("The file isn't an export in the columnar format.")
+
+    while True:
+
+        header = file.read(frame_header.size)
+        if not header:
+            return
+
+        if len(header) < frame_header.size:
+            raise ValueError("The export ends part way through a block.")
+
+        (length,) = frame_header.unpack(header)
+        data = file.read(length)
+
+        if len(data) < length:
+            raise ValueError("The export ends part way through a block.")
+
+        block = json.loads(zlib.decompress(data))
+        names = list(block["columns"])
+
+        for values in zip(*block["columns"].values()):
+            yield dict({"type": block["type"]}, **dict(zip(names, values)))
+
+# Start an export in a format, returning the watermark it covers up to alongside a generator of its chunks. Nothing is read until the chunks are iterated.
+def stream(backend, format="ndjson", clients=None, start=None, end=None, since=None, include=kinds):
+
+    if format not in content_types:
+        raise ValueError("Unknown export format " + repr(format) + ".")
+
+    # A watermark is never moved backwards, even if the clock has gone backwards since it was returned.
+    watermark = current_watermark() if since is None else max(current_watermark(), since)
+    encode = ndjson if format == "ndjson" else columnar
+
+    return watermark, encode(rows(backend, watermark, clients, start, end, since, include), watermark)
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Export every client's records, samples and audit events.")
+    parser.add_argument("--format", default="ndjson", choices=tuple(content_types), help="Whether to export newline-delimited JSON or compressed columns.")
+    parser.add_argument("--client", action="append", dest="clients", help="Only export the client with this identifier, which may be given more than once.")
+    parser.add_argument("--start", type=float, help="Only export what happened at or after this time.")
+    parser.add_argument("--end", type=float, help="Only export what happened at or before this time.")
+    parser.add_argument("--since", type=float, help="Only export what's new since the watermark of an earlier export.")
+    parser.add_argument("--watermark-file", help="A file to read the watermark to export since from, if --since isn't given, and to store the new watermark in once the export is complete.")
+    parser.add_argument("--include", default=",".join(kinds), help="The types of row to export, separated by commas.")
+    parser.add_argument("--output", default="-", help="The path to write the export to, which defaults to standard output.")
+    arguments = parser.parse_args()
+
+    include = tuple(kind for kind in arguments.include.split(",") if kind)
+    if not set(include) <= set(kinds):
+        parser.error("--include must only list " + ", ".join(kinds) + ".")
+
+    since = arguments.since
+    if since is None and arguments.watermark_file and os.path.exists(arguments.watermark_file):
+
+        with open(arguments.watermark_file) as file:
+            since = float(file.read())
+
+    watermark, chunks = stream(get_backend(), arguments.format, None if arguments.clients is None else set(arguments.clients), arguments.start, arguments.end, since, include)
+
+    # Write the export as it's produced.
+    output = sys.stdout.buffer if arguments.output == "-" else open(arguments.output, "wb")
+    try:
+
+        for chunk in chunks:
+            output.write(chunk)
+
+    finally:
+
+        if output is sys.stdout.buffer:
+            output.flush()
+
+        else:
+            output.close()
+
+    # Only move the watermark once the export has been written in full, so that a failed export is retried from the same point. It's replaced in one step so that it's never left half written.
+    if arguments.watermark_file:
+
+        with open(arguments.watermark_file + ".tmp", "w") as file:
+            file.write(repr(watermark))
+
+        os.replace(arguments.watermark_file + ".tmp", arguments.watermark_file)
+
+    print("Exported everything up to " + repr(watermark) + ".", file=sys.stderr)
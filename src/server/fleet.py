@@ -0,0 +1,376 @@
+'''
+
+    We aim to answer questions about the whole fleet, such as which clients have a load above 4 or a mount over 90% full, without reading every record. Each field clients can be filtered and sorted by has an index kept in memory, sorted by value, which records update as they're written.
+
+    The indexes are kept by each worker process, updated as it writes records and rebuilt from every stored record once every recompute interval, so a fleet query answered by one worker only sees what the others have written since its last rebuild.
+
+    Alongside the indexes, we keep a summary of the whole fleet as running totals. Each client's contribution to the totals is remembered, so that when its record is written the old contribution is subtracted and the new one added. Round-trip times are the exception, which are counted in sketches of the whole fleet as they're measured, since remembering every client's sketch would cost far more memory than the sketches save.
+
+'''
+
+import bisect, os, sys, threading, time
+
+# Import our configuration.
+import config
+
+# Import the storage engines.
+from backends import get_backend
+
+# Import the sketches of round-trip times.
+import sketch
+
+# Import the identifiers clients are known by, which unlike their tokens may be shown to others.
+from tokens import identifier_of
+
+# Define the fields clients can be filtered and sorted by, alongside the section of a record each is computed from.
+fields = {
+
+    "updated_at": "metadata",
+    "latency": "latency",
+    "cpu_load": "cpu",
+    "cpu_model": "cpu",
+    "memory_used": "memory",
+    "disk_usage": "mounting_points"
+
+}
+
+# Define the values each client contributes to the fleet's summary, alongside the section of a record each is computed from.
+totals = {
+
+    "cpu_load": "cpu",
+    "memory_total": "memory",
+    "memory_used": "memory",
+    "mounting_points": "mounting_points",
+    "mounting_points_over_threshold": "mounting_points"
+
+}
+
+# Define the sections the fields and totals are computed from.
+indexed_sections = set(fields.values()) | set(totals.values())
+
+# Compute the fields and the contributions to the summary of a section of a record. Disk usage is the fraction of the fullest mounting point that's used.
+def index_values(section, value):
+
+    if section == "metadata":
+        return {"updated_at": value["updated_at"]}
+
+    if section == "latency":
+        return {"latency": value}
+
+    if section == "cpu":
+        return {"cpu_load": value["load"], "cpu_model": value["model"]}
+
+    # A client that hasn't reported its memory has neither value, as SQLite stores every section of a record in the same row.
+    if section == "memory":
+        return {"memory_used": value["used"], "memory_total": None if value["available"] is None or value["used"] is None else value["available"] + value["used"]}
+
+    if section == "mounting_points":
+
+        usages = [mounting_point["used"] / (mounting_point["used"] + mounting_point["available"]) for mounting_point in value.values() if mounting_point["used"] + mounting_point["available"] > 0]
+
+        return {
+
+            "disk_usage": max(usages) if usages else None,
+            "mounting_points": len(value),
+            "mounting_points_over_threshold": sum(1 for usage in usages if usage >= config.disk_usage_threshold)
+
+        }
+
+    return {}
+
+# Define a class to represent the clients ordered by the value of a single field, alongside the value of each client.
+class SortedIndex:
+
+    def __init__(self):
+
+        self.entries = []
+        self.values = {}
+
+    # Set the value of a client, or remove the client if the value is None.
+    def set(self, token, value):
+
+        if token in self.values:
+
+            old_value = self.values[token]
+            if old_value == value:
+                return
+
+            del self.entries[bisect.bisect_left(self.entries, (old_value, token))]
+            del self.values[token]
+
+        if value is not None:
+            bisect.insort(self.entries, (value, token))
+            self.values[token] = value
+
+    # Retrieve the positions of the first and last entries within an inclusive range of values, either end of which may be open.
+    def bounds(self, minimum=None, maximum=None):
+
+        # Tokens are strings, so the empty string sorts before every entry of a value.
+        start = 0 if minimum is None else bisect.bisect_left(self.entries, (minimum, ""))
+        end = len(self.entries) if maximum is None else bisect.bisect_right(self.entries, (maximum, chr(0x10FFFF)))
+
+        return start, max(start, end)
+
+# Define a class to represent running totals of the values clients contribute, alongside how many clients contribute each one.
+class Summary:
+
+    def __init__(self):
+
+        self.sums = {key: 0 for key in totals}
+        self.counts = {key: 0 for key in totals}
+        self.contributions = {}
+
+    # Replace a client's contributions, subtracting the old ones from the totals and adding the new ones.
+    def set(self, token, values):
+
+        contributions = self.contributions.setdefault(token, {})
+        for key, value in values.items():
+
+            if key not in self.sums:
+                continue
+
+            old_value = contributions.pop(key, None)
+            if old_value is not None:
+                self.sums[key] -= old_value
+                self.counts[key] -= 1
+
+            if value is not None:
+                contributions[key] = value
+                self.sums[key] += value
+                self.counts[key] += 1
+
+    # Add up every client's contributions from scratch, which discards any rounding that has built up in the running totals.
+    def recompute(self):
+
+        self.sums = {key: 0 for key in totals}
+        self.counts = {key: 0 for key in totals}
+
+        for contributions in self.contributions.values():
+
+            for key, value in contributions.items():
+                self.sums[key] += value
+                self.counts[key] += 1
+
+# Define a class to represent the indexes of every field across the fleet.
+class Fleet:
+
+    def __init__(self, backend):
+
+        self.backend = backend
+        self.indexes = {field: SortedIndex() for field in fields}
+        self.summary = Summary()
+        self.tokens = set()
+        self.lock = threading.Lock()
+
+        # Store the sketches of the whole fleet's round-trip times.
+        self.round_trip_times = sketch.empty_windows(time.time())
+
+        # Remember which process owns these indexes.
+        self.pid = os.getpid()
+
+        # Build the indexes and summary from the stored records in the background, and rebuild them every so often to correct any drift, such as from records written by other processes. Fields updated while we build are already up to date, so the build must not overwrite them with what it reads. Round-trip times measured while we build are only counted again if the build has already read the client's sketches.
+        self.updated = None
+        self.built = None
+        self.measured = None
+        self.recomputed_at = None
+        self.ready = threading.Event()
+        self.builder = threading.Thread(target=self.build_loop, name="monitor-fleet", daemon=True)
+        self.builder.start()
+
+    # Build the indexes and summary, then rebuild them on an interval.
+    def build_loop(self):
+
+        while True:
+
+            # A failed build leaves what we already have in place, but the builder itself must keep running.
+            try:
+                self.build()
+
+            except Exception as error:
+                print("Couldn't build the fleet's indexes, so they were left as they were: " + repr(error), file=sys.stderr)
+
+            self.ready.set()
+            time.sleep(config.fleet_recompute_interval)
+
+    # Read every stored record into the indexes, summary and sketches.
+    def build(self):
+
+        with self.lock:
+            self.updated = {}
+            self.built = set()
+            self.measured = sketch.empty_windows(time.time())
+
+        round_trip_times = sketch.empty_windows(time.time())
+        complete = False
+
+        try:
+
+            for token in self.backend.tokens():
+
+                values = {}
+                for section in indexed_sections:
+
+                    value = self.backend.load(token, section)
+                    if value is not None:
+                        values.update(index_values(section, value))
+
+                windows = self.backend.load(token, "latency_sketch")
+
+                with self.lock:
+
+                    updated = self.updated.get(token, ())
+                    self.set(token, {field: value for field, value in values.items() if field not in updated})
+
+                    sketch.absorb_windows(round_trip_times, windows, time.time())
+                    self.built.add(token)
+
+            complete = True
+
+        finally:
+
+            with self.lock:
+
+                # Only a complete build replaces the sketches, since the clients it didn't read would otherwise be left out.
+                if complete:
+                    sketch.absorb_windows(round_trip_times, self.measured, time.time())
+                    self.round_trip_times = round_trip_times
+
+                self.updated = None
+                self.built = None
+                self.measured = None
+                self.summary.recompute()
+                self.recomputed_at = time.time()
+
+    # Set the fields of a client. Callers must hold the lock.
+    def set(self, token, values):
+
+        self.tokens.add(token)
+        self.summary.set(token, values)
+
+        for field, value in values.items():
+
+            if field in self.indexes:
+                self.indexes[field].set(token, value)
+
+    # Update the fields of a client as its record is written.
+    def update(self, token, values):
+
+        with self.lock:
+
+            if self.updated is not None:
+                self.updated.setdefault(token, set()).update(values)
+
+            self.set(token, values)
+
+    # Count a client's round-trip time in the fleet's sketches as it's measured.
+    def observe_round_trip_time(self, token, timestamp, round_trip_time):
+
+        with self.lock:
+
+            sketch.observe(self.round_trip_times, timestamp, round_trip_time)
+
+            if self.built is not None and token in self.built:
+                sketch.observe(self.measured, timestamp, round_trip_time)
+
+    # Retrieve the summary of the whole fleet. This only reads the running totals and sketches, apart from counting the stale clients from the bounds of a range of the index of when clients were updated.
+    def summarize(self):
+
+        self.ready.wait()
+
+        with self.lock:
+
+            sums = dict(self.summary.sums)
+            counts = dict(self.summary.counts)
+            stale_hosts = self.indexes["updated_at"].bounds(None, time.time() - config.stale_host_after)
+
+            return {
+
+                "hosts": len(self.tokens),
+                "stale_hosts": stale_hosts[1] - stale_hosts[0],
+                "stale_after": config.stale_host_after,
+                "memory": {"total": sums["memory_total"], "used": sums["memory_used"], "reporting": counts["memory_total"]},
+                "cpu": {"average_load": sums["cpu_load"] / counts["cpu_load"] if counts["cpu_load"] else None, "reporting": counts["cpu_load"]},
+                "disks": {"mounting_points": sums["mounting_points"], "over_threshold": sums["mounting_points_over_threshold"], "threshold": config.disk_usage_threshold},
+                "round_trip_time": sketch.summarize_windows(self.round_trip_times, time.time()),
+                "recomputed_at": self.recomputed_at
+
+            }
+
+    # Retrieve every field of a client, alongside the identifier it's known by in place of its token.
+    def describe(self, token):
+        return dict({"client": identifier_of(token)}, **{field: index.values.get(token) for field, index in self.indexes.items()})
+
+    # Find the clients whose fields match every filter, which maps a field to an inclusive minimum and maximum, ordered by a field. Returns how many clients matched alongside the requested page of them.
+    def query(self, filters=None, sort="updated_at", descending=False, limit=100, offset=0):
+
+        self.ready.wait()
+        filters = filters or {}
+
+        with self.lock:
+
+            # Start from whichever filter matches the fewest clients, which we can tell from the bounds of its range alone.
+            ranges = {field: self.indexes[field].bounds(minimum, maximum) for field, (minimum, maximum) in filters.items()}
+            driving = min(ranges, key=lambda field: ranges[field][1] - ranges[field][0]) if ranges else None
+
+            # Without filters, every client is a candidate, in the order of the field we're sorting by. Clients without a value for it come last.
+            if driving is None:
+
+                # Only the requested page of the index is read, so this doesn't depend on the size of the fleet.
+                entries = self.indexes[sort].entries
+                count = len(entries)
+
+                if descending:
+                    page = [token for value, token in reversed(entries[max(0, count - offset - limit):max(0, count - offset)])]
+
+                else:
+                    page = [token for value, token in entries[offset:offset + limit]]
+
+                if len(page) < limit:
+                    unsorted = sorted(self.tokens.difference(self.indexes[sort].values))
+                    page += unsorted[max(0, offset - count):max(0, offset - count) + limit - len(page)]
+
+                return len(self.tokens), [self.describe(token) for token in page]
+
+            start, end = ranges[driving]
+            candidates = [token for value, token in self.indexes[driving].entries[start:end]]
+
+            # Check the rest of the filters against the value of each candidate.
+            for field, (minimum, maximum) in filters.items():
+
+                if field == driving:
+                    continue
+
+                values = self.indexes[field].values
+                candidates = [token for token in candidates if token in values and (minimum is None or values[token] >= minimum) and (maximum is None or values[token] <= maximum)]
+
+            # Order the matches by the field we're sorting by, unless they're already in that order.
+            if sort != driving:
+
+                values = self.indexes[sort].values
+                ordered = sorted((token for token in candidates if token in values), key=lambda token: (values[token], token), reverse=descending)
+                candidates = ordered + sorted(token for token in candidates if token not in values)
+
+            elif descending:
+                candidates.reverse()
+
+            return len(candidates), [self.describe(token) for token in candidates[offset:offset + limit]]
+
+# Store the process-wide indexes.
+fleet = None
+fleet_lock = threading.Lock()
+
+# Retrieve the process-wide indexes, building them on first use.
+def get_fleet():
+
+    global fleet
+
+    # Worker processes forked from a parent need their own indexes, since the parent's builder thread doesn't carry over.
+    if fleet is not None and fleet.pid == os.getpid():
+        return fleet
+
+    with fleet_lock:
+
+        if fleet is None or fleet.pid != os.getpid():
+            fleet = Fleet(get_backend())
+
+    return fleet
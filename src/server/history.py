@@ -0,0 +1,240 @@
+'''
+
+    We aim to keep a compact history of each client's metrics, stored as fixed-width samples in fixed-capacity ring buffers.
+
+'''
+
+import array, bisect, sys, threading, time
+
+# Import our configuration.
+import config
+
+# Define the metrics we keep a history of and the fields of their samples. Metrics may be qualified by what they measure, such as "disk:/home" for a mounting point.
+metric_fields = {
+
+    "cpu": ("load",),
+    "memory": ("available", "used"),
+    "latency": ("latency",),
+    "disk": ("available", "used")
+
+}
+
+# Retrieve the fields of a metric, or None if we don't keep a history of it.
+def fields_of(metric):
+    return metric_fields.get(metric.split(":", 1)[0])
+
+# Build the storage key of the list of metrics a client has a history of.
+def metrics_key(token, namespace="history"):
+    return token + ":" + namespace
+
+# Build the storage key of the index of a metric's history.
+def index_key(token, metric, namespace="history"):
+    return token + ":" + namespace + ":" + metric
+
+# Build the storage key of a slot in a metric's ring buffer.
+def chunk_key(token, metric, slot, namespace="history"):
+    return token + ":" + namespace + ":" + metric + ":" + str(slot)
+
+# Define a class to represent a chunk of samples, ordered by their timestamps. Timestamps, and when each sample arrived, are stored as 32-bit unsigned integers and each field as a 32-bit float, so a sample takes four bytes per field plus eight for its timestamp and arrival.
+class Chunk:
+
+    def __init__(self, width):
+
+        self.timestamps = array.array("I")
+        self.arrivals = array.array("I")
+        self.columns = [array.array("f") for _ in range(width)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Insert a sample into the chunk in order, or replace the sample with the same timestamp. The values are computed from those of the sample being replaced, or None if there isn't one.
+    def upsert(self, timestamp, combine, arrived_at):
+
+        position = bisect.bisect_left(self.timestamps, timestamp)
+
+        if position < len(self.timestamps) and self.timestamps[position] == timestamp:
+
+            for column, value in zip(self.columns, combine([column[position] for column in self.columns])):
+                column[position] = value
+
+            self.arrivals[position] = arrived_at
+            return
+
+        self.timestamps.insert(position, timestamp)
+        self.arrivals.insert(position, arrived_at)
+        for column, value in zip(self.columns, combine(None)):
+            column.insert(position, value)
+
+    # Iterate the samples of the chunk within a time range, as lists of the timestamp followed by each field, optionally only those that arrived after one time and by another.
+    def samples(self, start=None, end=None, arrived_after=None, arrived_by=None):
+
+        first = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        last = len(self.timestamps) if end is None else bisect.bisect_right(self.timestamps, end)
+
+        for position in range(first, last):
+
+            if (arrived_after is not None and self.arrivals[position] <= arrived_after) or (arrived_by is not None and self.arrivals[position] > arrived_by):
+                continue
+
+            yield [self.timestamps[position]] + [column[position] for column in self.columns]
+
+    # Serialize the chunk as its timestamps followed by each column, in little-endian byte order.
+    def encode(self):
+
+        arrays = [self.timestamps, self.arrivals] + self.columns
+
+        if sys.byteorder == "big":
+            arrays = [array.array(values.typecode, values) for values in arrays]
+            for values in arrays:
+                values.byteswap()
+
+        return b"".join(values.tobytes() for values in arrays)
+
+    # Deserialize a chunk with the given number of fields. Chunks written before arrivals were stored are read as if each sample arrived when it was collected.
+    @classmethod
+    def decode(cls, data, width, arrivals=True):
+
+        chunk = cls(width)
+        arrays = ([chunk.timestamps, chunk.arrivals] if arrivals else [chunk.timestamps]) + chunk.columns
+        count = len(data) // (4 * len(arrays))
+
+        for position, values in enumerate(arrays):
+
+            values.frombytes(data[position * count * 4:(position + 1) * count * 4])
+            if sys.byteorder == "big":
+                values.byteswap()
+
+        if not arrivals:
+            chunk.arrivals = array.array("I", chunk.timestamps)
+
+        return chunk
+
+# Define a class to represent the metric histories stored in the database.
+class History:
+
+    def __init__(self, storage, chunk_size=config.history_chunk_size, capacity=config.history_capacity, namespace="history", fields=fields_of):
+
+        # Store our settings. The ring buffer of each metric holds this many chunks.
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.slots = max(1, capacity // chunk_size)
+
+        # Histories in different namespaces are stored under different keys, and may store different fields for the same metric.
+        self.namespace = namespace
+        self.fields = fields
+
+        # Appending may roll a series over to a new chunk, which must only happen once per series. Each store has its own lock, so separate databases never wait on each other.
+        self.lock = threading.Lock()
+
+    # Retrieve the metrics a client has a history of.
+    def metrics(self, token):
+        return self.storage.get(metrics_key(token, self.namespace)) or []
+
+    # Retrieve the index of a metric's history, which maps each retained chunk to the count and time range of its samples and when the latest of them arrived. Chunks written before arrivals were stored have no arrival in the index.
+    def index(self, token, metric):
+
+        index = self.storage.get(index_key(token, metric, self.namespace))
+
+        if index is None:
+
+            index = {
+
+                "head": 0,
+                "chunks": {}
+
+            }
+
+        return index
+
+    # Retrieve a chunk of a metric's history by its sequence number, given its entry in the index.
+    def chunk(self, token, metric, sequence, entry):
+
+        width = len(self.fields(metric))
+        return self.storage.get(chunk_key(token, metric, sequence % self.slots, self.namespace), lambda data: Chunk.decode(data, width, len(entry) > 3))
+
+    # Add a sample to a metric's history, returning False if it was dropped. Timestamps are kept to the second, so a later sample within the same second replaces the earlier one.
+    def append(self, token, metric, timestamp, values):
+        return self.upsert(token, metric, timestamp, lambda previous: values)
+
+    # Insert a sample into a metric's history, or replace the sample with the same timestamp. The values are computed from those of the sample being replaced, or None if there isn't one. Returns False if the sample was dropped, which only happens to a sample older than every one we've kept once the ring buffer has wrapped around, as it's beyond our capacity.
+    def upsert(self, token, metric, timestamp, combine):
+
+        timestamp = int(timestamp)
+        arrived_at = int(time.time())
+
+        with self.lock:
+
+            index = self.index(token, metric)
+            chunks = index["chunks"]
+            head = str(index["head"])
+            sequence = index["head"]
+
+            # A sample older than the latest, such as one replayed from a client's spool, goes in the last chunk that starts at or before it, or the oldest chunk if none does. It's dropped if the chunks before the oldest have been forgotten.
+            if head in chunks and timestamp < chunks[head][2]:
+
+                earlier = [int(key) for key, entry in chunks.items() if entry[1] <= timestamp]
+                if not earlier and index["head"] >= self.slots:
+                    return False
+
+                sequence = max(earlier) if earlier else min(int(key) for key in chunks)
+
+            # Start a new chunk if a newer sample doesn't fit in the current one. It takes the slot of the oldest chunk in the ring buffer, which we'll forget.
+            elif head in chunks and timestamp > chunks[head][2] and chunks[head][0] >= self.chunk_size:
+
+                index["head"] += 1
+                sequence = index["head"]
+                chunks.pop(str(index["head"] - self.slots), None)
+
+            # Retrieve the chunk, starting it if it's new.
+            key = str(sequence)
+            entry = chunks.get(key)
+
+            if entry is not None:
+                chunk = self.chunk(token, metric, sequence, entry)
+
+            else:
+                chunk = Chunk(len(self.fields(metric)))
+                entry = [0, timestamp, timestamp]
+
+                # Remember that the client has a history of this metric.
+                metrics = self.metrics(token)
+                if metric not in metrics:
+                    self.storage.put(metrics_key(token, self.namespace), metrics + [metric])
+
+            chunk.upsert(timestamp, combine, arrived_at)
+            self.storage.put(chunk_key(token, metric, sequence % self.slots, self.namespace), chunk, Chunk.encode)
+
+            # Track the count, time range and latest arrival of the chunk in the index, which only changes when a sample is added or arrives in a new second.
+            updated = [len(chunk), min(entry[1], timestamp), max(entry[2], timestamp), arrived_at]
+            if chunks.get(key) != updated:
+                chunks[key] = updated
+                self.storage.put(index_key(token, metric, self.namespace), index)
+
+            return True
+
+    # Retrieve the samples of a metric's history within a time range, oldest first, optionally only those that arrived after one time and by another.
+    def query(self, token, metric, start=None, end=None, limit=None, arrived_after=None, arrived_by=None):
+
+        index = self.index(token, metric)
+        samples = []
+
+        for sequence in sorted(index["chunks"], key=int):
+
+            # Skip chunks entirely outside of the time range, or with nothing that arrived since.
+            entry = index["chunks"][sequence]
+            count, first_timestamp, last_timestamp = entry[:3]
+            if (start is not None and last_timestamp < start) or (end is not None and first_timestamp > end) or (arrived_after is not None and len(entry) > 3 and entry[3] <= arrived_after):
+                continue
+
+            chunk = self.chunk(token, metric, int(sequence), entry)
+            if chunk is None:
+                continue
+
+            for sample in chunk.samples(start, end, arrived_after, arrived_by):
+
+                if limit is not None and len(samples) >= limit:
+                    return samples
+
+                samples.append(sample)
+
+        return samples
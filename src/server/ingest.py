@@ -0,0 +1,234 @@
+'''
+
+    We aim to let request handlers hand validated reports to a single writer, which coalesces the reports of each client and commits them in batches.
+
+    Each process has its own writer. Under a server with several worker processes, the writers of different workers are kept from overwriting each other's changes to a record by the storage engine: each batch is loaded and saved within a SQLite transaction that holds the database's write lock, and a key-value database can only be used by one process.
+
+'''
+
+import atexit, collections, os, queue, threading, time
+
+# Import our configuration.
+import config
+
+# Import the database module and the storage engines.
+from database import Record
+from backends import get_backend
+
+# Define a class to represent the single writer that reports for a storage engine are queued for.
+class Writer:
+
+    def __init__(self, backend, queue_size=config.ingest_queue_size, batch_interval=config.ingest_batch_interval, batch_size=config.ingest_batch_size):
+
+        # Store the storage engine we write to and our settings.
+        self.backend = backend
+        self.batch_interval = batch_interval / 1000
+        self.batch_size = batch_size
+
+        # Store the queued reports as pairs of a token and a report.
+        self.queue = queue.Queue(queue_size)
+
+        # Store our statistics.
+        self.lock = threading.Lock()
+        self.statistics = {
+
+            "enqueued": 0,
+            "rejected": 0,
+            "committed": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_commit_latency": 0.0,
+            "max_commit_latency": 0.0,
+            "total_commit_latency": 0.0
+
+        }
+
+        # Start writing in the background.
+        self.closed = False
+        self.thread = threading.Thread(target=self.write_loop, name="monitor-writer", daemon=True)
+        self.thread.start()
+
+    # Queue a report for a client, returning False if the queue is full.
+    def submit(self, token, report):
+
+        try:
+            self.queue.put_nowait((token, report))
+
+        except queue.Full:
+
+            with self.lock:
+                self.statistics["rejected"] += 1
+
+            return False
+
+        with self.lock:
+            self.statistics["enqueued"] += 1
+
+        return True
+
+    # Collect a batch of reports, waiting for the first one and then for up to the batch interval or until the batch is full.
+    def collect(self):
+
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+
+        while len(batch) < self.batch_size:
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+
+            except queue.Empty:
+                break
+
+        return batch
+
+    # Apply a batch of reports, loading and saving each client's record once and committing the whole batch together.
+    def commit(self, batch):
+
+        started_at = time.monotonic()
+
+        # Coalesce the reports of each client, keeping them in the order they arrived.
+        reports = collections.OrderedDict()
+        for token, report in batch:
+
+            if token is not None:
+                reports.setdefault(token, []).append(report)
+
+        committed = 0
+        failed = 0
+
+        try:
+
+            with self.backend.group():
+
+                for token, token_reports in reports.items():
+
+                    # A report that fails shouldn't take the rest of the batch down with it.
+                    try:
+
+                        client_record = Record(token)
+                        for report in token_reports:
+                            client_record.apply(report)
+
+                        client_record.save()
+                        committed += len(token_reports)
+
+                    except Exception:
+                        failed += len(token_reports)
+
+        # If the commit itself fails, nothing in the batch was written.
+        except Exception:
+            failed += committed
+            committed = 0
+
+        commit_latency = time.monotonic() - started_at
+
+        with self.lock:
+            self.statistics["committed"] += committed
+            self.statistics["failed"] += failed
+            self.statistics["batches"] += 1
+            self.statistics["last_commit_latency"] = commit_latency
+            self.statistics["max_commit_latency"] = max(self.statistics["max_commit_latency"], commit_latency)
+            self.statistics["total_commit_latency"] += commit_latency
+
+    # Write batches until we're closed and the queue has drained.
+    def write_loop(self):
+
+        while True:
+
+            batch = self.collect()
+            self.commit(batch)
+
+            for _ in batch:
+                self.queue.task_done()
+
+            # A report without a token is the signal to stop.
+            if any(token is None for token, report in batch):
+                return
+
+    # Retrieve a snapshot of our statistics.
+    def stats(self):
+
+        with self.lock:
+            statistics = dict(self.statistics)
+
+        statistics["queue_depth"] = self.queue.qsize()
+        statistics["average_commit_latency"] = statistics["total_commit_latency"] / statistics["batches"] if statistics["batches"] else 0.0
+        del statistics["total_commit_latency"]
+
+        return statistics
+
+    # Write everything that's been queued and stop the writer.
+    def close(self):
+
+        if self.closed:
+            return
+
+        self.closed = True
+        self.queue.put((None, None))
+        self.thread.join()
+
+# Define a class to represent the writers of every shard, each with its own queue and thread so that shards are written in parallel.
+class Writers:
+
+    def __init__(self, backend):
+
+        self.backend = backend
+        self.writers = [Writer(shard) for shard in backend.shards]
+
+        # Remember which process owns these writers.
+        self.pid = os.getpid()
+
+    # Queue a report for a client with the writer of its shard, returning False if that queue is full.
+    def submit(self, token, report):
+        return self.writers[self.backend.shard_index(token)].submit(token, report)
+
+    # Retrieve a snapshot of the statistics of every writer, combined.
+    def stats(self):
+
+        shard_statistics = [writer.stats() for writer in self.writers]
+        statistics = {key: sum(shard[key] for shard in shard_statistics) for key in ("enqueued", "rejected", "committed", "failed", "batches", "queue_depth")}
+
+        statistics["last_commit_latency"] = max(shard["last_commit_latency"] for shard in shard_statistics)
+        statistics["max_commit_latency"] = max(shard["max_commit_latency"] for shard in shard_statistics)
+        statistics["average_commit_latency"] = sum(shard["average_commit_latency"] * shard["batches"] for shard in shard_statistics) / statistics["batches"] if statistics["batches"] else 0.0
+        statistics["shard_queue_depths"] = [shard["queue_depth"] for shard in shard_statistics]
+
+        return statistics
+
+    # Write everything that's been queued and stop every writer.
+    def close(self):
+
+        # Processes forked from the one that started the writers inherit its exit handlers, but not the writers' threads, so they leave closing them to that process.
+        if self.pid != os.getpid():
+            return
+
+        for writer in self.writers:
+            writer.close()
+
+# Store the process-wide writers.
+writer = None
+writer_lock = threading.Lock()
+
+# Retrieve the process-wide writers, starting them on first use.
+def get_writer():
+
+    global writer
+
+    # Worker processes forked from a parent don't inherit its threads, so each process needs its own writer.
+    if writer is not None and writer.pid == os.getpid():
+        return writer
+
+    with writer_lock:
+
+        if writer is None or writer.pid != os.getpid():
+
+            # The storage engine is created first, so that on exit the writers drain their queues before the storage engine is closed.
+            writer = Writers(get_backend())
+            atexit.register(writer.close)
+
+    return writer
@@ -1,321 +1,853 @@
 # Import the database module.
 from database import Record
+from backends import get_backend
+from ingest import get_writer
+from history import fields_of
+from rollups import rollup_fields_of
+from fleet import get_fleet
+import fleet
+
+# Import the binary encoding of reports and our validators.
+import binary
+import validation
+
+# Import streaming exports and the hub that accepted reports are pushed to live.
+import export
+import broadcast
+
+# Import the pings round-trip times are measured with, and the sketches they're summarized in.
+import ping
+import sketch
+
+# Import our metrics.
+import metrics
+
+# Import the alert rules, loading them now so that a mistake in them stops the server from starting rather than failing every report.
+from alerts import get_alerts
+get_alerts()
+
+# Import the compaction of audit logs in the background.
+from maintenance import get_compactor
+
+# Import the registry of tokens and the rate limits they're held to.
+from tokens import get_registry
+from ratelimit import get_rate_limits
 
 # Import the Flask server.
-from flask import Flask, request, jsonify, abort
+from flask import Flask, request, jsonify, abort, g, Response, stream_with_context
+from werkzeug.exceptions import TooManyRequests
 
 # Import rate limiters.
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
+# Import our configuration.
+import config
+
 # Import other modules.
-import time
+import math, time
 
 # Define our application.
 monitor = Flask(__name__)
 
-# Define our ratelimits.
+# Define our ratelimits. Clients are held to the rate limits of their tokens as they authenticate, so these only guard against a single address flooding us.
 limiter = Limiter(
 
     app=monitor,
     key_func=get_remote_address,
-    default_limits=["60 per hour"]
+    default_limits=[config.address_rate_limit] if config.address_rate_limit else []
 
 )
 
-# Define our application secrets.
-application_secrets = [
+# Load the registry of tokens now, so that a mistake in it stops the server from starting rather than turning every client away.
+get_registry()
 
-    "development_key_1"
+# Resolve the series we time each phase of handling a report with once.
+parse_duration = metrics.request_phase_duration.labels("parse")
+authenticate_duration = metrics.request_phase_duration.labels("authenticate")
+validate_duration = metrics.request_phase_duration.labels("validate")
+write_duration = metrics.request_phase_duration.labels("write")
 
-]
+# Time every request from the moment it's routed.
+@monitor.before_request
+def start_timer():
+    g.started_at = time.perf_counter()
 
-# Authentication middleware.
-def authenticate(body):
-    
-    # Attempt to retrieve the token and compare it to the known list of valid tokens.
-    try:
+# Start compacting audit logs in the background. Worker processes forked from a parent don't inherit its threads, so each starts its own on the first request it handles.
+@monitor.before_request
+def start_compactor():
+    get_compactor()
 
-        if body["token"] not in application_secrets:
-            raise ValueError("Invalid token.")
-        
-    # If the token is present but invalid, we'll declare it.
-    except ValueError as error_message:
-        abort(403, error_message)
+# Count and time every request once its response is ready.
+@monitor.after_request
+def record_request(response):
 
-    # Otherwise, there isn't a token present in the body, so we'll throw the relevant error code and abort.
-    except:
-        abort(401, "There is no token present.")
+    endpoint = request.endpoint or "unknown"
+    metrics.request_duration.labels(endpoint).observe(time.perf_counter() - g.get("started_at", time.perf_counter()))
+    metrics.requests.labels(endpoint, str(response.status_code)).inc()
 
-# An endpoint to report latency to the server.
-@monitor.route("/api/v1/report_latency", methods=["POST"])
-def report_latency():
+    return response
 
-    # Retrieve the request body which should be a JSON object.
-    body = request.get_json()
-    
-    # Catch any authorization errors right away before they make it into the rest of the program.
-    authenticate(body)
+# Roll back anything a request wrote but didn't commit, such as when it failed part way through.
+@monitor.teardown_request
+def release_backend(error):
+    get_backend().rollback()
 
-    # If we've reached this part of the function, the used has authorized themselves. We'll try to grab the timestamp.
-    requested_at = None
-    try:
+# Retrieve the body of a report, which is either a JSON object or, if the client sent it in our binary encoding, the same object decoded from it.
+def read_body(kind):
+
+    with parse_duration.time():
+
+        if request.mimetype == binary.content_type:
+
+            try:
+                return binary.decode(request.get_data(), kind)
+
+            except ValueError as error_message:
+                abort(400, str(error_message))
+
+        return request.get_json()
+
+# Authentication middleware, which also holds the client to the rate limit of its token on the endpoint it's requesting. Endpoints that reveal more than the client's own records require a scope, which the token must have been granted. Returns the token's entry in the registry.
+def authenticate(body, scope=None):
+
+    with authenticate_duration.time():
+
+        # Attempt to retrieve the token and look it up in the registry.
+        try:
+
+            token = body["token"]
+            entry = get_registry().lookup(token) if isinstance(token, str) else None
+
+            if entry is None:
+                raise ValueError("Invalid token.")
+
+        # If the token is present but invalid, we'll declare it.
+        except ValueError as error_message:
+            abort(403, error_message)
+
+        # Otherwise, there isn't a token present in the body, so we'll throw the relevant error code and abort.
+        except:
+            abort(401, "There is no token present.")
+
+        # Ensure the token has been granted the scope the endpoint requires.
+        if scope is not None and scope not in entry["scopes"]:
+            abort(403, "The token hasn't been granted the " + scope + " scope.")
+
+        # Count the request against the token's rate limit, which is shared between every worker.
+        rate_limit = entry["rate_limit"]
+        if rate_limit is not None:
+
+            retry_after = get_rate_limits().acquire(entry["key"] + ":" + str(request.endpoint), rate_limit.amount, rate_limit.get_expiry())
+            if retry_after is not None:
+                raise TooManyRequests("The rate limit of " + str(rate_limit) + " has been exceeded.", retry_after=retry_after)
+
+        return entry
+
+# Declare the schema of each section of a report, each compiled once into a function that parses and validates that section of a request. Addresses may be null because an interface may not always have an address assigned to it at a given time, and swap may be null if swapping is disabled on the client.
+validate_latency = validation.compile_schema({
+
+    "requested_at": validation.integer()
+
+})
+
+validate_echo = validation.compile_schema({
+
+    "ping": validation.string()
 
-        # Try to retrieve the timestamp.
-        requested_at = body["requested_at"]
+})
 
-    except:
+parse_network_interface = validation.compile_schema({
 
-        # We failed to retrieve the timestamp as it's not present.
-        abort(400, "Requested at timestamp is missing from the request.")
+    "name": validation.string(),
+    "ipv6": validation.string(nullable=True),
+    "ipv4": validation.string(nullable=True),
+    "mac": validation.string()
 
-    # Ensure that the timestamp is an integer, otherwise we'll run into type issues.
-    if not isinstance(requested_at, int):
+})
 
-        # Report the error and abort.
-        abort(400, "Requested at timestamp is not an integer.")
+parse_cpu = validation.compile_schema({
 
-    # Calculate the latency.
-    received_at = time.time()
-    network_latency = received_at - requested_at
+    "threads": validation.integer(),
+    "cores": validation.integer(),
+    "model": validation.string(),
+    "load": validation.number()
+
+})
+
+parse_memory = validation.compile_schema({
+
+    "available": validation.integer(),
+    "used": validation.integer(),
+    "swap": validation.obj({
+
+        "available": validation.integer(),
+        "used": validation.integer()
+
+    }, nullable=True)
+
+})
+
+parse_disk_mounting_point = validation.compile_schema({
+
+    "path": validation.string(),
+    "used": validation.integer(),
+    "available": validation.integer()
+
+})
+
+# Parse and validate the latency section of a request, returning the measured network latency.
+def parse_latency(body):
+
+    # Calculate the latency from the client's timestamp.
+    requested_at = validate_latency(body)["requested_at"]
+    network_latency = time.time() - requested_at
 
     # If we've received a message from the future, either someone has invented time travel or their clock is misconfigured.
     if (network_latency < 0):
 
-        # Report the error to the client and abort.
-        abort(400, "Either the server or client clock is misconfigured.")
+        # Report the error.
+        raise ValueError("Either the server or client clock is misconfigured.")
+
+    return network_latency
+
+# Parse and validate the echo of a ping, returning the round-trip time the server measured.
+def parse_echo(body, token):
+    return ping.measure(token, validate_echo(body)["ping"])
+
+# Parse and validate when a batch was collected, which is a timestamp in seconds. A batch collected slightly in the future, as far as our clock is concerned, is treated as collected now.
+def parse_collected_at(collected_at):
+
+    if not isinstance(collected_at, (int, float)) or isinstance(collected_at, bool) or not math.isfinite(collected_at):
+        raise ValueError("Expected a timestamp in the request.")
+
+    now = time.time()
+
+    if collected_at > now + config.collected_at_skew:
+        raise ValueError("Either the server or client clock is misconfigured.")
+
+    if collected_at < now - config.collected_at_max_age:
+        raise ValueError("The batch is too old to be accepted.")
+
+    return min(collected_at, now)
+
+# Parse and validate every section of a batch report, which may contain any of the "latency", "echo", "cpu" and "memory" sections and lists of "interfaces" and "mounting_points", and when it was collected as "collected_at". Samples are kept as of when the batch was collected, so that batches replayed from a client's spool keep their place in its history. An echo is reported as the "round_trip" section.
+def parse_batch(body):
+
+    # Store the validated sections alongside any errors we encounter, so that the client can correct everything at once.
+    sections = {
+
+        "collected_at": None,
+        "latency": None,
+        "round_trip": None,
+        "cpu": None,
+        "memory": None,
+        "interfaces": [],
+        "mounting_points": []
+
+    }
+    errors = []
+
+    # Validate the single-valued sections, if they're present.
+    for section, parser in (("latency", parse_latency), ("cpu", parse_cpu), ("memory", parse_memory)):
+
+        if body.get(section) is None:
+            continue
+
+        try:
+            sections[section] = parser(body[section])
+
+        except validation.ValidationError as error:
+            errors += error.prefixed(section)
+
+        except ValueError as error_message:
+            errors.append(section + ": " + str(error_message))
+
+    # Validate when the batch was collected, if the client says.
+    if body.get("collected_at") is not None:
+
+        try:
+            sections["collected_at"] = parse_collected_at(body["collected_at"])
+
+        except ValueError as error_message:
+            errors.append("collected_at: " + str(error_message))
+
+    # Validate the shape of an echoed ping, if there is one, but leave measuring it until we know the rest of the batch is valid, as measuring spends the ping.
+    echo = None
+    if body.get("echo") is not None:
+
+        try:
+            echo = validate_echo(body["echo"])["ping"]
+
+        except validation.ValidationError as error:
+            errors += error.prefixed("echo")
+
+    # Validate the list-valued sections, if they're present.
+    for section, parser in (("interfaces", parse_network_interface), ("mounting_points", parse_disk_mounting_point)):
+
+        if body.get(section) is None:
+            continue
+
+        if not isinstance(body[section], list):
+            errors.append(section + ": Expected a list in the request.")
+            continue
+
+        for index, entry in enumerate(body[section]):
+
+            try:
+                sections[section].append(parser(entry))
+
+            except validation.ValidationError as error:
+                errors += error.prefixed(section + "[" + str(index) + "]")
+
+            except ValueError as error_message:
+                errors.append(section + "[" + str(index) + "]: " + str(error_message))
+
+    # Reject the whole batch if any section is invalid, so we never apply half of a report.
+    if errors:
+        raise validation.ValidationError(errors)
+
+    # Measure the round-trip time of the echo. A ping that has expired, was already echoed or was signed by another worker is treated as a missing round trip rather than an error, as the client drops rejected batches and the rest of the batch is still worth keeping.
+    if echo is not None:
+
+        try:
+            sections["round_trip"] = ping.measure(body["token"], echo)
+
+        except ValueError:
+            metrics.rejected_echoes.inc()
+
+    # Ensure the batch actually contains something to report.
+    if sections["latency"] is None and sections["round_trip"] is None and sections["cpu"] is None and sections["memory"] is None and not sections["interfaces"] and not sections["mounting_points"]:
+        raise ValueError("The batch doesn't contain any sections to report.")
+
+    return sections
+
+# Run a parser against a request body, aborting with a bad request if the body doesn't validate.
+def parse_or_abort(parser, body):
+
+    with validate_duration.time():
+
+        try:
+            return parser(body)
+
+        except ValueError as error_message:
+            abort(400, str(error_message))
+
+# Write a validated report for a client, where a report may contain any of the "latency", "round_trip", "interfaces", "cpu", "memory" and "mounting_points" sections. Returns True if the report was queued for the writer rather than written.
+def submit(token, report):
+
+    with write_duration.time():
+
+        # In queue mode, the writer coalesces and commits reports in the background.
+        if config.ingest_mode == "queue":
+
+            if not get_writer().submit(token, report):
+                abort(503, "The server is too busy to accept reports right now.")
+
+            queued = True
+
+        # Otherwise, we'll apply the report to the client's record and write it once.
+        else:
+
+            # The record is loaded and saved within a single transaction, so that a report written by another worker at the same time isn't lost.
+            with get_backend().shard(token).transaction():
+
+                client_record = Record(token)
+                client_record.apply(report)
+                client_record.save()
+
+            queued = False
+
+    # Push the report to any dashboards watching it now that it's been accepted.
+    broadcast.get_hub().publish(token, report)
+
+    return queued
+
+# Respond to a report, letting the client know if it was only accepted for writing rather than written.
+def respond(payload, queued):
+
+    if queued:
+        return jsonify(payload, 202), 202
+
+    return jsonify(payload, 200)
+
+# An endpoint to report latency to the server.
+@monitor.route("/api/v1/report_latency", methods=["POST"])
+def report_latency():
+
+    # Retrieve the request body, which should be a JSON object or a binary report.
+    body = read_body("latency")
+
+    # Catch any authorization errors right away before they make it into the rest of the program.
+    authenticate(body)
+
+    # If we've reached this part of the function, the used has authorized themselves. We'll calculate the latency from their timestamp.
+    network_latency = parse_or_abort(parse_latency, body)
 
     # If we've made it this far, we're able to go ahead and report the latency to the database.
-    client_record = Record(body["token"])
-    client_record.set_network_latency(network_latency)
+    queued = submit(body["token"], {"latency": network_latency})
 
     # Then, we'll respond to the client with the latency value we've recorded to complete the request.
-    return jsonify({
+    return respond({
 
         "message": "Success",
         "network_latency": network_latency
 
-    }, 200)
+    }, queued)
 
 # An endpoint to report network interfaces.
 @monitor.route("/api/v1/report_network_interface", methods=["POST"])
 def report_network_interface():
 
-    # Retrieve request body which should be a JSON object.
-    body = request.get_json()
+    # Retrieve the request body, which should be a JSON object or a binary report.
+    body = read_body("interface")
 
     # Authenticate the request to ensure that it's valid.
     authenticate(body)
 
-    # Store our values to retrieve out of the request.
-    network_interface_schema = {
+    # Retrieve and validate the interface from the request.
+    network_interface_schema = parse_or_abort(parse_network_interface, body)
 
-        "name": None,
-        "ipv6": None,
-        "ipv4": None,
-        "mac": None 
+    # Update our database record.
+    queued = submit(body["token"], {"interfaces": [network_interface_schema]})
 
-    }
+    # Reaffirm success to client.
+    return respond({
 
-    # Attempt to retrieve all of our data from the request.
-    try:
+        "message": "Success"
+
+    }, queued)
+
+# An endpoint to report the CPU.
+@monitor.route("/api/v1/report_cpu", methods=["POST"])
+def report_cpu():
+
+    # Retrieve body payload.
+    body = read_body("cpu")
+
+    # Authenticate the user.
+    authenticate(body)
+
+    # Retrieve and validate the CPU information from the request.
+    cpu_schema = parse_or_abort(parse_cpu, body)
+
+    # Update the database.
+    queued = submit(body["token"], {"cpu": cpu_schema})
+
+    # Reaffirm success to client.
+    return respond({
+
+        "message": "Success"
+
+    }, queued)
+
+# An endpoint to report memory.
+@monitor.route("/api/v1/report_memory", methods=["POST"])
+def report_memory():
+
+    # Request the body payload.
+    body = read_body("memory")
+
+    # Authenticate our user.
+    authenticate(body)
+
+    # Retrieve and validate the memory information from the request.
+    memory_schema = parse_or_abort(parse_memory, body)
 
-        # Populate our table.
-        network_interface_schema["name"] = body["name"]
-        network_interface_schema["ipv6"] = body["ipv6"]
-        network_interface_schema["ipv4"] = body["ipv4"]
-        network_interface_schema["mac"] = body["mac"]
+    # Update the database.
+    queued = submit(body["token"], {"memory": memory_schema})
+
+    # Reaffirm success to client.
+    return respond({
 
-    except:
+        "message": "Success"
 
-        # Alert the request that their message isn't valid.
-        abort(400, "Corrupted or malformed request.")
+    }, queued)
 
-    # Check that there aren't any null values where they aren't warranted. Addresses receive an exception because an interface may not always have an address assigned to it at a given time.
-    if (network_interface_schema["name"] is None or network_interface_schema["mac"] is None):
-        abort(400, "An essential value is set to null in the request.")
+@monitor.route("/api/v1/report_disk_mounting_point", methods=["POST"])
+def report_disk_mounting_point():
 
-    # We'll also want to make sure that all of our values are strings, if they aren't empty address fields.
-    if (not isinstance(body["name"], str) or (not isinstance(body["mac"], str))):
-        abort(400, "An essential value isn't the correct type in the request.")
+    # Retrieve the request body, which should be a JSON object or a binary report.
+    body = read_body("mounting_point")
 
-    # If either address value is set, we should also ensure that it's a string and not an alternative value.
-    if (body["ipv6"] is not None and not isinstance(body["ipv6"], str)):
-        abort(400, "The type for the IPv6 value isn't recognized in the request.")
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
 
-    if (body["ipv4"] is not None and not isinstance(body["ipv4"], str)):
-        abort(400, "The type for the IPv4 value isn't recognized in the request.")
+    # Retrieve and validate the mounting point from the request.
+    disk_interface_schema = parse_or_abort(parse_disk_mounting_point, body)
 
     # Update our database record.
-    client_record = Record(body["token"])
-    client_record.set_network_interfaces(network_interface_schema)
+    queued = submit(body["token"], {"mounting_points": [disk_interface_schema]})
 
     # Reaffirm success to client.
-    return jsonify({
+    return respond({
 
         "message": "Success"
 
+    }, queued)
+
+# An endpoint to report every section in one request, so that a client only authenticates, loads and writes its record once per cycle.
+@monitor.route("/api/v1/report_batch", methods=["POST"])
+def report_batch():
+
+    # Retrieve the request body, which should be a JSON object or a binary report.
+    body = read_body("batch")
+
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
+
+    # Retrieve and validate every section of the batch.
+    sections = parse_or_abort(parse_batch, body)
+
+    # Apply every section to a single record before writing it to the database once.
+    queued = submit(body["token"], sections)
+
+    # Reaffirm success to client.
+    return respond({
+
+        "message": "Success",
+        "network_latency": sections["latency"],
+        "round_trip_time": sections["round_trip"]
+
+    }, queued)
+
+# An endpoint to issue a ping, which the client echoes straight back so that the server can measure the round-trip time on its own clock.
+@monitor.route("/api/v1/ping", methods=["POST"])
+def ping_endpoint():
+
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
+
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
+
+    # Respond with the ping, which is only valid for the client it was issued to.
+    return jsonify({
+
+        "message": "Success",
+        "ping": ping.issue(body["token"]),
+        "expires_in": config.ping_ttl
+
     }, 200)
 
-# An endpoint to report the CPU.
-@monitor.route("/api/v1/report_cpu", methods=["POST"])
-def report_cpu():
-    
-    # Retrieve body payload.
+# An endpoint to echo a ping, recording the round-trip time it took.
+@monitor.route("/api/v1/echo", methods=["POST"])
+def echo():
+
+    # Retrieve request body which should be a JSON object.
     body = request.get_json()
 
-    # Authenticate the user.
+    # Authenticate the request to ensure that it's valid.
     authenticate(body)
 
-    # Define our schema.
-    cpu_schema = {
+    # Measure the round-trip time from when the ping was issued.
+    round_trip_time = parse_or_abort(lambda body: parse_echo(body, body["token"]), body)
 
-        "threads": None,
-        "cores": None,
-        "model": None,
-        "load": None
+    # Record the round-trip time.
+    queued = submit(body["token"], {"round_trip": round_trip_time})
 
-    }
+    # Respond with the round-trip time we've recorded.
+    return respond({
 
-    # Attempt to retrieve all of our data from the request.
-    try:
+        "message": "Success",
+        "round_trip_time": round_trip_time
 
-        # Retrieve the data.
-        cpu_schema["threads"] = body["threads"]
-        cpu_schema["cores"] = body["cores"]
-        cpu_schema["model"] = body["model"]
-        cpu_schema["load"] = body["load"]
+    }, queued)
 
-    except:
+# An endpoint to retrieve the percentiles of a client's round-trip times over the current and previous windows.
+@monitor.route("/api/v1/round_trip_time", methods=["POST"])
+def round_trip_time():
 
-        # Abort if we're unable to find the necessary data in the request.
-        abort(400, "Malformed or corrupted request.")
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
 
-    # Ensure that our types are rigid and correct.
-    if not isinstance(cpu_schema["threads"], int) or not isinstance(cpu_schema["cores"], int) or not isinstance(cpu_schema["model"], str) or not isinstance(cpu_schema["load"], float):
-        abort(400, "Type-error in request.")
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
 
-    # Update the database.
+    # Summarize the client's sketches.
     client_record = Record(body["token"])
-    client_record.set_cpu(cpu_schema)
 
-    # Reaffirm success to client.
     return jsonify({
 
-        "message": "Success"
+        "message": "Success",
+        "window": config.sketch_window,
+        "round_trip_time": sketch.summarize_windows(client_record.section("latency_sketch"), time.time())
 
     }, 200)
 
-# An endpoint to report memory.
-@monitor.route("/api/v1/report_memory", methods=["POST"])
-def report_memory():
+# An endpoint to report how the writer is keeping up when reports are queued.
+@monitor.route("/api/v1/ingest/stats", methods=["POST"])
+def ingest_stats():
 
-    # Request the body payload.
+    # Retrieve request body which should be a JSON object.
     body = request.get_json()
 
-    # Authenticate our user.
+    # Authenticate the request to ensure that it's valid.
     authenticate(body)
 
-    # Define our schema.
-    memory_schema = {
+    # Respond with the writer's statistics, if reports are being queued.
+    return jsonify({
+
+        "message": "Success",
+        "mode": config.ingest_mode,
+        "stats": get_writer().stats() if config.ingest_mode == "queue" else None
 
-        "available": None,
-        "used": None,
-        "swap": None,
+    }, 200)
 
-    }
+# An endpoint to read a page of a client's audit log, optionally filtered by time range and event type.
+@monitor.route("/api/v1/audit_log", methods=["POST"])
+def audit_log():
+
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
+
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
+
+    # Retrieve our filters from the request, all of which are optional.
+    start = body.get("start")
+    end = body.get("end")
+    event = body.get("event")
+    cursor = body.get("cursor")
+    limit = body.get("limit", 100)
+
+    # Ensure all values are what they should be.
+    if (start is not None and not isinstance(start, (int, float))) or (end is not None and not isinstance(end, (int, float))):
+        abort(400, "The time range in the request must be numeric.")
+
+    if (event is not None and not isinstance(event, str)) or (cursor is not None and not isinstance(cursor, str)):
+        abort(400, "Invalid type assigned to field in request.")
 
-    # Attempt to fetch our values from the request.
+    if not isinstance(limit, int) or limit < 1 or limit > 1000:
+        abort(400, "The limit in the request must be an integer between 1 and 1000.")
+
+    # Read the page from the audit log.
+    client_record = Record(body["token"])
     try:
+        events, cursor = client_record.audit_log.read(client_record.token, start, end, event, cursor, limit)
 
-        # Fetch our necessary values.
-        memory_schema["available"] = body["available"]
-        memory_schema["used"] = body["used"]
-        memory_schema["swap"] = body["swap"]
+    except ValueError:
+        abort(400, "The cursor in the request isn't valid.")
 
-    except:
+    # Respond with the page and the cursor to continue from.
+    return jsonify({
 
-        # Abort if we struggle to find the required values.
-        abort(400, "There was an error while trying to parse your request.")
+        "message": "Success",
+        "events": events,
+        "cursor": cursor
 
-    # Ensure that we validate our inputs.
-    if (not isinstance(memory_schema["available"], int) or not isinstance(memory_schema["used"], int)):
-        abort(400, "There was an invalid type detected while trying parsing your request.")
+    }, 200)
 
-    if (not isinstance(memory_schema["swap"], dict) and not memory_schema["swap"] is None):
-        abort(400, "There was an error while trying to verify the type of the swap object.")
+# An endpoint to read the history of one of a client's metrics over a time window, optionally rolled up to a coarser resolution.
+@monitor.route("/api/v1/history", methods=["POST"])
+def history():
 
-    # If swap is populated, then we'll validate it as well.
-    if (isinstance(memory_schema["swap"], dict)):
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
 
-        # There is a chance that our values aren't present in the swap dict, so we'll need to use a try function here.
-        try:
+    # Authenticate the request to ensure that it's valid.
+    authenticate(body)
 
-            # Ensure that our types are correct.
-            if (not isinstance(memory_schema["swap"]["available"], int)):
-                abort(400, "The swap segment of your request has an invalid type.")
+    # Retrieve our values from the request. The time window is optional and defaults to everything we've retained.
+    metric = body.get("metric")
+    start = body.get("start")
+    end = body.get("end")
+    limit = body.get("limit", 10000)
+    resolution = body.get("resolution")
 
-            if (not isinstance(memory_schema["swap"]["used"], int)):
-                abort(400, "The swap segment of your request has an invalid type.")
+    # Ensure all values are what they should be.
+    if not isinstance(metric, str) or fields_of(metric) is None:
+        abort(400, "The metric in the request isn't recognized.")
 
-        except:
+    if (start is not None and not isinstance(start, (int, float))) or (end is not None and not isinstance(end, (int, float))):
+        abort(400, "The time range in the request must be numeric.")
 
-            # If these values couldn't be parsed, then we'll abort.
-            abort(400, "The swap segment of your request couldn't be parsed.")
+    if not isinstance(limit, int) or limit < 1 or limit > 100000:
+        abort(400, "The limit in the request must be an integer between 1 and 100000.")
 
-    # Update the database.
+    if resolution is not None and (not isinstance(resolution, int) or resolution < 1):
+        abort(400, "The resolution in the request must be a positive integer.")
+
+    # Read the aggregates from the coarsest rollup that satisfies the requested resolution, falling back to the raw samples if the resolution is finer than every rollup.
     client_record = Record(body["token"])
-    client_record.set_memory(memory_schema)
+    samples = None if resolution is None else client_record.rollups.query(client_record.token, metric, resolution, start, end, limit)
 
-    # Reaffirm success to client.
+    if samples is not None:
+
+        return jsonify({
+
+            "message": "Success",
+            "metric": metric,
+            "resolution": resolution,
+            "fields": ["timestamp"] + list(rollup_fields_of(metric)),
+            "samples": samples
+
+        }, 200)
+
+    # Read the samples from the metric's history.
+    samples = client_record.history.query(client_record.token, metric, start, end, limit)
+
+    # Respond with the samples, each of which lists its timestamp followed by the metric's fields.
     return jsonify({
 
-        "message": "Success"
+        "message": "Success",
+        "metric": metric,
+        "fields": ["timestamp"] + list(fields_of(metric)),
+        "samples": samples
 
     }, 200)
 
-@monitor.route("/api/v1/report_disk_mounting_point", methods=["POST"])
-def report_disk_mounting_point():
+# An endpoint to expose our metrics in the Prometheus text format. Scrapers are exempt from rate limits.
+@monitor.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# An endpoint to find the clients across the fleet whose fields fall within ranges, such as a load above 4 or a mount over 90% full, sorted by any of those fields.
+@monitor.route("/api/v1/fleet/query", methods=["POST"])
+def fleet_query():
 
     # Retrieve request body which should be a JSON object.
     body = request.get_json()
 
-    # Authenticate the request to ensure that it's valid.
-    authenticate(body)
+    # Authenticate the request to ensure that it's valid, and that the token may read about the whole fleet.
+    authenticate(body, "read")
 
-    # Store our values to retrieve out of the request.
-    disk_interface_schema = {
+    # Retrieve our values from the request, all of which are optional. Each filter maps a field to an inclusive "min" and "max", or to a value it "equals".
+    filters = body.get("filters") or {}
+    sort = body.get("sort", "updated_at")
+    order = body.get("order", "asc")
+    limit = body.get("limit", 100)
+    offset = body.get("offset", 0)
 
-        "path": None,
-        "used": None,
-        "available": None 
+    # Ensure all values are what they should be.
+    if not isinstance(filters, dict):
+        abort(400, "The filters in the request must be an object.")
 
-    }
+    ranges = {}
+    for field, bounds in filters.items():
 
-    # Attempt to retrieve all of our data from the request.
-    try:
+        if field not in fleet.fields:
+            abort(400, "The field " + repr(field) + " can't be filtered by.")
 
-        # Populate our table.
-        disk_interface_schema["path"] = body["path"]
-        disk_interface_schema["used"] = body["used"]
-        disk_interface_schema["available"] = body["available"]
+        if not isinstance(bounds, dict) or not set(bounds) <= {"min", "max", "equals"}:
+            abort(400, "The filter on " + field + " must be an object of \"min\", \"max\" or \"equals\".")
 
-    except:
+        # CPU models are compared as strings, and every other field as a number.
+        kind = str if field == "cpu_model" else (int, float)
+        for bound in bounds.values():
 
-        # Alert the request that their message isn't valid.
-        abort(400, "Corrupted or malformed request.")
+            if bound is not None and (not isinstance(bound, kind) or isinstance(bound, bool)):
+                abort(400, "The filter on " + field + " must be " + ("a string" if field == "cpu_model" else "numeric") + ".")
 
-    # Ensure all values are what they should be.
-    if (not isinstance(disk_interface_schema["path"], str) or not isinstance(disk_interface_schema["available"], int) or not isinstance(disk_interface_schema["used"], int)):
-        abort(400, "Invalid type assigned to field in request.")
+        if bounds.get("equals") is not None:
+            ranges[field] = (bounds["equals"], bounds["equals"])
 
-    # Update our database record.
-    client_record = Record(body["token"])
-    client_record.set_disk_mounting_point(disk_interface_schema)
+        else:
+            ranges[field] = (bounds.get("min"), bounds.get("max"))
 
-    # Reaffirm success to client.
+    if sort not in fleet.fields:
+        abort(400, "The field " + repr(sort) + " can't be sorted by.")
+
+    if order not in ("asc", "desc"):
+        abort(400, "The order in the request must be \"asc\" or \"desc\".")
+
+    if not isinstance(limit, int) or limit < 1 or limit > 1000:
+        abort(400, "The limit in the request must be an integer between 1 and 1000.")
+
+    if not isinstance(offset, int) or offset < 0:
+        abort(400, "The offset in the request must be a non-negative integer.")
+
+    # Query the fleet's indexes.
+    total, clients = get_fleet().query(ranges, sort, order == "desc", limit, offset)
+
+    # Respond with the page of matching clients and how many matched in total.
     return jsonify({
 
-        "message": "Success"
+        "message": "Success",
+        "total": total,
+        "clients": clients
+
+    }, 200)
+
+# An endpoint to retrieve totals across the whole fleet, which each worker process keeps up to date as it writes reports rather than computing them on each read.
+@monitor.route("/api/v1/fleet/summary", methods=["POST"])
+def fleet_summary():
+
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
+
+    # Authenticate the request to ensure that it's valid, and that the token may read about the whole fleet.
+    authenticate(body, "read")
+
+    # Respond with the summary.
+    return jsonify({
+
+        "message": "Success",
+        "summary": get_fleet().summarize()
+
+    }, 200)
+
+# An endpoint to stream an export of every client's records, samples and audit events, optionally limited to the clients with some identifiers, a time range or what's new since the watermark of an earlier export.
+@monitor.route("/api/v1/export", methods=["POST"])
+def export_endpoint():
+
+    # Retrieve request body which should be a JSON object.
+    body = request.get_json()
+
+    # Authenticate the request to ensure that it's valid, and that the token may export the whole fleet.
+    authenticate(body, "admin")
+
+    # Retrieve our values from the request, all of which are optional.
+    export_format = body.get("format", "ndjson")
+    clients = body.get("clients")
+    start = body.get("start")
+    end = body.get("end")
+    since = body.get("since")
+    include = body.get("include", list(export.kinds))
+
+    # Ensure all values are what they should be.
+    if export_format not in export.content_types:
+        abort(400, "The format in the request must be \"ndjson\" or \"columnar\".")
+
+    if clients is not None and (not isinstance(clients, list) or not all(isinstance(client, str) for client in clients)):
+        abort(400, "The clients in the request must be a list of identifiers.")
+
+    if any(value is not None and not isinstance(value, (int, float)) for value in (start, end, since)):
+        abort(400, "The time range and watermark in the request must be numeric.")
+
+    if not isinstance(include, list) or not set(include) <= set(export.kinds):
+        abort(400, "The types of row to include must be a list of " + ", ".join(export.kinds) + ".")
+
+    # Stream the export as it's produced. The watermark to export since next time is known before the first row is read, so it's sent as a header.
+    watermark, chunks = export.stream(get_backend(), export_format, None if clients is None else set(clients), start, end, since, include)
+
+    return Response(stream_with_context(chunks), mimetype=export.content_types[export_format], headers={"X-Monitor-Watermark": repr(watermark)})
+
+# An endpoint to stream every accepted report to a dashboard as server-sent events, optionally only those of the clients with some identifiers or of some sections. Browsers can't send a body with an event stream, so the request is made through its query string, with filters given as comma-separated lists.
+@monitor.route("/api/v1/stream", methods=["GET"])
+def stream_endpoint():
+
+    # Authenticate the request to ensure that it's valid.
+    entry = authenticate(request.args)
+
+    # Retrieve our filters from the request, both of which are optional.
+    clients = request.args.get("clients")
+    sections = request.args.get("metrics")
+
+    clients = None if not clients else clients.split(",")
+    sections = None if not sections else sections.split(",")
+
+    # Ensure all values are what they should be. Watching other clients requires the read scope, so a token without it only ever watches its own client, whose identifier is its entry's key.
+    if "read" not in entry["scopes"]:
+
+        if clients is not None and set(clients) != {entry["key"]}:
+            abort(403, "The token hasn't been granted the read scope, so it can only watch its own client.")
+
+        clients = [entry["key"]]
+
+    if sections is not None and not set(sections) <= set(broadcast.sections):
+        abort(400, "The metrics in the request must be any of " + ", ".join(broadcast.sections) + ".")
 
-    }, 200)
\ No newline at end of file
+    # Stream updates as they're published to the hub, until the client goes away. Watching the fleet this way never reads from the database.
+    return Response(broadcast.stream(broadcast.get_hub(), clients, sections), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
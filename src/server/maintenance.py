@@ -0,0 +1,86 @@
+'''
+
+    We aim to apply retention to every client's audit log on an interval, so that expired events are dropped without waiting for the client to log another one, which a client that's stopped reporting never will.
+
+    The server compacts audit logs in the background. With the key-value database, which can only be opened by one process at a time, they can also be compacted by running this while the server is stopped.
+
+    Usage: python maintenance.py
+
+'''
+
+import os, threading, time
+
+# Import our configuration.
+import config
+
+# Import the storage engines.
+from backends import get_backend
+
+# Apply retention to the audit log of every stored record, one shard at a time, returning how many logs were compacted.
+def compact_audit_logs(backend):
+
+    compacted = 0
+    for shard in backend.shards:
+
+        for token in shard.tokens():
+            shard.audit_log.compact(token)
+            compacted += 1
+
+        shard.flush()
+
+    return compacted
+
+# Define a class to represent the compaction of audit logs in the background.
+class Compactor:
+
+    def __init__(self, backend, interval=config.audit_compact_interval):
+
+        self.backend = backend
+        self.interval = interval
+
+        # Remember which process owns the compaction thread.
+        self.pid = os.getpid()
+
+        self.thread = threading.Thread(target=self.compact_loop, name="monitor-compactor", daemon=True)
+        self.thread.start()
+
+    # Compact every audit log on an interval, starting an interval after the server does.
+    def compact_loop(self):
+
+        while True:
+
+            time.sleep(self.interval)
+
+            # A failed compaction is retried on the next interval, but the compactor itself must keep running.
+            try:
+                compact_audit_logs(self.backend)
+
+            except Exception:
+                pass
+
+            # SQLite connections are kept per thread, so anything left uncommitted by a failure is rolled back.
+            finally:
+                self.backend.rollback()
+
+# Store the process-wide compactor.
+compactor = None
+compactor_lock = threading.Lock()
+
+# Retrieve the process-wide compactor, starting it on first use.
+def get_compactor():
+
+    global compactor
+
+    # Worker processes forked from a parent don't inherit its threads, so each process needs its own compactor.
+    if compactor is not None and compactor.pid == os.getpid():
+        return compactor
+
+    with compactor_lock:
+
+        if compactor is None or compactor.pid != os.getpid():
+            compactor = Compactor(get_backend())
+
+    return compactor
+
+if __name__ == "__main__":
+    print("Compacted " + str(compact_audit_logs(get_backend())) + " audit logs.")
@@ -0,0 +1,255 @@
+'''
+
+    We aim to count and time what the server does on its hot paths, cheaply enough that measuring never becomes the bottleneck, and to expose it in the Prometheus text format.
+
+    Every thread keeps its own counts for each series, which only it ever updates, so recording a measurement never takes a lock. The counts of every thread are only added together when the metrics are read, and a thread's counts are folded into those of the series when it exits.
+
+'''
+
+import bisect, itertools, threading, time, weakref
+
+# Define the default buckets of latencies, in seconds, and of sizes, in bytes.
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+size_buckets = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+
+# Store every metric, in the order they're exposed.
+registry = []
+
+# Format a value for the exposition format.
+def format_value(value):
+
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Format the labels of a series, with any extra labels appended.
+def format_labels(names, values, extra=()):
+
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(name + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for name, value in pairs) + "}"
+
+# Define a class to represent the counts of a single series, split between the threads that update it.
+class Series:
+
+    def __init__(self, size):
+
+        # Store the number of counts each thread keeps, the counts of each live thread, and the counts of every thread that has exited.
+        self.size = size
+        self.local = threading.local()
+        self.shards = {}
+        self.retired = [0] * size
+        self.lock = threading.Lock()
+
+    # Retrieve the current thread's counts, creating them on first use.
+    def counts(self):
+
+        try:
+            return self.local.counts
+
+        except AttributeError:
+            pass
+
+        counts = [0] * self.size
+
+        with self.lock:
+            self.shards[id(counts)] = counts
+
+        # Thread-local values are released when their thread exits, so a sentinel stored alongside the counts tells us when to fold them into the retired counts.
+        self.local.counts = counts
+        self.local.sentinel = sentinel = Sentinel()
+        weakref.finalize(sentinel, self.retire, counts)
+
+        return counts
+
+    # Fold the counts of a thread that has exited into the retired counts.
+    def retire(self, counts):
+
+        with self.lock:
+
+            del self.shards[id(counts)]
+
+            for position, count in enumerate(counts):
+                self.retired[position] += count
+
+    # Add together the counts of every thread.
+    def total(self):
+
+        with self.lock:
+
+            total = list(self.retired)
+            for counts in self.shards.values():
+
+                for position, count in enumerate(list(counts)):
+                    total[position] += count
+
+        return total
+
+# Define a class to represent an object whose only purpose is to be released when its thread exits.
+class Sentinel:
+    pass
+
+# Define a class to represent a single series of a counter.
+class CounterSeries(Series):
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+
+        try:
+            counts = self.local.counts
+
+        except AttributeError:
+            counts = self.counts()
+
+        counts[0] += amount
+
+    def value(self):
+        return self.total()[0]
+
+# Define a class to represent a single series of a histogram, which counts how many observations fell into each bucket followed by their sum.
+class HistogramSeries(Series):
+
+    def __init__(self, buckets):
+
+        self.buckets = buckets
+        super().__init__(len(buckets) + 2)
+
+    def observe(self, value):
+
+        try:
+            counts = self.local.counts
+
+        except AttributeError:
+            counts = self.counts()
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    # Time the body of a with statement.
+    def time(self):
+        return Timer(self)
+
+    # Retrieve the cumulative count of each bucket, ending with the total count, alongside the sum of every observation.
+    def snapshot(self):
+
+        total = self.total()
+        return list(itertools.accumulate(total[:-1])), total[-1]
+
+# Define a class to represent timing the body of a with statement, which is cheaper than a generator-based context manager.
+class Timer:
+
+    __slots__ = ("series", "started_at")
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.series.observe(time.perf_counter() - self.started_at)
+
+# Define a class to represent a metric, which holds a series for each combination of its labels.
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+        registry.append(self)
+
+    # Retrieve the series for a combination of labels, creating it on first use.
+    def labels(self, *values):
+
+        series = self.series.get(values)
+        if series is not None:
+            return series
+
+        with self.lock:
+
+            if values not in self.series:
+                self.series[values] = self.create()
+
+            return self.series[values]
+
+    # Render the metric in the exposition format.
+    def render(self):
+
+        lines = ["# HELP " + self.name + " " + self.description, "# TYPE " + self.name + " " + self.kind]
+
+        with self.lock:
+            series = list(self.series.items())
+
+        for values, single in sorted(series):
+            lines += self.render_series(values, single)
+
+        return lines
+
+# Define a class to represent a counter.
+class Counter(Metric):
+
+    kind = "counter"
+
+    def create(self):
+        return CounterSeries()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render_series(self, values, series):
+        return [self.name + format_labels(self.label_names, values) + " " + format_value(series.value())]
+
+# Define a class to represent a histogram.
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=latency_buckets):
+
+        self.buckets = tuple(buckets)
+        super().__init__(name, description, labels)
+
+    def create(self):
+        return HistogramSeries(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render_series(self, values, series):
+
+        counts, total = series.snapshot()
+        lines = []
+
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            lines.append(self.name + "_bucket" + format_labels(self.label_names, values, (("le", format_value(bound)),)) + " " + str(count))
+
+        lines.append(self.name + "_sum" + format_labels(self.label_names, values) + " " + format_value(total))
+        lines.append(self.name + "_count" + format_labels(self.label_names, values) + " " + str(counts[-1]))
+
+        return lines
+
+# Render every metric in the exposition format.
+def render():
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+# Define the metrics of the server.
+requests = Counter("monitor_requests_total", "Requests handled, by endpoint and status code.", ("endpoint", "status"))
+request_duration = Histogram("monitor_request_duration_seconds", "Time taken to handle a request, by endpoint.", ("endpoint",))
+request_phase_duration = Histogram("monitor_request_phase_duration_seconds", "Time spent in each phase of handling a report, by phase.", ("phase",))
+storage_duration = Histogram("monitor_storage_operation_duration_seconds", "Time taken by each storage operation, by storage engine and operation.", ("engine", "operation"))
+section_size = Histogram("monitor_record_section_bytes", "Serialized size of record sections as they're written, by section.", ("section",), size_buckets)
+rejected_echoes = Counter("monitor_rejected_echoes_total", "Echoes of pings that couldn't be measured, whose batches were kept without a round trip.")
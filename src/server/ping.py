@@ -0,0 +1,82 @@
+'''
+
+    We aim to measure the round-trip time between each client and the server on the server's clock alone, so that it's as accurate as neither clock being set right allows.
+
+    The server issues a ping holding a nonce, the time it was issued and a signature binding both to the client's token. The client echoes it straight back, and the round-trip time is how long the echo took to arrive. Pings are signed rather than stored, so that any worker can answer an echo.
+
+'''
+
+import base64, collections, hashlib, hmac, os, struct, threading, time
+
+# Import our configuration.
+import config
+
+# Define the secret pings are signed with.
+secret = config.ping_secret.encode() or os.urandom(32)
+
+# Define the layout of a ping: when it was issued, in nanoseconds, and a random nonce, followed by the truncated signature of both.
+ping_format = struct.Struct("<Q8s")
+signature_size = 16
+
+# Sign the payload of a ping for a client.
+def sign(token, payload):
+    return hmac.new(secret, token.encode() + payload, hashlib.sha256).digest()[:signature_size]
+
+# Issue a ping for a client.
+def issue(token):
+
+    payload = ping_format.pack(time.time_ns(), os.urandom(8))
+    return base64.urlsafe_b64encode(payload + sign(token, payload)).decode()
+
+# Define a class to represent the echoes this process has answered, so that an echo can only be answered once by it. We only need to remember them until their pings expire.
+class Answered:
+
+    def __init__(self):
+
+        self.expiries = collections.deque()
+        self.pings = set()
+        self.lock = threading.Lock()
+
+    # Remember that an echo of a ping was answered, returning False if it already was.
+    def add(self, ping, expires_at):
+
+        with self.lock:
+
+            now = time.time()
+            while self.expiries and self.expiries[0][0] < now:
+                self.pings.discard(self.expiries.popleft()[1])
+
+            if ping in self.pings:
+                return False
+
+            self.pings.add(ping)
+            self.expiries.append((expires_at, ping))
+            return True
+
+answered = Answered()
+
+# Measure the round-trip time, in seconds, of a client's echo of a ping. Raises a ValueError if the ping wasn't issued to the client, has expired or has already been echoed.
+def measure(token, ping):
+
+    received_at = time.time_ns()
+
+    try:
+        data = base64.urlsafe_b64decode(ping.encode())
+
+    except ValueError:
+        raise ValueError("The ping isn't valid.")
+
+    if len(data) != ping_format.size + signature_size or not hmac.compare_digest(sign(token, data[:ping_format.size]), data[ping_format.size:]):
+        raise ValueError("The ping isn't valid.")
+
+    issued_at = ping_format.unpack_from(data)[0]
+    round_trip_time = (received_at - issued_at) / 1e9
+
+    # A ping from the future means the server's clock was set back since it was issued.
+    if round_trip_time < 0 or round_trip_time > config.ping_ttl:
+        raise ValueError("The ping has expired.")
+
+    if not answered.add(ping, issued_at / 1e9 + config.ping_ttl):
+        raise ValueError("The ping has already been echoed.")
+
+    return round_trip_time
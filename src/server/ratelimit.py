@@ -0,0 +1,139 @@
+'''
+
+    We aim to hold every client to its rate limits across every worker process, without needing a server of its own to keep the counts, by keeping them in a small SQLite database the workers share.
+
+    Each limit is a sliding window counter: we count requests in fixed windows, and weigh the count of the previous window by how much of it the sliding window still covers. This needs two counters per limit, rather than a timestamp per request, and is checked and counted in a single statement, so that two workers can never both take the last request of a window.
+
+'''
+
+import math, os, sqlite3, threading, time
+
+# Import our configuration.
+import config
+
+# Define our table. Each limit is keyed by what it limits and its period, since a client may be held to different limits on different endpoints.
+schema = """
+
+    CREATE TABLE IF NOT EXISTS rate_limits (
+
+        key TEXT PRIMARY KEY,
+        window INTEGER NOT NULL,
+        previous INTEGER NOT NULL,
+        current INTEGER NOT NULL
+
+    ) WITHOUT ROWID;
+
+"""
+
+# Define the statement that counts a request if the limit allows it. The counts are first moved on to the current window: the previous window's count is the current count if the stored window is the one just before, and nothing if it's older. The request is then only counted if the weighted count of both windows leaves room for it, and the counts are only returned if it was.
+acquire_statement = """
+
+    INSERT INTO rate_limits (key, window, previous, current) VALUES (:key, :window, 0, 1)
+    ON CONFLICT (key) DO UPDATE SET
+
+        previous = CASE WHEN window = :window THEN previous WHEN window = :window - 1 THEN current ELSE 0 END,
+        current = CASE WHEN window = :window THEN current ELSE 0 END + 1,
+        window = :window
+
+    WHERE
+
+        (CASE WHEN window = :window THEN previous WHEN window = :window - 1 THEN current ELSE 0 END) * :weight +
+        (CASE WHEN window = :window THEN current ELSE 0 END) + 1 <= :limit
+
+    RETURNING previous, current
+
+"""
+
+# Define a class to represent the rate limits shared between workers.
+class RateLimits:
+
+    def __init__(self, path=config.rate_limit_path):
+
+        # Store the path to the database and a connection for each thread.
+        self.path = path
+        self.local = threading.local()
+
+        # Remember which process opened the database, since connections can't be shared with forked processes.
+        self.pid = os.getpid()
+
+        self.connection().executescript(schema)
+
+    # Retrieve the connection of the current thread, opening it on first use.
+    def connection(self):
+
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+
+            # Each statement commits on its own. The counts are worthless after a crash, so we never wait for the disk.
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=16)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+
+            self.local.connection = connection
+
+        return connection
+
+    # Count a request against a limit, which allows a number of requests per period in seconds. Returns None if the request is allowed, or otherwise how many seconds to wait before it would be.
+    def acquire(self, key, limit, period):
+
+        now = time.time()
+        window = int(now // period)
+
+        # The sliding window covers the part of the previous window that the current window hasn't reached yet.
+        weight = 1 - (now - window * period) / period
+
+        row = self.connection().execute(acquire_statement, {
+
+            "key": key + ":" + str(period),
+            "window": window,
+            "weight": weight,
+            "limit": limit
+
+        }).fetchone()
+
+        if row is not None:
+            return None
+
+        return self.retry_after(key, limit, period, now)
+
+    # Work out how long a rejected request must wait, which is until enough of the previous window has slid out of the sliding window to leave room for it.
+    def retry_after(self, key, limit, period, now):
+
+        window = int(now // period)
+        row = self.connection().execute("SELECT window, previous, current FROM rate_limits WHERE key = ?", (key + ":" + str(period),)).fetchone()
+
+        if row is None:
+            return 0
+
+        stored_window, previous, current = row
+        if stored_window != window:
+            previous, current = (current if stored_window == window - 1 else 0), 0
+
+        elapsed = now - window * period
+
+        # If the current window alone leaves room, the wait is until the previous window's share has shrunk enough.
+        if current + 1 <= limit:
+            return max(0, math.ceil((1 - (limit - current - 1) / previous) * period - elapsed)) if previous else 0
+
+        # Otherwise, it's until the next window, once the current window's share has shrunk enough.
+        return math.ceil(period - elapsed + (1 - (limit - 1) / current) * period)
+
+# Store the process-wide rate limits.
+rate_limits = None
+rate_limits_lock = threading.Lock()
+
+# Retrieve the process-wide rate limits, opening their database on first use.
+def get_rate_limits():
+
+    global rate_limits
+
+    if rate_limits is not None and rate_limits.pid == os.getpid():
+        return rate_limits
+
+    with rate_limits_lock:
+
+        if rate_limits is None or rate_limits.pid != os.getpid():
+            rate_limits = RateLimits()
+
+    return rate_limits
@@ -0,0 +1,116 @@
+'''
+
+    We aim to redistribute the records of an existing database across a different number of shards. This must only be run while the server is stopped.
+
+    Usage: python reshard.py SHARDS DIRECTORY [--from-shards N] [--backend dbm|sqlite]
+
+'''
+
+import argparse, dbm, os, sqlite3
+
+# Import our configuration.
+import config
+
+# Import sharding and the layouts of each storage engine.
+from sharding import shard_of, shard_path
+from backends import schema_version_key
+from sqlite_backend import schema
+
+# Build the path of a destination shard, named as the server will expect it but placed in the output directory.
+def destination_path(path, directory, shard, shards):
+    return os.path.join(directory, os.path.basename(shard_path(path, shard, shards)))
+
+# Copy every key of the key-value shards into the shard of the token it belongs to. Values are copied as they're stored, without being decoded.
+def reshard_dbm(source_shards, destination_shards, directory):
+
+    destinations = [dbm.open(destination_path(config.database_path, directory, shard, destination_shards), "c") for shard in range(destination_shards)]
+    copied = 0
+
+    for source in range(source_shards):
+
+        with dbm.open(shard_path(config.database_path, source, source_shards), "r") as database:
+
+            for key in database.keys():
+
+                name = key.decode() if isinstance(key, bytes) else key
+
+                # Every shard records the version of its layout.
+                if name == schema_version_key:
+
+                    for destination in destinations:
+                        destination[key] = database[key]
+
+                    continue
+
+                # Every other key starts with the token of the record it belongs to, which can't contain the separator.
+                destinations[shard_of(name.split(":", 1)[0], destination_shards)][key] = database[key]
+                copied += 1
+
+    for destination in destinations:
+        destination.close()
+
+    return copied
+
+# Copy every client of the SQLite shards, and every row that refers to it, into the shard of its token.
+def reshard_sqlite(source_shards, destination_shards, directory):
+
+    destinations = []
+    for shard in range(destination_shards):
+
+        destination = sqlite3.connect(destination_path(config.sqlite_path, directory, shard, destination_shards))
+        destination.executescript(schema)
+        destinations.append(destination)
+
+    copied = 0
+
+    for source in range(source_shards):
+
+        database = sqlite3.connect(shard_path(config.sqlite_path, source, source_shards))
+
+        # Read the columns of each table, other than the identifiers that are renumbered in the destination.
+        columns = {table: [row[1] for row in database.execute("PRAGMA table_info(" + table + ")") if row[1] not in ("id", "client_id")] for table in ("clients", "interfaces", "mounting_points", "samples", "audit_events")}
+
+        for row in database.execute("SELECT id, " + ", ".join(columns["clients"]) + " FROM clients").fetchall():
+
+            client_id, values = row[0], row[1:]
+            destination = destinations[shard_of(values[columns["clients"].index("token")], destination_shards)]
+
+            new_client_id = destination.execute("INSERT INTO clients (" + ", ".join(columns["clients"]) + ") VALUES (" + ", ".join("?" * len(values)) + ")", values).lastrowid
+
+            # Copy every row that refers to the client, keeping audit events in the order they were recorded.
+            for table in ("interfaces", "mounting_points", "samples", "audit_events"):
+
+                order = " ORDER BY id" if table == "audit_events" else ""
+                rows = database.execute("SELECT " + ", ".join(columns[table]) + " FROM " + table + " WHERE client_id = ?" + order, (client_id,))
+                destination.executemany("INSERT INTO " + table + " (client_id, " + ", ".join(columns[table]) + ") VALUES (?, " + ", ".join("?" * len(columns[table])) + ")", ((new_client_id,) + tuple(child) for child in rows))
+
+            copied += 1
+
+        database.close()
+
+    for destination in destinations:
+        destination.commit()
+        destination.close()
+
+    return copied
+
+if __name__ == "__main__":
+
+    # Parse our arguments.
+    parser = argparse.ArgumentParser(description="Redistribute records across a different number of shards.")
+    parser.add_argument("shards", type=int, help="The number of shards to redistribute records across.")
+    parser.add_argument("directory", help="The directory to write the new shards to, which the server's databases are then replaced with.")
+    parser.add_argument("--from-shards", type=int, default=config.shards, help="The number of shards records are currently stored across.")
+    parser.add_argument("--backend", default=config.backend, choices=("dbm", "sqlite"), help="The storage engine the records are stored in.")
+    arguments = parser.parse_args()
+
+    os.makedirs(arguments.directory, exist_ok=True)
+
+    # Redistribute the records.
+    if arguments.backend == "dbm":
+        copied = reshard_dbm(arguments.from_shards, arguments.shards, arguments.directory)
+        print("Copied " + str(copied) + " keys into " + str(arguments.shards) + " shards.")
+
+    else:
+        copied = reshard_sqlite(arguments.from_shards, arguments.shards, arguments.directory)
+        print("Copied " + str(copied) + " clients into " + str(arguments.shards) + " shards.")
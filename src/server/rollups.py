@@ -0,0 +1,113 @@
+'''
+
+    We aim to keep minimum, maximum, average and count aggregates of each metric at coarser resolutions, updated as samples arrive, so that long-range reads never scan raw samples.
+
+'''
+
+# Import our configuration.
+import config
+
+# Import the fields of each metric.
+from history import fields_of
+
+# Define each tier by its resolution in seconds, how long it's retained and how many buckets each of its chunks holds.
+tiers = (
+
+    (60, config.rollup_minute_retention, 24 * 60),
+    (60 * 60, config.rollup_hour_retention, 7 * 24),
+    (24 * 60 * 60, config.rollup_day_retention, 30)
+
+)
+
+# Retrieve the fields of a metric's aggregates, which are the minimum, maximum and average of each of its fields followed by the number of samples, or None if we don't keep a history of it.
+def rollup_fields_of(metric):
+
+    fields = fields_of(metric)
+    if fields is None:
+        return None
+
+    return tuple(field + "_" + aggregate for field in fields for aggregate in ("min", "max", "avg")) + ("count",)
+
+# Fold a sample into the aggregates of a bucket, or start the aggregates from the sample if the bucket is new.
+def fold(aggregates, values):
+
+    if aggregates is None:
+        return [value for value in values for _ in range(3)] + [1]
+
+    count = aggregates[-1] + 1
+    folded = []
+
+    for position, value in enumerate(values):
+
+        minimum, maximum, average = aggregates[position * 3:position * 3 + 3]
+        folded += [min(minimum, value), max(maximum, value), average + (value - average) / count]
+
+    return folded + [count]
+
+# Merge the aggregates of two buckets.
+def merge(aggregates, other):
+
+    count = aggregates[-1] + other[-1]
+    merged = []
+
+    for position in range(0, len(aggregates) - 1, 3):
+
+        minimum, maximum, average = aggregates[position:position + 3]
+        other_minimum, other_maximum, other_average = other[position:position + 3]
+        merged += [min(minimum, other_minimum), max(maximum, other_maximum), (average * aggregates[-1] + other_average * other[-1]) / count]
+
+    return merged + [count]
+
+# Define a class to represent the rolled up histories stored in the database.
+class Rollups:
+
+    # Each tier is stored as its own history, created by the storage engine from a chunk size, a capacity sized to its retention, a namespace and the fields of its metrics.
+    def __init__(self, make_history):
+
+        self.tiers = [
+
+            (resolution, make_history(chunk_size, max(chunk_size, retention // resolution), "rollup:" + str(resolution), rollup_fields_of))
+            for resolution, retention, chunk_size in tiers
+
+        ]
+
+    # Fold a sample into the current bucket of every tier.
+    def add(self, token, metric, timestamp, values):
+
+        for resolution, history in self.tiers:
+            history.upsert(token, metric, int(timestamp) // resolution * resolution, lambda aggregates: fold(aggregates, values))
+
+    # Retrieve a metric's aggregates within a time range at the requested resolution, oldest first. This reads the coarsest tier that's at least as fine as the resolution, merging its buckets further if the resolution is coarser still. Returns None if the resolution is finer than every tier.
+    def query(self, token, metric, resolution, start=None, end=None, limit=None):
+
+        tier = None
+        for tier_resolution, history in self.tiers:
+
+            if tier_resolution <= resolution:
+                tier = (tier_resolution, history)
+
+        if tier is None:
+            return None
+
+        tier_resolution, history = tier
+
+        # If the tier already has the requested resolution, its buckets can be returned as they are.
+        if tier_resolution == resolution:
+            return history.query(token, metric, start, end, limit)
+
+        # Otherwise, merge consecutive buckets that fall into the same bucket at the requested resolution.
+        buckets = []
+        for sample in history.query(token, metric, start, end):
+
+            timestamp = sample[0] // resolution * resolution
+
+            if buckets and buckets[-1][0] == timestamp:
+                buckets[-1] = [timestamp] + merge(buckets[-1][1:], sample[1:])
+                continue
+
+            if limit is not None and len(buckets) >= limit:
+                break
+
+            buckets.append([timestamp] + sample[1:])
+
+        return buckets
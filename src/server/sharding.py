@@ -0,0 +1,79 @@
+'''
+
+    We aim to partition records across several databases by a stable hash of their token, so that writes to different shards never wait on each other and fleet-wide reads can run across shards in parallel.
+
+'''
+
+import concurrent.futures, contextlib, os, zlib
+
+# Retrieve the shard a token belongs to. This must never change for a given token and shard count, so we use a checksum rather than Python's randomized string hash.
+def shard_of(token, shards):
+    return zlib.crc32(token.encode()) % shards
+
+# Build the path of a shard's database from the path of the unsharded database, such as "monitor.2.sqlite" for "monitor.sqlite".
+def shard_path(path, shard, shards):
+
+    if shards == 1:
+        return path
+
+    root, extension = os.path.splitext(path)
+    return root + "." + str(shard) + extension
+
+# Define a class to represent records partitioned across several storage engines, each with its own database, threads and locks.
+class ShardedBackend:
+
+    def __init__(self, shards):
+
+        # Store our shards, and the threads used to read from all of them at once.
+        self.shards = shards
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="monitor-shard")
+
+    # Retrieve the index of the shard a token belongs to.
+    def shard_index(self, token):
+        return shard_of(token, len(self.shards))
+
+    # Retrieve the storage engine of the shard a token belongs to.
+    def shard(self, token):
+        return self.shards[self.shard_index(token)]
+
+    # Run a function against every shard in parallel, returning their results in shard order.
+    def fan_out(self, function):
+        return list(self.executor.map(function, self.shards))
+
+    # Retrieve a section of a record from its shard.
+    def load(self, token, section):
+        return self.shard(token).load(token, section)
+
+    # Store changed sections of a record in its shard.
+    def save(self, token, sections):
+        self.shard(token).save(token, sections)
+
+    # Group several saves into a single write to each shard.
+    @contextlib.contextmanager
+    def group(self):
+
+        with contextlib.ExitStack() as stack:
+
+            for shard in self.shards:
+                stack.enter_context(shard.group())
+
+            yield
+
+    def rollback(self):
+
+        for shard in self.shards:
+            shard.rollback()
+
+    # List the tokens of every stored record, reading every shard at once.
+    def tokens(self):
+        return [token for tokens in self.fan_out(lambda shard: shard.tokens()) for token in tokens]
+
+    def flush(self):
+        self.fan_out(lambda shard: shard.flush())
+
+    def close(self):
+
+        for shard in self.shards:
+            shard.close()
+
+        self.executor.shutdown()
@@ -0,0 +1,258 @@
+'''
+
+    We aim to summarize the distribution of a metric, such as a client's round-trip time, in constant memory, so that we can answer its percentiles without keeping every sample. Sketches of different clients merge into a sketch of the whole fleet.
+
+    A sketch is a DDSketch: each value is counted in a bucket whose bounds grow geometrically, so any quantile is answered to within a fixed relative error. Sketches are plain JSON-serializable objects, so that they're stored like any other section of a record.
+
+'''
+
+import math
+
+# Import our configuration.
+import config
+
+# Define the growth of the buckets, which answers every quantile to within the configured relative error.
+gamma = (1 + config.sketch_relative_accuracy) / (1 - config.sketch_relative_accuracy)
+log_gamma = math.log(gamma)
+
+# Define the smallest value we distinguish from zero, in the unit of the metric. Values at or below it are counted as zero.
+minimum_value = 1e-6
+
+# Define the quantiles we report, alongside the name each is reported under.
+reported_quantiles = (
+
+    ("p50", 0.5),
+    ("p95", 0.95),
+    ("p99", 0.99)
+
+)
+
+# Create an empty sketch. The counts are of consecutive buckets, starting from the bucket at the offset.
+def empty():
+
+    return {
+
+        "zero": 0,
+        "offset": 0,
+        "counts": []
+
+    }
+
+# Retrieve the bucket a positive value is counted in.
+def bucket_of(value):
+    return math.ceil(math.log(value) / log_gamma)
+
+# Retrieve the value a bucket stands for, which is within the relative error of every value counted in it.
+def value_of(bucket):
+    return 2 * gamma ** bucket / (gamma + 1)
+
+# Bound a sketch to the configured number of buckets by folding its lowest buckets into the lowest one we keep. This only loses accuracy in the lowest quantiles, and latency objectives are about the highest ones.
+def collapse(sketch):
+
+    counts = sketch["counts"]
+    excess = len(counts) - config.sketch_max_buckets
+
+    if excess > 0:
+        counts[excess] += sum(counts[:excess])
+        del counts[:excess]
+        sketch["offset"] += excess
+
+# Count a value in a sketch.
+def add(sketch, value):
+
+    if value <= minimum_value:
+        sketch["zero"] += 1
+        return
+
+    bucket = bucket_of(value)
+    counts = sketch["counts"]
+
+    if not counts:
+        sketch["offset"] = bucket
+        counts.append(1)
+        return
+
+    # Grow the buckets down to the value's, unless that would take us past the limit, in which case the value is counted in the lowest bucket as if we'd collapsed.
+    if bucket < sketch["offset"]:
+
+        if sketch["offset"] - bucket + len(counts) > config.sketch_max_buckets:
+            counts[0] += 1
+            return
+
+        counts[0:0] = [0] * (sketch["offset"] - bucket)
+        sketch["offset"] = bucket
+
+    # Grow the buckets up to the value's.
+    elif bucket >= sketch["offset"] + len(counts):
+        counts.extend([0] * (bucket - sketch["offset"] - len(counts) + 1))
+        collapse(sketch)
+
+    counts[bucket - sketch["offset"]] += 1
+
+# Add the counts of another sketch to a sketch, leaving the other as it is.
+def absorb(sketch, other):
+
+    sketch["zero"] += other["zero"]
+
+    if not other["counts"]:
+        return
+
+    counts = sketch["counts"]
+    if not counts:
+        sketch["offset"] = other["offset"]
+        sketch["counts"] = list(other["counts"])
+        return
+
+    # Grow the buckets to cover both sketches' buckets.
+    if other["offset"] < sketch["offset"]:
+        counts[0:0] = [0] * (sketch["offset"] - other["offset"])
+        sketch["offset"] = other["offset"]
+
+    end = other["offset"] + len(other["counts"])
+    if end > sketch["offset"] + len(counts):
+        counts.extend([0] * (end - sketch["offset"] - len(counts)))
+
+    for position, count in enumerate(other["counts"], other["offset"] - sketch["offset"]):
+        counts[position] += count
+
+    collapse(sketch)
+
+# Merge sketches into a new sketch, leaving them as they are. None stands for an empty sketch.
+def merge(*sketches):
+
+    merged = empty()
+    for sketch in sketches:
+
+        if sketch is not None:
+            absorb(merged, sketch)
+
+    return merged
+
+# Retrieve how many values a sketch has counted.
+def count(sketch):
+    return sketch["zero"] + sum(sketch["counts"])
+
+# Retrieve the reported quantiles of a sketch in a single pass over its buckets, alongside how many values it has counted. Every quantile is None if the sketch is empty.
+def summarize(sketch):
+
+    total = count(sketch)
+    summary = {name: None for name, quantile in reported_quantiles}
+    summary["count"] = total
+
+    if total == 0:
+        return summary
+
+    # Walk the buckets in order, answering each quantile once the values counted so far pass its rank.
+    pending = sorted(reported_quantiles, key=lambda entry: entry[1])
+    cumulative = sketch["zero"]
+
+    while pending and cumulative > pending[0][1] * (total - 1):
+        summary[pending.pop(0)[0]] = 0.0
+
+    for position, bucket_count in enumerate(sketch["counts"]):
+
+        cumulative += bucket_count
+        while pending and cumulative > pending[0][1] * (total - 1):
+            summary[pending.pop(0)[0]] = value_of(sketch["offset"] + position)
+
+    return summary
+
+# Retrieve the start of the window a timestamp falls in. Windows are aligned to multiples of their length, so the windows of every client line up and merge.
+def window_of(timestamp):
+    return int(timestamp // config.sketch_window) * config.sketch_window
+
+# Create the windowed sketches of a metric, which keep a sketch of the current window and of the one before it, so that percentiles always cover between one and two windows of samples.
+def empty_windows(timestamp):
+
+    return {
+
+        "start": window_of(timestamp),
+        "current": empty(),
+        "previous": None
+
+    }
+
+# Copy a sketch, which may be None.
+def copy(sketch):
+
+    if sketch is None:
+        return None
+
+    return {
+
+        "zero": sketch["zero"],
+        "offset": sketch["offset"],
+        "counts": list(sketch["counts"])
+
+    }
+
+# Copy windowed sketches, which may be None.
+def copy_windows(windows):
+
+    if windows is None:
+        return None
+
+    return {
+
+        "start": windows["start"],
+        "current": copy(windows["current"]),
+        "previous": copy(windows["previous"])
+
+    }
+
+# Move windowed sketches on to the window a timestamp falls in, keeping the current window as the previous one if it's the window just before.
+def rotate(windows, timestamp):
+
+    start = window_of(timestamp)
+    if start > windows["start"]:
+
+        windows["previous"] = windows["current"] if start - windows["start"] == config.sketch_window else None
+        windows["current"] = empty()
+        windows["start"] = start
+
+# Count a value in windowed sketches, creating them if they're None. Returns the windowed sketches.
+def observe(windows, timestamp, value):
+
+    if windows is None:
+        windows = empty_windows(timestamp)
+
+    rotate(windows, timestamp)
+    add(windows["current"], value)
+
+    return windows
+
+# Retrieve the sketches of the current and previous windows as of a timestamp, without changing the windowed sketches. Either may be None.
+def recent(windows, timestamp):
+
+    if windows is None:
+        return None, None
+
+    start = window_of(timestamp)
+
+    if windows["start"] == start:
+        return windows["current"], windows["previous"]
+
+    if windows["start"] == start - config.sketch_window:
+        return None, windows["current"]
+
+    return None, None
+
+# Add the counts of other windowed sketches, which may be None, to windowed sketches as of a timestamp, leaving the others as they are.
+def absorb_windows(windows, other, timestamp):
+
+    rotate(windows, timestamp)
+    current, previous = recent(other, timestamp)
+
+    if current is not None:
+        absorb(windows["current"], current)
+
+    if previous is not None:
+
+        if windows["previous"] is None:
+            windows["previous"] = empty()
+
+        absorb(windows["previous"], previous)
+
+# Retrieve the reported quantiles of windowed sketches as of a timestamp, over both windows.
+def summarize_windows(windows, timestamp):
+    return summarize(merge(*recent(windows, timestamp)))
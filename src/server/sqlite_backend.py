@@ -0,0 +1,588 @@
+'''
+
+    We aim to store records in typed, normalized SQLite tables, so that several worker processes can ingest concurrently and only the columns an update touches are written.
+
+'''
+
+import contextlib, json, sqlite3, threading, time
+
+# Import our configuration.
+import config
+
+# Import the rolled up histories and the fields of each metric.
+from rollups import Rollups
+from history import fields_of
+
+# Import our metrics, resolving the series we time each operation with once.
+import metrics
+
+open_duration = metrics.storage_duration.labels("sqlite", "open")
+read_duration = metrics.storage_duration.labels("sqlite", "read")
+write_duration = metrics.storage_duration.labels("sqlite", "write")
+commit_duration = metrics.storage_duration.labels("sqlite", "commit")
+
+# Define the widest sample we store, which is a rolled up metric with two fields.
+value_columns = 7
+
+# Define our tables. Every table but the clients table refers to a client by its row identifier rather than its token.
+schema = """
+
+    CREATE TABLE IF NOT EXISTS clients (
+
+        id INTEGER PRIMARY KEY,
+        token TEXT NOT NULL UNIQUE,
+        created_at REAL,
+        updated_at REAL,
+        latency REAL,
+        latency_sketch TEXT,
+        cpu_threads INTEGER,
+        cpu_cores INTEGER,
+        cpu_model TEXT,
+        cpu_load REAL,
+        memory_available INTEGER,
+        memory_used INTEGER,
+        swap_available INTEGER,
+        swap_used INTEGER
+
+    );
+
+    CREATE TABLE IF NOT EXISTS interfaces (
+
+        client_id INTEGER NOT NULL REFERENCES clients (id),
+        name TEXT NOT NULL,
+        ipv6 TEXT,
+        ipv4 TEXT,
+        mac TEXT,
+        seen_at REAL,
+        PRIMARY KEY (client_id, name)
+
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS mounting_points (
+
+        client_id INTEGER NOT NULL REFERENCES clients (id),
+        path TEXT NOT NULL,
+        used INTEGER,
+        available INTEGER,
+        seen_at REAL,
+        PRIMARY KEY (client_id, path)
+
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS samples (
+
+        client_id INTEGER NOT NULL REFERENCES clients (id),
+        series TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        arrived_at INTEGER,
+        value_0 REAL, value_1 REAL, value_2 REAL, value_3 REAL, value_4 REAL, value_5 REAL, value_6 REAL,
+        PRIMARY KEY (client_id, series, metric, timestamp)
+
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS audit_events (
+
+        id INTEGER PRIMARY KEY,
+        client_id INTEGER NOT NULL REFERENCES clients (id),
+        timestamp REAL NOT NULL,
+        event TEXT NOT NULL,
+        description TEXT NOT NULL
+
+    );
+
+    CREATE INDEX IF NOT EXISTS audit_events_by_client ON audit_events (client_id, id);
+
+"""
+
+# Define the columns of the tables that store each keyed section, starting with the column each entry is keyed by.
+keyed_columns = {
+
+    "interfaces": ("name", "ipv6", "ipv4", "mac", "seen_at"),
+    "mounting_points": ("path", "used", "available", "seen_at")
+
+}
+
+# Bring tables created by earlier versions up to the current layout. Every step takes the database's write lock and checks again whether it's needed, since several processes may start at once.
+def migrate(connection):
+
+    # Interfaces and mounting points were once stored by their position in a list, which let the same one be stored several times. Set the old tables aside so they're recreated keyed by their name and path.
+    connection.execute("BEGIN IMMEDIATE")
+    for table in keyed_columns:
+
+        if "position" in [row[1] for row in connection.execute("PRAGMA table_info(" + table + ")")]:
+            connection.execute("ALTER TABLE " + table + " RENAME TO legacy_" + table)
+
+    connection.commit()
+
+    # Create our tables.
+    connection.executescript(schema)
+
+    # Sketches of round-trip times were added to the clients table after it was first created.
+    connection.execute("BEGIN IMMEDIATE")
+    if "latency_sketch" not in [row[1] for row in connection.execute("PRAGMA table_info(clients)")]:
+        connection.execute("ALTER TABLE clients ADD COLUMN latency_sketch TEXT")
+
+    connection.commit()
+
+    # When each sample arrived was added to the samples table after it was first created. Samples stored before then are read as if they arrived when they were collected.
+    connection.execute("BEGIN IMMEDIATE")
+    if "arrived_at" not in [row[1] for row in connection.execute("PRAGMA table_info(samples)")]:
+        connection.execute("ALTER TABLE samples ADD COLUMN arrived_at INTEGER")
+
+    connection.commit()
+
+    # Copy each old table into its replacement, where the last of any duplicates is the most recently reported. Every entry is treated as just reported, so that none are removed before the client has had a chance to report them again.
+    connection.execute("BEGIN IMMEDIATE")
+    for table, columns in keyed_columns.items():
+
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", ("legacy_" + table,)).fetchone() is None:
+            continue
+
+        connection.execute("INSERT OR REPLACE INTO " + table + " (client_id, " + ", ".join(columns) + ") SELECT client_id, " + ", ".join(columns[:-1]) + ", ? FROM legacy_" + table + " ORDER BY client_id, position", (time.time(),))
+        connection.execute("DROP TABLE legacy_" + table)
+
+    connection.commit()
+
+# Define the columns of the clients table that store each single-valued section.
+section_columns = {
+
+    "metadata": ("created_at", "updated_at"),
+    "latency": ("latency",),
+    "latency_sketch": ("latency_sketch",),
+    "cpu": ("cpu_threads", "cpu_cores", "cpu_model", "cpu_load"),
+    "memory": ("memory_available", "memory_used", "swap_available", "swap_used")
+
+}
+
+# Build the statements that read and write each single-valued section. These never change, so each connection prepares them once and reuses them from its statement cache.
+select_section = {section: "SELECT " + ", ".join(columns) + " FROM clients WHERE id = ?" for section, columns in section_columns.items()}
+update_section = {section: "UPDATE clients SET " + ", ".join(column + " = ?" for column in columns) + " WHERE id = ?" for section, columns in section_columns.items()}
+
+# Build the statements that read and write each keyed section.
+select_keyed = {section: "SELECT " + ", ".join(columns) + " FROM " + section + " WHERE client_id = ?" for section, columns in keyed_columns.items()}
+insert_keyed = {section: "INSERT INTO " + section + " (client_id, " + ", ".join(columns) + ") VALUES (?, " + ", ".join("?" * len(columns)) + ")" for section, columns in keyed_columns.items()}
+
+# Build the statements that read and write samples.
+value_names = ", ".join("value_" + str(position) for position in range(value_columns))
+select_samples = "SELECT timestamp, " + value_names + " FROM samples WHERE client_id = ? AND series = ? AND metric = ? AND timestamp >= ? AND timestamp <= ? AND COALESCE(arrived_at, timestamp) > ? AND COALESCE(arrived_at, timestamp) <= ? ORDER BY timestamp LIMIT ?"
+select_sample = "SELECT " + value_names + " FROM samples WHERE client_id = ? AND series = ? AND metric = ? AND timestamp = ?"
+insert_sample = "INSERT OR REPLACE INTO samples (client_id, series, metric, timestamp, arrived_at, " + value_names + ") VALUES (?, ?, ?, ?, ?, " + ", ".join("?" * value_columns) + ")"
+
+# Convert a stored row into the value of a section.
+def section_from_row(section, row):
+
+    if section == "metadata":
+        return {"created_at": row[0], "updated_at": row[1]}
+
+    if section == "latency":
+        return row[0]
+
+    if section == "latency_sketch":
+        return None if row[0] is None else json.loads(row[0])
+
+    if section == "cpu":
+        return {"threads": row[0], "cores": row[1], "model": row[2], "load": row[3]}
+
+    if section == "memory":
+        return {"available": row[0], "used": row[1], "swap": None if row[2] is None else {"available": row[2], "used": row[3]}}
+
+# Convert the value of a section into the columns it's stored in.
+def row_from_section(section, value):
+
+    if section == "metadata":
+        return (value["created_at"], value["updated_at"])
+
+    if section == "latency":
+        return (value,)
+
+    if section == "latency_sketch":
+        return (None if value is None else json.dumps(value, separators=(",", ":")),)
+
+    if section == "cpu":
+        return (value["threads"], value["cores"], value["model"], value["load"])
+
+    if section == "memory":
+        swap = value["swap"] or {"available": None, "used": None}
+        return (value["available"], value["used"], swap["available"], swap["used"])
+
+# Define a class to represent the metric histories stored in the samples table.
+class SQLiteHistory:
+
+    def __init__(self, backend, chunk_size=config.history_chunk_size, capacity=config.history_capacity, namespace="history", fields=fields_of):
+
+        # Store our settings. We trim each series back to its capacity once every chunk's worth of samples, remembering the latest timestamp we trimmed.
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.namespace = namespace
+        self.fields = fields
+        self.appended = {}
+        self.trimmed = {}
+
+    # Retrieve the metrics a client has a history of.
+    def metrics(self, token):
+
+        client_id = self.backend.client_id(token)
+        return [row[0] for row in self.backend.connection().execute("SELECT DISTINCT metric FROM samples WHERE client_id = ? AND series = ?", (client_id, self.namespace))]
+
+    # Add a sample to a metric's history, returning False if it was dropped. A later sample within the same second replaces the earlier one.
+    def append(self, token, metric, timestamp, values):
+        return self.store(self.backend.client_id(token), metric, int(timestamp), values)
+
+    # Add a sample to a metric's history, or replace the sample with the same timestamp. The values are computed from those of the sample being replaced, or None if there isn't one. Returns False if the sample was dropped.
+    def upsert(self, token, metric, timestamp, combine):
+
+        client_id = self.backend.client_id(token)
+        timestamp = int(timestamp)
+
+        row = self.backend.connection().execute(select_sample, (client_id, self.namespace, metric, timestamp)).fetchone()
+        width = len(self.fields(metric))
+        return self.store(client_id, metric, timestamp, combine(None if row is None else list(row[:width])))
+
+    # Write a sample, trimming the series back to its capacity every so often. A sample no newer than those we've trimmed is dropped, as it's beyond our capacity, and False is returned.
+    def store(self, client_id, metric, timestamp, values):
+
+        series = (client_id, metric)
+        if timestamp <= self.trimmed.get(series, -1):
+            return False
+
+        connection = self.backend.connection()
+        values = list(values) + [None] * (value_columns - len(values))
+        connection.execute(insert_sample, [client_id, self.namespace, metric, timestamp, int(time.time())] + values)
+
+        self.appended[series] = self.appended.get(series, 0) + 1
+
+        if self.appended[series] >= self.chunk_size:
+
+            self.appended[series] = 0
+            cutoff = connection.execute("SELECT timestamp FROM samples WHERE client_id = ? AND series = ? AND metric = ? ORDER BY timestamp DESC LIMIT 1 OFFSET ?", (client_id, self.namespace, metric, self.capacity)).fetchone()
+
+            if cutoff is not None:
+                connection.execute("DELETE FROM samples WHERE client_id = ? AND series = ? AND metric = ? AND timestamp <= ?", (client_id, self.namespace, metric, cutoff[0]))
+                self.trimmed[series] = cutoff[0]
+
+        return True
+
+    # Retrieve the samples of a metric's history within a time range, oldest first, optionally only those that arrived after one time and by another.
+    def query(self, token, metric, start=None, end=None, limit=None, arrived_after=None, arrived_by=None):
+
+        client_id = self.backend.client_id(token)
+        width = len(self.fields(metric))
+
+        rows = self.backend.connection().execute(select_samples, (
+
+            client_id,
+            self.namespace,
+            metric,
+            -1 if start is None else start,
+            2 ** 32 if end is None else end,
+            -1 if arrived_after is None else arrived_after,
+            2 ** 32 if arrived_by is None else arrived_by,
+            -1 if limit is None else limit
+
+        ))
+
+        return [list(row[:width + 1]) for row in rows]
+
+# Define a class to represent the audit logs stored in the audit events table.
+class SQLiteAuditLog:
+
+    def __init__(self, backend, max_events=config.audit_segment_size * config.audit_max_segments, max_age=config.audit_max_age, compact_every=config.audit_segment_size):
+
+        # Store our settings. We apply retention to each log once every so many events.
+        self.backend = backend
+        self.max_events = max_events
+        self.max_age = max_age
+        self.compact_every = compact_every
+        self.appended = {}
+
+    # Append an event to the end of an audit log.
+    def append(self, token, entry):
+
+        client_id = self.backend.client_id(token)
+        self.backend.connection().execute(
+
+            "INSERT INTO audit_events (client_id, timestamp, event, description) VALUES (?, ?, ?, ?)",
+            (client_id, entry["timestamp"], entry["event"], entry["description"])
+
+        )
+
+        self.appended[client_id] = self.appended.get(client_id, 0) + 1
+        if self.appended[client_id] >= self.compact_every:
+            self.appended[client_id] = 0
+            self.expire(client_id)
+
+    # Drop the events of an audit log beyond our size and age limits.
+    def expire(self, client_id):
+
+        connection = self.backend.connection()
+        connection.execute("DELETE FROM audit_events WHERE client_id = ? AND timestamp < ?", (client_id, time.time() - self.max_age))
+        connection.execute(
+
+            "DELETE FROM audit_events WHERE client_id = ? AND id <= (SELECT id FROM audit_events WHERE client_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (client_id, client_id, self.max_events)
+
+        )
+
+    # Apply retention to an audit log.
+    def compact(self, token):
+
+        self.expire(self.backend.client_id(token))
+        self.backend.commit()
+
+    # Read a page of events from an audit log in chronological order, optionally filtered by time range and event type. The returned cursor continues from where the page ended, or is None once there's nothing left.
+    def read(self, token, start=None, end=None, event=None, cursor=None, limit=100):
+
+        client_id = self.backend.client_id(token)
+
+        # Cursors are the identifier of the next event to return.
+        first_id = int(cursor) if cursor else 0
+
+        rows = self.backend.connection().execute(
+
+            "SELECT id, timestamp, description, event FROM audit_events WHERE client_id = ? AND id >= ? AND (? IS NULL OR timestamp >= ?) AND (? IS NULL OR timestamp <= ?) AND (? IS NULL OR event = ?) ORDER BY id LIMIT ?",
+            (client_id, first_id, start, start, end, end, event, event, limit + 1)
+
+        ).fetchall()
+
+        entries = [{"timestamp": row[1], "description": row[2], "event": row[3]} for row in rows[:limit]]
+        return entries, (str(rows[limit][0]) if len(rows) > limit else None)
+
+    # Iterate every retained event of an audit log in chronological order.
+    def entries(self, token):
+
+        cursor = None
+        while True:
+
+            entries, cursor = self.read(token, cursor=cursor, limit=1000)
+            yield from entries
+
+            if cursor is None:
+                return
+
+    # Append existing events to an audit log.
+    def extend(self, token, entries):
+
+        for entry in entries:
+            self.append(token, entry)
+
+# Define a class to represent records stored in SQLite.
+class SQLiteBackend:
+
+    def __init__(self, path):
+
+        # Store the path to the database and a connection for each thread.
+        self.path = path
+        self.local = threading.local()
+
+        # Remember the row identifier of each client we've seen, since every other table refers to clients by them. Clients each thread has created in its current transaction are only remembered once it commits.
+        self.client_ids = {}
+
+        # Create our tables, bringing any created by earlier versions up to date.
+        migrate(self.connection())
+
+        # Store the stores built on top of our tables.
+        self.audit_log = SQLiteAuditLog(self)
+        self.history = SQLiteHistory(self)
+        self.rollups = Rollups(lambda *arguments: SQLiteHistory(self, *arguments))
+
+        # An unsharded storage engine is its own only shard.
+        self.shards = [self]
+
+    def shard_index(self, token):
+        return 0
+
+    def shard(self, token):
+        return self
+
+    def fan_out(self, function):
+        return [function(self)]
+
+    # Retrieve the connection of the current thread, opening it on first use. Each connection keeps its prepared statements cached between requests.
+    def connection(self):
+
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+
+            with open_duration.time():
+
+                connection = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+
+                # Let readers continue while another connection writes, and only wait for the disk when the write-ahead log is checkpointed.
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute("PRAGMA synchronous = NORMAL")
+                connection.execute("PRAGMA foreign_keys = ON")
+
+            self.local.connection = connection
+
+        return connection
+
+    # Retrieve the clients the current thread has created in its current transaction, mapping their tokens to their row identifiers.
+    def created_client_ids(self):
+
+        created = getattr(self.local, "created_client_ids", None)
+        if created is None:
+            created = self.local.created_client_ids = {}
+
+        return created
+
+    # Retrieve the functions to call once the current thread's transaction commits, which are dropped if it's rolled back.
+    def commit_callbacks(self):
+
+        callbacks = getattr(self.local, "commit_callbacks", None)
+        if callbacks is None:
+            callbacks = self.local.commit_callbacks = []
+
+        return callbacks
+
+    # Call a function once what the current thread has saved is committed, which is right away unless it's saving within a group.
+    def after_commit(self, callback):
+
+        if getattr(self.local, "grouped", False):
+            self.commit_callbacks().append(callback)
+
+        else:
+            callback()
+
+    # Retrieve the row identifier of a client, creating the client if it doesn't exist yet.
+    def client_id(self, token):
+
+        client_id = self.client_ids.get(token)
+        if client_id is not None:
+            return client_id
+
+        created = self.created_client_ids()
+        if token in created:
+            return created[token]
+
+        connection = self.connection()
+        row = connection.execute("SELECT id FROM clients WHERE token = ?", (token,)).fetchone()
+
+        if row is not None:
+            self.client_ids[token] = row[0]
+            return row[0]
+
+        # New clients are created in the current transaction, so that they're written together with everything else, and only remembered once it commits, so that a rolled back request can never leave us remembering a row identifier that doesn't exist.
+        connection.execute("INSERT OR IGNORE INTO clients (token) VALUES (?)", (token,))
+        row = connection.execute("SELECT id FROM clients WHERE token = ?", (token,)).fetchone()
+
+        created[token] = row[0]
+        return row[0]
+
+    # Retrieve a section of a record, or None if it hasn't been stored.
+    def load(self, token, section):
+
+        client_id = self.client_id(token)
+        connection = self.connection()
+
+        with read_duration.time():
+
+            # Keyed sections map the first column of each row to the whole row.
+            if section in keyed_columns:
+                columns = keyed_columns[section]
+                rows = connection.execute(select_keyed[section], (client_id,))
+                return {row[0]: dict(zip(columns, row)) for row in rows}
+
+            row = connection.execute(select_section[section], (client_id,)).fetchone()
+            return None if row is None else section_from_row(section, row)
+
+    # Store changed sections of a record, committing them alongside any events and samples recorded since the last commit.
+    def save(self, token, sections):
+
+        client_id = self.client_id(token)
+        connection = self.connection()
+
+        with write_duration.time():
+
+            for section, value in sections.items():
+
+                # Keyed sections replace their rows, which removes any entries that are no longer in the section.
+                if section in keyed_columns:
+                    columns = keyed_columns[section]
+                    connection.execute("DELETE FROM " + section + " WHERE client_id = ?", (client_id,))
+                    connection.executemany(insert_keyed[section], [(client_id,) + tuple(entry[column] for column in columns) for entry in value.values()])
+
+                else:
+                    connection.execute(update_section[section], row_from_section(section, value) + (client_id,))
+
+        # Saves made within a group are committed together when the group ends.
+        if not getattr(self.local, "grouped", False):
+            self.commit()
+
+    # Group several saves into a single transaction, rolling all of them back if any of them fails. The transaction takes the database's write lock before anything is read, so that no other process can change a record between it being loaded and saved within the group, and groups nested within it join it.
+    @contextlib.contextmanager
+    def group(self):
+
+        if getattr(self.local, "grouped", False):
+            yield
+            return
+
+        # Anything written outside of a group so far is committed on its own.
+        connection = self.connection()
+        if connection.in_transaction:
+            self.commit()
+
+        connection.execute("BEGIN IMMEDIATE")
+        self.local.grouped = True
+
+        try:
+            yield
+            self.commit()
+
+        except BaseException:
+            self.rollback()
+            raise
+
+        finally:
+            self.local.grouped = False
+
+    # Load and save a record within a single transaction, so that no other process can change it in between.
+    def transaction(self):
+        return self.group()
+
+    # Commit the current thread's transaction.
+    def commit(self):
+
+        connection = self.connection()
+
+        with commit_duration.time():
+            connection.commit()
+
+        # The clients created in the transaction now exist for every thread.
+        created = self.created_client_ids()
+        if created:
+            self.client_ids.update(created)
+            created.clear()
+
+        # Only now is what was saved in the transaction visible to other threads, so only now can anything that mirrors it be updated.
+        callbacks = self.commit_callbacks()
+        while callbacks:
+            callbacks.pop(0)()
+
+    # Roll back anything the current thread hasn't committed, such as the writes of a request that failed part way through.
+    def rollback(self):
+
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and connection.in_transaction:
+            connection.rollback()
+
+        self.created_client_ids().clear()
+        self.commit_callbacks().clear()
+
+    # List the tokens of every stored record.
+    def tokens(self):
+        return [row[0] for row in self.connection().execute("SELECT token FROM clients WHERE created_at IS NOT NULL")]
+
+    # Every change is committed as it's saved.
+    def flush(self):
+        self.commit()
+
+    # Close the current thread's connection. Other threads' connections are closed as their threads exit.
+    def close(self):
+
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
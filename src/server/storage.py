@@ -0,0 +1,285 @@
+'''
+
+    We aim to keep a single long-lived handle to the database open for the lifetime of the process, holding hot values in memory and writing them back in the background.
+
+'''
+
+import atexit, collections, concurrent.futures, dbm, json, os, queue, threading, time
+
+# Import our configuration.
+import config
+
+# Import the compression of stored values.
+import compression
+
+# Import our metrics, resolving the series we time each operation with once.
+import metrics
+
+open_duration = metrics.storage_duration.labels("dbm", "open")
+read_duration = metrics.storage_duration.labels("dbm", "read")
+decode_duration = metrics.storage_duration.labels("dbm", "decode")
+encode_duration = metrics.storage_duration.labels("dbm", "encode")
+compress_duration = metrics.storage_duration.labels("dbm", "compress")
+write_duration = metrics.storage_duration.labels("dbm", "write")
+
+# Define a class to represent the process-wide storage layer.
+class Storage:
+
+    def __init__(self, path=config.database_path, cache_size=config.cache_size, flush_interval=config.flush_interval, flush_threshold=config.flush_threshold):
+
+        # Store our settings.
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+
+        # Store decoded values in least-recently-used order, alongside the serialized values that haven't been written yet.
+        self.cache = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.RLock()
+
+        # Some database modules only allow a handle to be used from the thread that opened it, so every database operation runs on one dedicated thread.
+        self.database = None
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.work_loop, name="monitor-storage", daemon=True)
+        self.worker.start()
+
+        # Remember which process owns this storage layer.
+        self.pid = os.getpid()
+
+        # Start writing dirty values back in the background.
+        self.closed = False
+        self.wake = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_loop, name="monitor-flusher", daemon=True)
+        self.flusher.start()
+
+    # Run database operations in order on the storage thread. Unlike an executor, this thread keeps serving us while the interpreter runs its exit handlers.
+    def work_loop(self):
+
+        while True:
+
+            future, function, arguments = self.requests.get()
+
+            try:
+                future.set_result(function(*arguments))
+
+            except BaseException as error:
+                future.set_exception(error)
+
+    # Queue a database operation on the storage thread, returning a future for its result.
+    def submit(self, function, *arguments):
+
+        future = concurrent.futures.Future()
+        self.requests.put((future, function, arguments))
+        return future
+
+    # Open the database on first use. This always runs on the storage thread.
+    def open(self):
+
+        if self.database is None:
+
+            with open_duration.time():
+                self.database = dbm.open(self.path, "c")
+
+        return self.database
+
+    # Read a serialized value from the database. This always runs on the storage thread.
+    def read(self, key):
+
+        database = self.open()
+
+        with read_duration.time():
+
+            try:
+                return database[key]
+
+            except KeyError:
+                return None
+
+    # Write serialized values to the database, removing any that were deleted. This always runs on the storage thread.
+    def write(self, items):
+
+        database = self.open()
+
+        # JSON values are compressed only as they're written, so a value that's replaced several times between flushes is only compressed once, and never while a request waits on it. Values with their own binary encoding are written as they are.
+        with compress_duration.time():
+            items = {key: compression.compress(serialized_value.encode()) if isinstance(serialized_value, str) else serialized_value for key, serialized_value in items.items()}
+
+        with write_duration.time():
+
+            for key, serialized_value in items.items():
+
+                if serialized_value is None:
+
+                    try:
+                        del database[key]
+
+                    except KeyError:
+                        pass
+
+                else:
+                    database[key] = serialized_value
+
+            # Not every database module buffers writes, but those that do should persist them now.
+            if hasattr(database, "sync"):
+                database.sync()
+
+    # Retrieve a value, decoding it from the database only if it isn't already in memory. Values are JSON, which may have been compressed, unless the caller provides its own decoder.
+    def get(self, key, decode=compression.loads):
+
+        with self.lock:
+
+            # Serve the value from memory if we can.
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            # If the value was evicted before it was written, decode it from the pending write instead of the database.
+            if key in self.pending:
+                serialized_value = self.pending[key]
+
+            # Otherwise, we'll read it from the database. We do this while holding the lock so that the read can never overtake a flush of the same key.
+            else:
+                serialized_value = self.submit(self.read, key).result()
+
+            if serialized_value is None:
+                return None
+
+            started_at = time.perf_counter()
+            value = decode(serialized_value)
+            decode_duration.observe(time.perf_counter() - started_at)
+
+            self.remember(key, value)
+            return value
+
+    # Store a value in memory and schedule it to be written back to the database, returning the size of its serialized value. Values are JSON unless the caller provides its own encoder.
+    def put(self, key, value, encode=json.dumps):
+
+        # Serialize the value right away, so that later changes made by the caller can't race with the flush.
+        started_at = time.perf_counter()
+        serialized_value = encode(value)
+        encode_duration.observe(time.perf_counter() - started_at)
+
+        with self.lock:
+            self.remember(key, value)
+            self.pending[key] = serialized_value
+
+            # Wake the flusher early if too many values are waiting to be written.
+            if len(self.pending) >= self.flush_threshold:
+                self.wake.set()
+
+        return len(serialized_value)
+
+    # Remove a value from memory and schedule it to be removed from the database.
+    def delete(self, key):
+
+        with self.lock:
+            self.cache.pop(key, None)
+            self.pending[key] = None
+
+    # List every key in the database, including those that haven't been written yet.
+    def keys(self):
+
+        with self.lock:
+
+            keys = set(key.decode() if isinstance(key, bytes) else key for key in self.submit(lambda: list(self.open().keys())).result())
+
+            for key, serialized_value in self.pending.items():
+
+                if serialized_value is None:
+                    keys.discard(key)
+
+                else:
+                    keys.add(key)
+
+        return keys
+
+    # Keep a decoded value in memory, evicting the least recently used values beyond our limit. Callers must hold the lock.
+    def remember(self, key, value):
+
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+
+        # Evicted values that haven't been written yet stay available in the pending writes until the next flush.
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # Write every pending value back to the database.
+    def flush(self):
+
+        with self.lock:
+
+            if not self.pending:
+                return
+
+            # Queue the write while holding the lock, so that any read queued after this point sees the new values.
+            items = self.pending
+            self.pending = {}
+            future = self.submit(self.write, items)
+
+        # If the write fails, we'll keep its values pending so that the next flush retries them, unless they've been superseded since.
+        try:
+            future.result()
+
+        except Exception:
+
+            with self.lock:
+                for key, serialized_value in items.items():
+                    self.pending.setdefault(key, serialized_value)
+
+            raise
+
+    # Flush pending values on an interval, or sooner if the dirty-count threshold is reached.
+    def flush_loop(self):
+
+        while not self.closed:
+
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+
+            try:
+                self.flush()
+
+            # A failed flush leaves its values unwritten, but the flusher itself must keep running.
+            except Exception:
+                pass
+
+    # Flush everything and release the database handle.
+    def close(self):
+
+        # A process forked from the one that created the storage layer inherits its exit handlers, but not the thread that would close it, so it leaves closing to that process.
+        if self.closed or self.pid != os.getpid():
+            return
+
+        self.closed = True
+        self.wake.set()
+        self.flush()
+
+        def close_database():
+
+            if self.database is not None:
+                self.database.close()
+                self.database = None
+
+        self.submit(close_database).result()
+
+# Store the process-wide storage layer.
+storage = None
+storage_lock = threading.Lock()
+
+# Retrieve the process-wide storage layer, creating it on first use.
+def get_storage():
+
+    global storage
+
+    # Worker processes forked from a parent don't inherit its threads, so each process needs its own storage layer.
+    if storage is not None and storage.pid == os.getpid():
+        return storage
+
+    with storage_lock:
+
+        if storage is None or storage.pid != os.getpid():
+            storage = Storage()
+            atexit.register(storage.close)
+
+    return storage
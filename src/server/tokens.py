@@ -0,0 +1,197 @@
+'''
+
+    We aim to authenticate clients against a registry of tokens that's loaded from a file and reloaded whenever the file changes, without restarting the server.
+
+    Tokens are looked up by their SHA-256 digest in a dictionary, so a lookup costs the same however many tokens are registered, and the file may hold digests in place of the tokens themselves.
+
+    A token is a client's secret, so it's never shown to anyone else. Clients are known to others, such as dashboards and exports, by an opaque identifier derived from the digest. Tokens may also be granted scopes, which allow them to read about the whole fleet rather than only report about their own client.
+
+'''
+
+import hashlib, json, os, sys, threading, time
+
+# Import the parser of rate limits, such as "60 per hour".
+from limits import parse
+
+# Import our configuration.
+import config
+
+# Define the scopes a token may be granted. A token with the "read" scope may query and watch the whole fleet, and one with the "admin" scope may also export it.
+scopes = ("read", "admin")
+
+# Define the scopes each scope implies.
+implied_scopes = {
+
+    "read": ("read",),
+    "admin": ("read", "admin")
+
+}
+
+# Define the character that separates a token from the rest of the storage keys of its record, which a token therefore can't contain, or its keys couldn't be told apart from those of another token.
+key_separator = ":"
+
+# Define the tokens we accept when there's no registry file, which is only fit for development.
+default_tokens = [
+
+    {"token": "development_key_1", "scopes": ["admin"]}
+
+]
+
+# Retrieve the digest a token is registered under.
+def digest_of(token):
+    return hashlib.sha256(token.encode()).digest()
+
+# Retrieve the opaque identifier of a client from the digest of its token, which is how the client is known to anyone but itself.
+def identifier_of_digest(digest):
+    return digest[:16].hex()
+
+# Retrieve the opaque identifier of a client from its token.
+def identifier_of(token):
+    return identifier_of_digest(digest_of(token))
+
+# Parse a rate limit, returning None if it's empty, which means the token isn't limited.
+def parse_rate_limit(rate_limit):
+    return parse(rate_limit) if rate_limit else None
+
+# Parse the scopes granted to a token, returning every scope they imply.
+def parse_scopes(granted):
+
+    if not isinstance(granted, list) or not all(scope in scopes for scope in granted):
+        raise ValueError("The scopes must be a list of any of " + ", ".join(scopes) + ".")
+
+    return frozenset(implied for scope in granted for implied in implied_scopes[scope])
+
+# Parse the entries of a registry, each of which is either a token or an object of the "token" or its "sha256" digest in hexadecimal, and optionally the "rate_limit" it's held to in place of the default and the "scopes" it's granted. Returns a dictionary mapping the digest of each token to its entry.
+def parse_entries(definitions):
+
+    if not isinstance(definitions, list):
+        raise ValueError("The token registry must be a list.")
+
+    default_rate_limit = parse_rate_limit(config.token_rate_limit)
+    entries = {}
+
+    for index, definition in enumerate(definitions):
+
+        if isinstance(definition, str):
+            definition = {"token": definition}
+
+        if not isinstance(definition, dict) or ("token" in definition) == ("sha256" in definition):
+            raise ValueError("Entry " + str(index) + " of the token registry must be a token or an object of either its \"token\" or its \"sha256\" digest.")
+
+        try:
+            digest = digest_of(definition["token"]) if "token" in definition else bytes.fromhex(definition["sha256"])
+            if "token" in definition and key_separator in definition["token"]:
+                raise ValueError("A token can't contain \"" + key_separator + "\".")
+            rate_limit = parse_rate_limit(definition["rate_limit"]) if "rate_limit" in definition else default_rate_limit
+            granted = parse_scopes(definition.get("scopes", []))
+
+        except (TypeError, ValueError, AttributeError) as error:
+            raise ValueError("Entry " + str(index) + " of the token registry isn't valid: " + str(error))
+
+        if len(digest) != hashlib.sha256().digest_size:
+            raise ValueError("Entry " + str(index) + " of the token registry has a digest of the wrong length.")
+
+        # The rate limits of a token are kept under its client's identifier, so that the tokens themselves are never stored.
+        entries[digest] = {
+
+            "key": identifier_of_digest(digest),
+            "rate_limit": rate_limit,
+            "scopes": granted
+
+        }
+
+    return entries
+
+# Define a class to represent the registry of tokens.
+class Registry:
+
+    def __init__(self, path=config.tokens_path):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Store what the file looked like when we last loaded it and when we last checked it, so that we only reload it when it's changed and only check it every so often.
+        self.signature = None
+        self.checked_at = time.monotonic()
+
+        # Remember which process loaded the registry.
+        self.pid = os.getpid()
+
+        # A mistake in the registry stops the server from starting, rather than turning every client away.
+        self.entries = self.load()
+
+    # Retrieve what the file looks like, or None if it doesn't exist.
+    def stat(self):
+
+        try:
+            status = os.stat(self.path)
+
+        except FileNotFoundError:
+            return None
+
+        return (status.st_mtime_ns, status.st_size, status.st_ino)
+
+    # Load the registry from the file, or the default tokens if there isn't one.
+    def load(self):
+
+        self.signature = self.stat()
+        if self.signature is None:
+            return parse_entries(default_tokens)
+
+        with open(self.path) as file:
+            return parse_entries(json.load(file))
+
+    # Reload the registry if the file has changed since we last checked it. A mistake in the changed file leaves the registry as it was, as does removing the file, so that the development token is only ever accepted by a server started without one.
+    def refresh(self):
+
+        with self.lock:
+
+            self.checked_at = time.monotonic()
+            signature = self.stat()
+
+            if signature == self.signature:
+                return
+
+            if signature is None:
+                self.signature = None
+                print("The token registry was removed, so it was left as it was.", file=sys.stderr)
+                return
+
+            try:
+                self.entries = self.load()
+
+            except (OSError, ValueError) as error:
+                print("Couldn't reload the token registry, so it was left as it was: " + str(error), file=sys.stderr)
+
+    # Retrieve the entry of a token, or None if it isn't registered. Tokens registered by their digest can't be checked for the key separator until they're presented, so a token containing it is never accepted.
+    def lookup(self, token):
+
+        if time.monotonic() - self.checked_at >= config.tokens_reload_interval:
+            self.refresh()
+
+        if key_separator in token:
+            return None
+
+        return self.entries.get(digest_of(token))
+
+    def __len__(self):
+        return len(self.entries)
+
+# Store the process-wide registry.
+registry = None
+registry_lock = threading.Lock()
+
+# Retrieve the process-wide registry, loading it on first use.
+def get_registry():
+
+    global registry
+
+    if registry is not None and registry.pid == os.getpid():
+        return registry
+
+    with registry_lock:
+
+        if registry is None or registry.pid != os.getpid():
+            registry = Registry()
+
+    return registry
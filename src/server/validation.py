@@ -0,0 +1,132 @@
+'''
+
+    We aim to validate request bodies against declarative schemas, each compiled once into a function that accepts a valid body with as little work as possible and reports every problem with an invalid one at once.
+
+'''
+
+import math
+
+# Define the error raised when a body doesn't match its schema, which carries every problem that was found. It's a ValueError so that it's handled like any other invalid request.
+class ValidationError(ValueError):
+
+    def __init__(self, errors):
+
+        super().__init__(" ".join(errors))
+        self.errors = errors
+
+    # Retrieve the problems prefixed by where the body is held in a larger one, such as "cpu", so that a problem with a field reads "cpu.load ..." and one with the body itself reads "cpu: ...".
+    def prefixed(self, prefix):
+        return [prefix + (": " if error == not_an_object else ".") + error for error in self.errors]
+
+# Define the problem reported when a body isn't an object at all.
+not_an_object = "Expected an object in the request."
+
+# Define a class to represent a field of a schema.
+class Field:
+
+    def __init__(self, types, description, nullable=False, schema=None, finite=False):
+
+        # Store the types the field's value may have, how to describe them in an error, whether the value may be null and whether a number must be finite.
+        self.types = types
+        self.description = description
+        self.nullable = nullable
+        self.finite = finite
+
+        # Fields holding an object validate it against a schema of their own, which is checked inline by the schema holding them and by its own validator when reporting problems.
+        self.schema = schema
+        self.validate = None if schema is None else compile_schema(schema)
+
+# Define the kinds of field a schema may declare. Numbers are floating point, as integers are declared separately, and must be finite, as exports and the JSON we respond with can't hold anything else.
+def string(nullable=False):
+    return Field(str, "a string", nullable)
+
+def integer(nullable=False):
+    return Field(int, "an integer", nullable)
+
+def number(nullable=False):
+    return Field(float, "a number", nullable, finite=True)
+
+def obj(schema, nullable=False):
+    return Field(dict, "an object", nullable, schema)
+
+# Compile a schema, which maps the name of each field to its declaration, into a function that returns a copy of a body holding only the schema's fields or raises a ValidationError.
+def compile_schema(schema):
+
+    fields = list(schema.items())
+
+    # Find every problem with a body. This only runs once the compiled check has failed, so it can afford to be thorough rather than fast.
+    def report(body):
+
+        if not isinstance(body, dict):
+            raise ValidationError([not_an_object])
+
+        errors = []
+        for name, field in fields:
+
+            if name not in body:
+                errors.append(name + " is missing from the request.")
+
+            elif body[name] is None:
+
+                if not field.nullable:
+                    errors.append(name + " can't be null.")
+
+            elif not isinstance(body[name], field.types):
+                errors.append(name + " must be " + field.description + ".")
+
+            elif field.finite and not math.isfinite(body[name]):
+                errors.append(name + " must be finite.")
+
+            elif field.validate is not None:
+
+                try:
+                    field.validate(body[name])
+
+                except ValidationError as error:
+                    errors += error.prefixed(name)
+
+        raise ValidationError(errors)
+
+    # Generate the source of a function that reads every field, including those of nested objects, checks all of them in a single expression and builds the result, handing over to the thorough report as soon as anything is wrong.
+    namespace = {"report": report, "isfinite": math.isfinite}
+    reads, condition, result = generate(schema, "body", "", "        ", namespace)
+
+    source = ["def validate(body):", "    try:"] + reads
+    source += ["    except Exception:", "        report(body)"]
+    source += ["    if not " + condition + ":", "        report(body)"]
+    source.append("    return " + result)
+
+    exec("\n".join(source), namespace)
+    return namespace["validate"]
+
+# Generate the source that validates an object held in a variable against a schema, as the lines that read each of its fields into variables named with a suffix, the condition that holds if they're all valid and the expression that builds a copy of the object holding only the schema's fields. Nested objects are read and checked inline, so that validating them costs no more than validating their fields.
+def generate(schema, variable, suffix, indent, namespace):
+
+    reads = []
+    conditions = []
+    results = []
+
+    for position, (name, field) in enumerate(schema.items()):
+
+        field_suffix = suffix + "_" + str(position)
+        value = "value" + field_suffix
+        namespace["types" + field_suffix] = field.types
+        reads.append(indent + value + " = " + variable + "[" + repr(name) + "]")
+
+        condition = "isinstance(" + value + ", types" + field_suffix + ")"
+        result = value
+
+        if field.finite:
+            condition = "(" + condition + " and isfinite(" + value + "))"
+
+        # A nested object is only read once it's known not to be null, and any other value that isn't an object fails to be read.
+        if field.schema is not None:
+
+            nested_reads, nested_condition, result = generate(field.schema, value, field_suffix, indent + "    " if field.nullable else indent, namespace)
+            reads += [indent + "if " + value + " is not None:"] + nested_reads if field.nullable else nested_reads
+            condition = "(" + condition + " and " + nested_condition + ")"
+
+        conditions.append("(" + value + " is None or " + condition + ")" if field.nullable else condition)
+        results.append(repr(name) + ": " + ("(None if " + value + " is None else " + result + ")" if field.nullable else result))
+
+    return reads, "(" + " and ".join(conditions or ["True"]) + ")", "{" + ", ".join(results) + "}"
@@ -0,0 +1,52 @@
+'''
+
+    We aim to check that the alerts delivered to a receiver name clients by their identifier and never reveal their tokens.
+
+'''
+
+import json, os, shlex, sys, tempfile, time, unittest
+
+# Import the server's alerts.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+from alerts import Alerts, Rule, Sink
+from tokens import identifier_of
+
+# Define a test case to check the alerts delivered to a command.
+class DeliverAlertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Break a rule and then stop breaking it, so that an alert is delivered as it fires and again as it's resolved.
+    def test_payload_names_client_by_identifier(self):
+
+        path = os.path.join(self.directory.name, "alerts.jsonl")
+        command = shlex.join([sys.executable, "-c", "import sys; open(sys.argv[1], 'ab').write(sys.stdin.buffer.read() + b'\\n')", path])
+
+        sink = Sink(webhook="", command=command, queue_size=10, timeout=10)
+        alerts = Alerts([Rule("slow", "latency", ">", 0.5)], sink)
+
+        token = "a-secret-token"
+        alerts.observe(token, "latency", (1.0,), 100)
+        alerts.observe(token, "latency", (0.1,), 160)
+
+        deadline = time.time() + 10
+        while sink.statistics["delivered"] + sink.statistics["failed"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(sink.statistics["delivered"], 2)
+
+        with open(path) as file:
+            body = file.read()
+
+        self.assertNotIn(token, body)
+
+        delivered = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([alert["state"] for alert in delivered], ["firing", "resolved"])
+        self.assertTrue(all(alert["client"] == identifier_of(token) for alert in delivered))
+
+if __name__ == "__main__":
+    unittest.main()
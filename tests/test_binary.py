@@ -0,0 +1,60 @@
+'''
+
+    We aim to check that batch reports decode from the binary encoding into the same request bodies they were encoded from.
+
+'''
+
+import os, sys, unittest
+
+# Import the server's binary encoding.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import binary
+
+# Define a test case to check that batches survive a round trip through the binary encoding.
+class BatchRoundTripTest(unittest.TestCase):
+
+    # Encode a batch and decode it again, which must give back the same body.
+    def round_trip(self, body):
+        self.assertEqual(binary.decode(binary.encode(body, "batch"), "batch"), body)
+
+    def test_full_batch(self):
+
+        self.round_trip({
+
+            "token": "token",
+            "collected_at": 1760000000.5,
+            "latency": {"requested_at": 1760000000},
+            "echo": {"ping": "AMQ1ZGJ0dxgNsnX3ZqIe0TYNOWrvh2ZJGPXh1z-oPNE="},
+            "cpu": {"threads": 8, "cores": 4, "model": "x", "load": 1.5},
+            "memory": {"available": 10, "used": 5, "swap": None},
+            "interfaces": [{"name": "eth0", "ipv6": None, "ipv4": "10.0.0.2", "mac": "08:00:27:4e:66:a1"}],
+            "mounting_points": [{"path": "/", "used": 1, "available": 2}]
+
+        })
+
+    def test_empty_batch(self):
+
+        self.round_trip({
+
+            "token": "token",
+            "collected_at": None,
+            "latency": None,
+            "echo": None,
+            "cpu": None,
+            "memory": None,
+            "interfaces": [],
+            "mounting_points": []
+
+        })
+
+    # Messages laid out by an earlier version are turned away rather than misread.
+    def test_earlier_version(self):
+
+        message = bytearray(binary.encode({"token": "token", "cpu": {"threads": 8, "cores": 4, "model": "x", "load": 1.5}}, "batch"))
+        message[0] = 2
+
+        with self.assertRaises(ValueError):
+            binary.decode(bytes(message), "batch")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+'''
+
+    We aim to check that the fleet's indexes and summary are built from the stored records of every storage engine, and only ever updated with what's been committed.
+
+'''
+
+import os, sys, tempfile, time, unittest
+
+# Import the server's storage engines and fleet.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+from backends import KeyValueBackend
+from sqlite_backend import SQLiteBackend
+from storage import Storage
+from fleet import Fleet, index_values
+
+# Define a test case to check that building the fleet reads clients that have only reported some sections.
+class BuildFleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Store a client that has reported its processor but never its memory, and one that has reported both, then build the fleet from them.
+    def build(self, backend):
+
+        now = time.time()
+        cpu = {"threads": 8, "cores": 4, "model": "x", "load": 1.5}
+
+        backend.save("cpu_only", {"metadata": {"created_at": now, "updated_at": now}, "cpu": cpu})
+        backend.save("both", {"metadata": {"created_at": now, "updated_at": now}, "cpu": cpu, "memory": {"available": 10, "used": 5, "swap": None}})
+        backend.flush()
+
+        fleet = Fleet(backend)
+        self.assertTrue(fleet.ready.wait(10))
+
+        summary = fleet.summarize()
+        self.assertEqual(summary["hosts"], 2)
+        self.assertEqual(summary["cpu"]["reporting"], 2)
+        self.assertEqual(summary["memory"], {"total": 15, "used": 5, "reporting": 1})
+
+    def test_key_value_backend(self):
+
+        backend = KeyValueBackend(Storage(os.path.join(self.directory.name, "monitor.sqlite")))
+        try:
+            self.build(backend)
+
+        finally:
+            backend.close()
+
+    def test_sqlite_backend(self):
+
+        backend = SQLiteBackend(os.path.join(self.directory.name, "monitor.db"))
+        try:
+            self.build(backend)
+
+        finally:
+            backend.close()
+
+# Define a test case to check that the fleet is only updated once a transaction commits.
+class UpdateAfterCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.directory.name, "monitor.db"))
+
+    def tearDown(self):
+        self.backend.close()
+        self.directory.cleanup()
+
+    # Save a client's processor within a group, updating the fleet once it commits as records do, and fail the group if asked.
+    def save(self, fleet, fail):
+
+        now = time.time()
+        cpu = {"threads": 8, "cores": 4, "model": "x", "load": 1.5}
+
+        with self.backend.group():
+
+            self.backend.save("token", {"metadata": {"created_at": now, "updated_at": now}, "cpu": cpu})
+            self.backend.after_commit(lambda: fleet.update("token", index_values("cpu", cpu)))
+
+            if fail:
+                raise RuntimeError("The group failed.")
+
+    def test_rolled_back(self):
+
+        fleet = Fleet(self.backend)
+        self.assertTrue(fleet.ready.wait(10))
+
+        with self.assertRaises(RuntimeError):
+            self.save(fleet, True)
+
+        self.assertEqual(fleet.summarize()["cpu"]["reporting"], 0)
+
+        # Nothing is left waiting for the next transaction to commit either.
+        self.backend.save("other", {"metadata": {"created_at": 1, "updated_at": 1}})
+        self.assertEqual(fleet.summarize()["cpu"]["reporting"], 0)
+
+    def test_committed(self):
+
+        fleet = Fleet(self.backend)
+        self.assertTrue(fleet.ready.wait(10))
+
+        self.save(fleet, False)
+        self.assertEqual(fleet.summarize()["cpu"]["reporting"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+
+    We aim to check that samples arriving out of order, such as those replayed from a client's spool, are kept in order by the history and rollups alike, and are moved by the next export.
+
+'''
+
+import os, sys, tempfile, time, unittest
+
+# Import the server's storage engines, histories and exports.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+from backends import KeyValueBackend
+from sqlite_backend import SQLiteBackend, SQLiteHistory
+from storage import Storage
+from history import History
+import export
+
+# Define a test case to check samples that arrive out of order on every storage engine.
+class OutOfOrderSampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Keep samples in a small history whose ring buffer wraps around, checking that older samples are put in order until they're beyond its capacity.
+    def keep_in_order(self, history):
+
+        for timestamp in (10, 20, 30, 40):
+            self.assertTrue(history.append("token", "cpu", timestamp, (1.0,)))
+
+        self.assertTrue(history.append("token", "cpu", 25, (2.0,)))
+        self.assertEqual([sample[0] for sample in history.query("token", "cpu")][-4:], [20, 25, 30, 40])
+
+        for timestamp in range(50, 150, 10):
+            self.assertTrue(history.append("token", "cpu", timestamp, (1.0,)))
+
+        self.assertFalse(history.append("token", "cpu", 5, (1.0,)))
+        self.assertNotIn(5, [sample[0] for sample in history.query("token", "cpu")])
+
+    # Keep a sample collected before the previous one in the history and rollups, then export it after a watermark that's later than when it was collected.
+    def replay(self, backend):
+
+        now = int(time.time())
+        backend.save("token", {"metadata": {"created_at": now, "updated_at": now}})
+
+        for timestamp in (now - 60, now - 600):
+            self.assertTrue(backend.history.append("token", "cpu", timestamp, (1.0,)))
+            backend.rollups.add("token", "cpu", timestamp, (1.0,))
+
+        backend.flush()
+
+        self.assertEqual([sample[0] for sample in backend.history.query("token", "cpu")], [now - 600, now - 60])
+        self.assertEqual(sum(bucket[-1] for bucket in backend.rollups.query("token", "cpu", 60)), 2)
+
+        # Both samples arrived now, so an export since a watermark before now moves them, one since now doesn't, and one up to a watermark before now leaves them to the next.
+        exported = lambda watermark, since: sorted(row["timestamp"] for row in export.rows(backend, watermark, since=since, include=("samples",)))
+        self.assertEqual(exported(now + 1, now - 30), [now - 600, now - 60])
+        self.assertEqual(exported(now + 1, now + 1), [])
+        self.assertEqual(exported(now - 5, None), [])
+
+    def test_key_value_backend(self):
+
+        storage = Storage(os.path.join(self.directory.name, "monitor.sqlite"))
+        backend = KeyValueBackend(storage)
+        try:
+            self.keep_in_order(History(storage, chunk_size=2, capacity=4, namespace="small"))
+            self.replay(backend)
+
+        finally:
+            backend.close()
+
+    def test_sqlite_backend(self):
+
+        backend = SQLiteBackend(os.path.join(self.directory.name, "monitor.db"))
+        try:
+            self.keep_in_order(SQLiteHistory(backend, chunk_size=2, capacity=4, namespace="small"))
+            self.replay(backend)
+
+        finally:
+            backend.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+'''
+
+    We aim to check that audit logs are compacted without waiting for a client to log another event.
+
+'''
+
+import os, sys, tempfile, time, unittest
+
+# Import the server's storage engines and maintenance.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+from backends import KeyValueBackend
+from sqlite_backend import SQLiteBackend
+from storage import Storage
+import maintenance
+
+# Define a test case to check that expired audit events are dropped by compaction alone.
+class CompactAuditLogsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Log an expired and a recent event for a client, then compact every audit log without logging anything else, returning the events that are left.
+    def compact(self, backend):
+
+        now = time.time()
+        backend.save("token", {"metadata": {"created_at": now, "updated_at": now}})
+
+        backend.audit_log.max_age = 60
+        backend.audit_log.append("token", {"timestamp": now - 3600, "event": "cpu_updated", "description": "Expired."})
+        backend.audit_log.append("token", {"timestamp": now, "event": "cpu_updated", "description": "Recent."})
+        backend.flush()
+
+        self.assertEqual(maintenance.compact_audit_logs(backend), 1)
+        return [entry["description"] for entry in backend.audit_log.entries("token")]
+
+    def test_key_value_backend(self):
+
+        backend = KeyValueBackend(Storage(os.path.join(self.directory.name, "monitor.sqlite")))
+        try:
+            self.assertEqual(self.compact(backend), ["Recent."])
+
+        finally:
+            backend.close()
+
+    def test_sqlite_backend(self):
+
+        backend = SQLiteBackend(os.path.join(self.directory.name, "monitor.db"))
+        try:
+            self.assertEqual(self.compact(backend), ["Recent."])
+
+        finally:
+            backend.close()
+
+if __name__ == "__main__":
+    unittest.main()
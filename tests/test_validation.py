@@ -0,0 +1,51 @@
+'''
+
+    We aim to check that compiled schemas turn away numbers that aren't finite, at any depth, and that problems are prefixed by where they were found.
+
+'''
+
+import os, sys, unittest
+
+# Import the server's validation.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "server"))
+import validation
+
+# Define a test case to check the numbers a schema accepts.
+class FiniteNumberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.validate = validation.compile_schema({"load": validation.number(), "nested": validation.obj({"load": validation.number(nullable=True)})})
+
+    def test_finite_numbers(self):
+        self.assertEqual(self.validate({"load": 1.5, "nested": {"load": None}}), {"load": 1.5, "nested": {"load": None}})
+
+    def test_non_finite_numbers(self):
+
+        for value in (float("nan"), float("inf"), float("-inf")):
+
+            with self.assertRaises(validation.ValidationError) as context:
+                self.validate({"load": value, "nested": {"load": value}})
+
+            self.assertEqual(context.exception.errors, ["load must be finite.", "nested.load must be finite."])
+
+# Define a test case to check how problems with a body held in a larger one are prefixed.
+class PrefixedErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.validate = validation.compile_schema({"load": validation.number()})
+
+    def prefixed(self, body):
+
+        with self.assertRaises(validation.ValidationError) as context:
+            self.validate(body)
+
+        return context.exception.prefixed("cpu")
+
+    def test_field_problem(self):
+        self.assertEqual(self.prefixed({}), ["cpu.load is missing from the request."])
+
+    def test_object_problem(self):
+        self.assertEqual(self.prefixed(5), ["cpu: Expected an object in the request."])
+
+if __name__ == "__main__":
+    unittest.main()